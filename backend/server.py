@@ -1,32 +1,88 @@
 # backend/server.py
 import asyncio
 import uvicorn
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse, FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uuid
 import os
 import sys
 import time
+import threading
+from contextlib import asynccontextmanager
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 
 # ensure project root is importable
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# try import the pipeline; if it fails, raise a clear error
-try:
-    from scripts.harmonia_pop_pipeline import full_run
-except Exception as e:
-    # give a clear message in server logs and re-raise
-    print("Failed to import harmonica_pop_pipeline:", e)
-    raise
+# the pipeline pulls in librosa / torch / torchcrepe: import it lazily so the
+# server binds quickly, and report readiness only once the models are warm
+from scripts.worker_pool import WorkerPool, configured_workers, warm_models
+from scripts.resources import ResourceManager
+from scripts.job_store import JobStore, request_key, seed_for
+from scripts.cancellation import CancelToken, JobCancelled
+from scripts.admission import AdmissionController, Rejected, estimate_cost
+from scripts.extract_stems_demucs import resolve_separation
+from scripts.features import resolve_tier
+from scripts.song_index import SongIndex
+from scripts.styles import available_styles
 
 # ───────────────────────────────
 BASE_OUT = "output"
 LOG_SUBSCRIBERS = []  # simple in-memory SSE queue
+SERVER_STARTED = time.perf_counter()
+STATE = {"ready": False, "pool": None, "warmup": None, "startup_seconds": None, "error": None}
+# one job slot per pool worker (or HARMONIA_MAX_JOBS in-process); each job gets cpus // max_jobs threads
+RESOURCES = ResourceManager(max_jobs=configured_workers() or None)
+# persistent jobs + stage checkpoints (SQLite, HARMONIA_JOB_DB)
+JOBS = JobStore()
+# catalog of analysed songs, filled as jobs finish (SQLite, HARMONIA_INDEX_DB)
+CATALOG = SongIndex()
+BACKGROUND = set()  # references to running retry tasks
+TOKENS = {}         # job_id -> CancelToken of jobs running in this process
+TICKETS = {}        # job_id -> admission Ticket of jobs queued or running in this process
+INFLIGHT = {}       # request key -> _Flight (coalesces identical concurrent requests)
+# per-user / global limits and weighted fair order; one running slot per job slot
+ADMISSION = AdmissionController(max_running=RESOURCES.max_jobs)
 
-app = FastAPI()
+def _pipeline():
+    try:
+        from scripts import harmonia_pop_pipeline
+    except Exception as e:
+        # give a clear message in server logs and re-raise
+        print("Failed to import harmonica_pop_pipeline:", e)
+        raise
+    return harmonia_pop_pipeline
+
+def _warm_up():
+    """Runs in a background thread at startup: warm models (in-process or in the pool)."""
+    try:
+        workers = configured_workers()
+        if workers > 0:
+            pool = WorkerPool(workers, threads_per_worker=RESOURCES.threads_per_job)
+            STATE["warmup"] = pool.prewarm()
+            STATE["pool"] = pool
+        else:
+            STATE["warmup"] = warm_models()
+        STATE["startup_seconds"] = time.perf_counter() - SERVER_STARTED
+        STATE["ready"] = True
+        print(f"[STARTUP] ready in {STATE['startup_seconds']:.2f}s (workers={workers})")
+    except Exception as e:
+        STATE["error"] = str(e)
+        print("[STARTUP] warm-up failed:", e)
+
+@asynccontextmanager
+async def lifespan(_app):
+    n = JOBS.mark_interrupted()
+    if n:
+        print(f"[STARTUP] {n} unfinished job(s) marked interrupted (POST /jobs/<id>/retry resumes them)")
+    threading.Thread(target=_warm_up, name="warmup", daemon=True).start()
+    yield
+    if STATE["pool"] is not None:
+        STATE["pool"].shutdown()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -55,6 +111,42 @@ def convert_page():
         return HTMLResponse(f.read(), status_code=200)
 
 
+@app.get("/health")
+def health():
+    # liveness: the process is up and serving HTTP
+    return {"status": "ok"}
+
+@app.get("/ready")
+def ready():
+    # readiness: models are loaded (in-process or in every pool worker)
+    body = {
+        "ready": STATE["ready"],
+        "workers": configured_workers(),
+        "startup_seconds": STATE["startup_seconds"],
+        "error": STATE["error"],
+    }
+    return JSONResponse(body, status_code=200 if STATE["ready"] else 503)
+
+@app.get("/config/resources")
+def resources_config():
+    # CPU / thread budget applied to every job
+    return {**RESOURCES.config(), "workers": configured_workers()}
+
+@app.get("/config/admission")
+def admission_config():
+    return ADMISSION.stats()
+
+def _client(request):
+    # X-User-Id identifies the submitter (falls back to the client address);
+    # X-Priority: interactive | normal | batch
+    user = request.headers.get("x-user-id") or (request.client.host if request.client else "anonymous")
+    return user, (request.headers.get("x-priority") or "").lower() or None
+
+def _busy(e):
+    log(f"[ADMISSION] rejected: {e.reason}")
+    return JSONResponse({"error": e.reason, "retry_after": e.retry_after}, status_code=429,
+                        headers={"Retry-After": str(e.retry_after)})
+
 @app.get("/stream")
 async def stream():
     return StreamingResponse(event_generator(), media_type="text/event-stream")
@@ -63,6 +155,67 @@ def log(msg: str):
     # sanitize message, push to queue
     LOG_SUBSCRIBERS.append(str(msg))
 
+async def _dispatch(job_id, song, out_dir, kwargs):
+    """Run one job off the event loop: in a warm pool worker if configured, else a thread."""
+    pool = STATE["pool"]
+    if pool is not None:
+        # workers are already pinned to their thread budget
+        return await asyncio.wrap_future(pool.submit(song, out_dir, job_id=job_id, **kwargs))
+    full_run = _pipeline().full_run
+    # in-process jobs get a token we can trip directly; workers poll the job store flag
+    token = TOKENS[job_id] = CancelToken(job_id=job_id, store=JOBS)
+
+    def _job():
+        with RESOURCES.job() as threads:
+            token.check()
+            return full_run(song, out_dir, threads=threads, job_id=job_id, token=token, **kwargs)
+    try:
+        return await asyncio.get_running_loop().run_in_executor(None, _job)
+    finally:
+        TOKENS.pop(job_id, None)
+
+def _cancel(job_id):
+    found = JOBS.request_cancel(job_id)
+    token = TOKENS.get(job_id)
+    if token is not None:
+        token.cancel()
+    ticket = TICKETS.get(job_id)
+    if ticket is not None:
+        ADMISSION.cancel(ticket)    # still queued: give the place back now
+    return found
+
+class _Flight:
+    """One running job shared by every identical request waiting on it."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.clients = set()
+        self.task = None
+
+async def _cancel_on_disconnect(request, flight):
+    # closing the page (or aborting the fetch) cancels the run once no
+    # other identical request is still waiting for it
+    while True:
+        await asyncio.sleep(1.0)
+        if await request.is_disconnected():
+            flight.clients.discard(id(request))
+            if not flight.clients:
+                log(f"[PIPELINE] client gone, cancelling job {flight.job_id}")
+                _cancel(flight.job_id)
+            return
+
+async def _run_flight(key, flight, ticket, song, out_dir, kwargs):
+    try:
+        await ADMISSION.wait(ticket)    # queued until it is this job's turn
+        res = await _dispatch(flight.job_id, song, out_dir, kwargs)
+        if JOBS.get_job(flight.job_id)["status"] == "done":
+            JOBS.put_result(key, flight.job_id, res)
+        return res
+    finally:
+        ADMISSION.release(ticket)
+        INFLIGHT.pop(key, None)
+        TICKETS.pop(flight.job_id, None)
+
 @app.post("/upload/song")
 async def upload_song(file: UploadFile = File(...)):
     uid = str(uuid.uuid4())[:8]
@@ -76,6 +229,7 @@ async def upload_song(file: UploadFile = File(...)):
 # backend/server.py  (only changed run_arrange signature & return payload)
 @app.post("/run/arrange")
 async def run_arrange(
+    request: Request,
     song: str = Form(...),
     style: str = Form("poprock"),
     piano: float = Form(1.0),
@@ -84,15 +238,16 @@ async def run_arrange(
     synth: float = Form(1.0),
     drums: float = Form(1.0),
     autotune_mode: str = Form("medium"),   # NEW: 'subtle'|'medium'|'hard'|'all'
+    styles: str = Form(""),                # optional comma-separated list: render several styles in one run
+    separation: str = Form("quality"),     # 'quality' (4-stem demucs) | 'fast' (vocal split only)
+    analysis_tier: str = Form("full"),     # 'full' (CQT chroma) | 'fast' (STFT chroma at 11 kHz)
 ):
     try:
-        uid = int(time.time())
-        out_dir = os.path.join(BASE_OUT, f"run_{uid}")
-        os.makedirs(out_dir, exist_ok=True)
-
-        log(f"[PIPELINE] Style chosen: {style}")
+        style_list = [x.strip() for x in styles.split(",") if x.strip()]
+        log(f"[PIPELINE] Style chosen: {', '.join(style_list) or style}")
         log(f"[PIPELINE] Autotune mode: {autotune_mode}")
-        log("[PIPELINE] Starting arrangement...")
+        log(f"[PIPELINE] Separation: {separation}")
+        log(f"[PIPELINE] Analysis tier: {analysis_tier}")
 
         mixer = {
             "piano": float(piano),
@@ -103,27 +258,202 @@ async def run_arrange(
         }
 
         # full_run now accepts autotune_mode
-        res = full_run(song, out_dir, style=style, mixer=mixer, autotune_mode=autotune_mode)
+        kwargs = dict(style=style, mixer=mixer, autotune_mode=autotune_mode, styles=style_list or None,
+                      separation=resolve_separation(separation), analysis_tier=resolve_tier(analysis_tier))
+        # identical requests (same song contents + parameters) share one result
+        key = request_key(song, kwargs)
+        hit = JOBS.cached_result(key)
+        if hit is not None:
+            log(f"[PIPELINE] Cached result of job {hit['job_id']}")
+            log("__PIPELINE_DONE__")
+            return _arrange_payload(hit["job_id"], hit["result"], style, mixer, autotune_mode, cached=True)
+
+        flight = INFLIGHT.get(key)
+        if flight is None:
+            user, priority = _client(request)
+            try:
+                ticket = ADMISSION.admit(user, estimate_cost(song), priority)
+            except Rejected as e:
+                return _busy(e)
+            # one directory per job: concurrent jobs write fixed-name outputs
+            job_id = uuid.uuid4().hex[:12]
+            out_dir = os.path.join(BASE_OUT, f"run_{job_id}")
+            os.makedirs(out_dir, exist_ok=True)
+            # humanize jitter seeded from the request, so the cached result is the result
+            kwargs["seed"] = seed_for(key)
+            flight = INFLIGHT[key] = _Flight(JOBS.create_job(song, out_dir, kwargs, job_id=job_id))
+            TICKETS[job_id] = ticket
+            flight.task = asyncio.create_task(_run_flight(key, flight, ticket, song, out_dir, kwargs))
+            log(f"[PIPELINE] Job {flight.job_id}")
+            log("[PIPELINE] Starting arrangement...")
+        else:
+            log(f"[PIPELINE] Joining running job {flight.job_id}")
+
+        flight.clients.add(id(request))
+        watcher = asyncio.create_task(_cancel_on_disconnect(request, flight))
+        try:
+            res = await asyncio.shield(flight.task)
+        finally:
+            watcher.cancel()
+            flight.clients.discard(id(request))
 
         log("[PIPELINE] Completed.")
         log("__PIPELINE_DONE__")
+        return _arrange_payload(flight.job_id, res, style, mixer, autotune_mode)
 
-        # res contains keys: 'midi','instruments_wav','vocals', 'finals'
-        # vocals and finals can be dicts when autotune_mode=='all'
-        return {
-            "midi": res.get("midi"),
-            "instruments": res.get("instruments_wav"),
-            "vocals": res.get("vocals"),     # str or dict
-            "finals": res.get("finals"),     # str or dict
-            "style": style,
-            "mixer": mixer,
-            "autotune_mode": autotune_mode
-        }
-
+    except JobCancelled as e:
+        log(f"[PIPELINE] {e}")
+        return {"error": str(e), "cancelled": True}
     except Exception as e:
         log(f"[ERROR] {str(e)}")
         return {"error": str(e)}
 
+def _arrange_payload(job_id, res, style, mixer, autotune_mode, cached=False):
+    # res contains keys: 'midi','instruments','vocals', 'finals' (+ 'styles' for multi-style runs)
+    # vocals and finals can be dicts when autotune_mode=='all'
+    return {
+        "job_id": job_id,
+        "cached": cached,
+        "midi": res.get("midi"),
+        "instruments": res.get("instruments"),
+        "vocals": res.get("vocals"),     # str or dict
+        "finals": res.get("finals"),     # str or dict
+        "style": style,
+        "styles": res.get("styles"),     # {style: {midi, instruments, finals}} or None
+        "mixer": mixer,
+        "autotune_mode": autotune_mode,
+        "warnings": res.get("warnings") or [],   # optional stages that failed (e.g. synth)
+    }
+
+
+# ───────────────────────────────
+# Jobs: list / inspect / retry / cancel
+# ───────────────────────────────
+@app.get("/jobs")
+def list_jobs(status: str = None, limit: int = 100):
+    return {"jobs": JOBS.list_jobs(status=status, limit=limit)}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = JOBS.get_job(job_id, stages=True)
+    if job is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    return job
+
+async def _run_retry(job, ticket):
+    try:
+        async with ADMISSION.slot(ticket):
+            await _dispatch(job["id"], job["song"], job["out_dir"], job["params"])
+        log(f"[PIPELINE] Job {job['id']} retry completed.")
+    except JobCancelled as e:
+        log(f"[PIPELINE] {e}")
+    except Exception as e:
+        log(f"[ERROR] job {job['id']}: {e}")
+    finally:
+        TICKETS.pop(job["id"], None)
+
+@app.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str, request: Request):
+    # completed stages are skipped; only failed / missing ones run again
+    job = JOBS.get_job(job_id)
+    if job is None:
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    if job["status"] == "running":
+        return JSONResponse({"error": "job is running"}, status_code=409)
+    user, priority = _client(request)
+    try:
+        ticket = ADMISSION.admit(user, estimate_cost(job["song"]), priority)
+    except Rejected as e:
+        return _busy(e)
+    JOBS.prepare_retry(job_id)
+    TICKETS[job_id] = ticket
+    task = asyncio.create_task(_run_retry(job, ticket))
+    BACKGROUND.add(task)
+    task.add_done_callback(BACKGROUND.discard)
+    return {"job_id": job_id, "status": "queued"}
+
+@app.delete("/jobs/{job_id}")
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    # running stages stop at their next check; demucs / fluidsynth are killed;
+    # async so the admission queue is only touched from the event loop
+    if not _cancel(job_id):
+        return JSONResponse({"error": "job not found"}, status_code=404)
+    return {"job_id": job_id, "status": JOBS.get_job(job_id)["status"], "cancel": True}
+
+LIVE_FORMATS = {"f32", "s16"}
+LIVE_MAX_SR = 192000
+
+@app.websocket("/live")
+async def live(ws: WebSocket, sr: int = 16000, tempo: float = 120, groove: str = "poprock",
+               fmt: str = "f32", seed: int = None):
+    """
+    Live accompaniment. The client streams binary frames of mono PCM
+    (fmt=f32 little-endian float32, or s16) at `sr`; every frame is answered
+    with a JSON message of analysis + MIDI events (see live_arranger).
+    Frames of <= 100 ms keep the round trip under 200 ms. Send the text
+    message "stop" (or just close) to end the session.
+    """
+    await ws.accept()
+    if fmt not in LIVE_FORMATS or not 0 < sr <= LIVE_MAX_SR:
+        # refuse before LiveArranger sizes its filters from `sr`
+        await ws.send_json({"error": f"need fmt in {sorted(LIVE_FORMATS)} and 0 < sr <= {LIVE_MAX_SR}"})
+        await ws.close(code=1008)
+        return
+    from scripts.live_arranger import LiveArranger, decode_pcm
+    # librosa / numba warm-up happens here, before the first frame
+    arranger = await asyncio.to_thread(LiveArranger, sr=sr, tempo=tempo, groove=groove, seed=seed)
+    await ws.send_json({"ready": True, "sr": arranger.sr, "tempo": arranger.tempo})
+    try:
+        while True:
+            msg = await ws.receive()
+            if msg["type"] == "websocket.disconnect":
+                return
+            if msg.get("bytes"):
+                try:
+                    block = decode_pcm(msg["bytes"], fmt)
+                except ValueError as e:     # frame length not a multiple of the sample size
+                    await ws.send_json({"error": f"bad frame: {e}"})
+                    continue
+                # one session, frames in order: run each block off the loop and wait for it
+                out = await asyncio.to_thread(arranger.push, block)
+                await ws.send_json(out)
+            elif (msg.get("text") or "").strip() == "stop":
+                await ws.send_json(arranger.close())
+                await ws.close()
+                return
+    except WebSocketDisconnect:
+        pass
+
+# ───────────────────────────────
+# Catalog: songs indexed by finished jobs
+# ───────────────────────────────
+@app.get("/catalog")
+def catalog_search(key: str = None, tempo_min: float = None, tempo_max: float = None,
+                   vocal_low: float = None, vocal_high: float = None, limit: int = 50):
+    tempo = (tempo_min or 0.0, tempo_max or 1000.0) if tempo_min or tempo_max else None
+    vocal = (vocal_low or 0.0, vocal_high or 127.0) if vocal_low or vocal_high else None
+    try:
+        return {"songs": CATALOG.search(key=key, tempo=tempo, vocal_range=vocal, limit=limit)}
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+@app.get("/catalog/{song_id}/similar")
+def catalog_similar(song_id: str, n: int = 3, limit: int = 10):
+    if CATALOG.get(song_id) is None:
+        return JSONResponse({"error": "song not indexed"}, status_code=404)
+    return {"songs": CATALOG.similar_progressions(song_id, n=n, limit=limit)}
+
+@app.get("/catalog/{song_id}/compatible")
+def catalog_compatible(song_id: str, limit: int = 50):
+    if CATALOG.get(song_id) is None:
+        return JSONResponse({"error": "song not indexed"}, status_code=404)
+    return {"songs": CATALOG.compatible(song_id, limit=limit)}
+
+# arrangement styles: built-in templates + JSON templates in HARMONIA_STYLES_DIR
+@app.get("/styles")
+def list_styles():
+    return {"styles": available_styles()}
 
 @app.get("/download")
 def download_file(file: str):
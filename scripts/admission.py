@@ -0,0 +1,217 @@
+# scripts/admission.py
+"""
+Admission control and weighted fair scheduling for pipeline jobs.
+
+Every /run/arrange call asks the AdmissionController for a ticket:
+
+- queue limits: more than `max_queue` waiting jobs overall, or more than
+  `per_user_queue` for one user, is rejected (the server answers 429 with
+  a Retry-After estimated from recent job times)
+- concurrency limits: at most `max_running` jobs at once, and at most
+  `per_user_running` per user
+- order: start-time fair queueing. Each user's jobs get virtual tags
+
+      start  = max(virtual_time, user's previous finish)
+      finish = start + cost / weight
+
+  and the waiting job with the smallest finish tag runs next. A user who
+  submits fifty songs only advances their own tags, so other users' jobs
+  slot in between; the cost (audio duration) makes short jobs finish
+  first, and the priority weight (X-Priority) favours interactive work.
+
+A job cancelled while queued gives its place back at once (cancel());
+its waiter gets JobCancelled instead of a slot.
+
+The controller lives on the server's event loop; it is not thread-safe.
+
+    HARMONIA_MAX_QUEUE         waiting jobs overall (default 32)
+    HARMONIA_USER_QUEUE        waiting jobs per user (default 4)
+    HARMONIA_USER_CONCURRENCY  running jobs per user (default 1)
+"""
+
+import os
+import time
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+
+import soundfile as sf
+
+try:
+    from scripts.cancellation import JobCancelled
+except Exception:
+    from cancellation import JobCancelled
+
+PRIORITY_WEIGHTS = {
+    "interactive": 4.0,
+    "normal": 2.0,
+    "batch": 1.0,
+}
+DEFAULT_PRIORITY = "normal"
+MIN_COST = 5.0          # seconds of audio; keeps tiny clips from jumping every queue
+DEFAULT_SEC_PER_COST = 1.0
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def estimate_cost(song):
+    """Job cost in seconds of audio (falls back to the size of 16-bit stereo 44.1 kHz)."""
+    try:
+        return max(MIN_COST, float(sf.info(str(song)).duration))
+    except Exception:
+        try:
+            return max(MIN_COST, os.path.getsize(song) / (44100 * 2 * 2))
+        except OSError:
+            return MIN_COST
+
+
+class Rejected(Exception):
+    """Queue full; `retry_after` is a suggestion in seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = int(max(1, round(retry_after)))
+
+
+class Ticket:
+    __slots__ = ("user", "cost", "weight", "start", "finish", "seq", "event", "running", "started_at",
+                 "cancelled")
+
+    def __init__(self, user, cost, weight, start, finish, seq):
+        self.user = user
+        self.cost = cost
+        self.weight = weight
+        self.start = start
+        self.finish = finish
+        self.seq = seq
+        self.event = asyncio.Event()
+        self.running = False
+        self.started_at = None
+        self.cancelled = False
+
+
+class AdmissionController:
+    def __init__(self, max_running, per_user_running=None, max_queue=None, per_user_queue=None,
+                 weights=None):
+        self.max_running = max(1, int(max_running))
+        self.per_user_running = max(1, int(per_user_running or _env_int("HARMONIA_USER_CONCURRENCY", 1)))
+        self.max_queue = max(0, int(max_queue if max_queue is not None else _env_int("HARMONIA_MAX_QUEUE", 32)))
+        self.per_user_queue = max(0, int(per_user_queue if per_user_queue is not None
+                                         else _env_int("HARMONIA_USER_QUEUE", 4)))
+        self.weights = dict(weights or PRIORITY_WEIGHTS)
+        self.waiting = []
+        self.running = {}           # user -> running jobs
+        self.n_running = 0
+        self._vtime = 0.0
+        self._last_finish = {}      # user -> finish tag of their latest job
+        self._seq = itertools.count()
+        self._sec_per_cost = DEFAULT_SEC_PER_COST
+
+    # ---- admission ----
+    def admit(self, user, cost, priority=None):
+        """Queue a job or raise Rejected. Returns the job's Ticket."""
+        user = str(user or "anonymous")
+        queued_user = sum(1 for t in self.waiting if t.user == user)
+        # limits apply to jobs that would wait; a job that starts right away is not queued
+        must_wait = self.n_running >= self.max_running or self.running.get(user, 0) >= self.per_user_running
+        if must_wait and len(self.waiting) >= self.max_queue:
+            raise Rejected("server busy", self.retry_after())
+        if must_wait and queued_user >= self.per_user_queue:
+            raise Rejected("too many queued jobs for this user", self.retry_after(user))
+        weight = self.weights.get(priority or DEFAULT_PRIORITY, self.weights[DEFAULT_PRIORITY])
+        start = max(self._vtime, self._last_finish.get(user, 0.0))
+        finish = start + float(cost) / weight
+        self._last_finish[user] = finish
+        ticket = Ticket(user, float(cost), weight, start, finish, next(self._seq))
+        self.waiting.append(ticket)
+        self._schedule()
+        return ticket
+
+    def _schedule(self):
+        while self.n_running < self.max_running:
+            eligible = [t for t in self.waiting if self.running.get(t.user, 0) < self.per_user_running]
+            if not eligible:
+                return
+            t = min(eligible, key=lambda t: (t.finish, t.seq))
+            self.waiting.remove(t)
+            self._vtime = max(self._vtime, t.start)
+            self.running[t.user] = self.running.get(t.user, 0) + 1
+            self.n_running += 1
+            t.running = True
+            t.started_at = time.monotonic()
+            t.event.set()
+
+    async def wait(self, ticket):
+        """Block until the ticket holds a running slot; JobCancelled if it was cancelled while queued."""
+        await ticket.event.wait()
+        if ticket.cancelled:
+            raise JobCancelled("job cancelled while queued")
+
+    def cancel(self, ticket):
+        """Drop a queued ticket and wake its waiter. Running tickets are left alone; returns True if dropped."""
+        if ticket.running or ticket not in self.waiting:
+            return False
+        self._drop_queued(ticket)
+        ticket.cancelled = True
+        ticket.event.set()
+        self._schedule()
+        return True
+
+    def release(self, ticket):
+        """Free the ticket's slot, or drop it from the queue if it never ran. Idempotent."""
+        if ticket.running:
+            ticket.running = False
+            self.n_running -= 1
+            self.running[ticket.user] -= 1
+            if not self.running[ticket.user]:
+                del self.running[ticket.user]
+            elapsed = time.monotonic() - ticket.started_at
+            # EWMA of wall seconds per second of audio, for Retry-After
+            self._sec_per_cost = 0.8 * self._sec_per_cost + 0.2 * (elapsed / max(ticket.cost, 1e-6))
+        elif ticket in self.waiting:
+            # gave up while queued (cancelled, client gone)
+            self._drop_queued(ticket)
+        self._schedule()
+
+    def _drop_queued(self, ticket):
+        self.waiting.remove(ticket)
+        # a dropped job that was the user's latest gives back its share of virtual time;
+        # its start tag is where the user's previous job finished (or the clock was)
+        if self._last_finish.get(ticket.user) == ticket.finish:
+            self._last_finish[ticket.user] = ticket.start
+
+    @asynccontextmanager
+    async def slot(self, ticket):
+        """Wait for the ticket's turn, hold a running slot for the block."""
+        try:
+            await self.wait(ticket)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    # ---- introspection ----
+    def retry_after(self, user=None):
+        """Seconds until a slot is likely free for `user` (or anyone)."""
+        queued = [t for t in self.waiting if user is None or t.user == user]
+        backlog = sum(t.cost for t in queued) * self._sec_per_cost
+        lanes = self.per_user_running if user is not None else self.max_running
+        return max(1.0, backlog / lanes)
+
+    def stats(self):
+        return {
+            "max_running": self.max_running,
+            "per_user_running": self.per_user_running,
+            "max_queue": self.max_queue,
+            "per_user_queue": self.per_user_queue,
+            "running": self.n_running,
+            "queued": len(self.waiting),
+            "users_running": dict(self.running),
+            "sec_per_audio_sec": round(self._sec_per_cost, 3),
+            "weights": self.weights,
+        }
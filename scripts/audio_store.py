@@ -0,0 +1,237 @@
+# scripts/audio_store.py
+"""
+Decoded-audio store.
+
+Stems are read by several stages per job (analysis, CREPE, every autotune
+preset, the arrangers), each of which used to decode the WAV and resample
+it again. load_audio() decodes a file once per sample rate and keeps the
+mono float32 PCM as a .npy file keyed by the file's content hash:
+
+    <store>/<sha1>_<sr>.npy
+
+Later reads are np.load(mmap_mode="r") views - no decode, no resample, no
+copy. Other rates are resampled once per quality tier (resample.py) from the
+stored native-rate entry, <sha1>_<sr>_<quality>.npy, so the WAV itself is
+decoded at most once.
+
+ANALYSIS_SR is the one rate every analysis stage (chords, energy, tempo,
+CREPE, arrangers) works at.
+
+Views are read-only; copy before modifying in place.
+
+Entries are touched on every hit, and the store is pruned (at most once a
+minute per process, after a write) to its size and age limits, least
+recently used first; entries used in the last PRUNE_GRACE seconds are
+kept. Removing a file another job has mapped is safe: the mapping keeps the
+data until it is closed.
+
+    HARMONIA_AUDIO_STORE=<dir>        store location (default: <project>/cache/audio)
+    HARMONIA_AUDIO_STORE=off          disable (plain librosa.load)
+    HARMONIA_AUDIO_STORE_MAX_MB       size limit (default 4096; 0 = none)
+    HARMONIA_AUDIO_STORE_MAX_DAYS     drop entries unused this long (default 14; 0 = never)
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import librosa
+import soundfile as sf
+
+try:
+    from scripts.resample import resample, resolve_quality
+except Exception:
+    from resample import resample, resolve_quality
+
+ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_DIR = ROOT / "cache" / "audio"
+
+ANALYSIS_SR = 16000
+
+DEFAULT_MAX_MB = 4096
+DEFAULT_MAX_DAYS = 14
+PRUNE_INTERVAL = 60.0   # seconds between prunes in one process
+PRUNE_GRACE = 600.0     # entries written or used this recently are never pruned
+HASH_ENTRIES = 4096     # memoized content hashes (least recently used dropped)
+
+_HASHES = OrderedDict()     # (abspath, size, mtime_ns) -> sha1
+_LOCK = threading.Lock()
+_LAST_PRUNE = [0.0]
+
+
+def store_dir():
+    d = os.environ.get("HARMONIA_AUDIO_STORE", "")
+    if d.lower() in ("off", "0", "none"):
+        return None
+    return Path(d) if d else DEFAULT_DIR
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def content_hash(path, chunk=1 << 20):
+    """sha1 of the file contents, memoized on (path, size, mtime)."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _LOCK:
+        h = _HASHES.get(key)
+        if h is not None:
+            _HASHES.move_to_end(key)
+    if h is not None:
+        return h
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            sha.update(block)
+    h = sha.hexdigest()
+    with _LOCK:
+        _HASHES[key] = h
+        _HASHES.move_to_end(key)
+        while len(_HASHES) > HASH_ENTRIES:
+            _HASHES.popitem(last=False)
+    return h
+
+
+def native_rate(path):
+    try:
+        return int(sf.info(str(path)).samplerate)
+    except Exception:
+        return int(librosa.get_samplerate(str(path)))
+
+
+def _entry(root, digest, sr, quality=None):
+    if quality is None:
+        return root / f"{digest}_{int(sr)}.npy"
+    return root / f"{digest}_{int(sr)}_{quality}.npy"
+
+
+def _save(path, y):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, np.ascontiguousarray(y, dtype=np.float32))
+    os.replace(tmp, path)
+
+
+def _open(path, touch=False):
+    try:
+        y = np.load(path, mmap_mode="r", allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+    if touch:
+        try:
+            os.utime(path)      # mtime = last use, for prune_store
+        except OSError:
+            pass
+    return y
+
+
+def _readonly(view, y):
+    """The stored view, or `y` as a read-only float32 array if the entry could not be opened."""
+    if view is not None:
+        return view
+    y = np.ascontiguousarray(y, dtype=np.float32)
+    y.flags.writeable = False
+    return y
+
+
+def prune_store(root=None, max_bytes=None, max_age=None, grace=PRUNE_GRACE):
+    """
+    Remove store entries unused for `max_age` seconds, then the least
+    recently used ones until the store fits in `max_bytes` (defaults from
+    HARMONIA_AUDIO_STORE_MAX_MB / _MAX_DAYS; 0 = no limit). Entries used
+    within the last `grace` seconds are kept even over the size limit, so a
+    prune in another job cannot remove a file load_audio is about to open.
+    Returns the number of files removed.
+    """
+    root = Path(root) if root else store_dir()
+    if root is None or not root.is_dir():
+        return 0
+    if max_bytes is None:
+        max_bytes = _env_float("HARMONIA_AUDIO_STORE_MAX_MB", DEFAULT_MAX_MB) * (1 << 20)
+    if max_age is None:
+        max_age = _env_float("HARMONIA_AUDIO_STORE_MAX_DAYS", DEFAULT_MAX_DAYS) * 86400.0
+    entries = []
+    for f in root.glob("*.npy"):
+        try:
+            st = f.stat()
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, f))
+    entries.sort()                      # oldest use first
+    total = sum(e[1] for e in entries)
+    now = time.time()
+    removed = 0
+    for mtime, size, f in entries:
+        if now - mtime < grace:
+            break                       # this one and every later entry are in use
+        too_old = max_age > 0 and now - mtime > max_age
+        too_big = max_bytes > 0 and total > max_bytes
+        if not (too_old or too_big):
+            break
+        try:
+            f.unlink()
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+def _maybe_prune(root):
+    now = time.monotonic()
+    with _LOCK:
+        if now - _LAST_PRUNE[0] < PRUNE_INTERVAL:
+            return
+        _LAST_PRUNE[0] = now
+    try:
+        prune_store(root)
+    except OSError:
+        pass
+
+
+def load_audio(path, sr=None, quality=None):
+    """
+    Mono float32 signal of `path` at `sr` (None = native rate), like
+    librosa.load(path, sr=sr, mono=True). `quality` is the resample tier
+    (default: HARMONIA_RESAMPLE_QUALITY). Returns (read-only view, sr).
+    """
+    quality = resolve_quality(quality)
+    root = store_dir()
+    if root is None:
+        y, sr_native = librosa.load(str(path), sr=None, mono=True)
+        sr = int(sr or sr_native)
+        return resample(y, sr_native, sr, quality), sr
+
+    digest = content_hash(path)
+    sr_native = native_rate(path)
+    sr = int(sr or sr_native)
+    target = _entry(root, digest, sr, None if sr == sr_native else quality)
+    y = _open(target, touch=True)
+    if y is not None:
+        return y, sr
+
+    # fresh entries are re-opened as views; if one is gone already (pruned
+    # by another process), the array in hand is returned instead
+    native = _entry(root, digest, sr_native)
+    y_native = _open(native, touch=True)
+    if y_native is None:
+        y_native, _ = librosa.load(str(path), sr=None, mono=True)
+        _save(native, y_native)
+        y_native = _readonly(_open(native), y_native)
+    y = y_native
+    if sr != sr_native:
+        y = resample(y_native, sr_native, sr, quality)
+        _save(target, y)
+        y = _readonly(_open(target), y)
+    _maybe_prune(root)
+    return y, sr
@@ -18,7 +18,6 @@ Usage:
 """
 
 import os
-import math
 import inspect
 from typing import List, Tuple, Optional
 
@@ -29,6 +28,11 @@ import torch
 import torchcrepe
 from scipy.signal import savgol_filter, medfilt
 
+try:
+    from scripts.audio_store import load_audio
+except Exception:
+    from audio_store import load_audio
+
 # -----------------------
 # Utility: CREPE wrapper
 # -----------------------
@@ -261,8 +265,8 @@ def stem_to_midi_track(stem_path: str,
     Process a single audio stem into a pretty_midi.Instrument and detected chord segments.
     Returns (instrument, chord_segments)
     """
-    y, _ = librosa.load(stem_path, sr=sr)
-    audio_tensor = torch.tensor(y).unsqueeze(0)
+    y, _ = load_audio(stem_path, sr=sr)
+    audio_tensor = torch.tensor(np.asarray(y)).unsqueeze(0)
 
     # onsets + amplitude
     onsets, amp_env = detect_onsets_and_energy(y, sr, hop_length=hop_length)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# scripts/benchmark.py
+"""
+Benchmark suite for the Harmonica backend.
+
+Each benchmark prints one JSON line so results can be diffed between runs.
+
+    python scripts/benchmark.py startup            # cold import / warm-up times
+    python scripts/benchmark.py midi_write         # midi_writer vs pretty_midi (+ round trip check)
+    python scripts/benchmark.py analysis           # analysis tiers: speed + chord accuracy
+    python scripts/benchmark.py pitch              # CREPE contour + pitch correction on a detuned tone
+
+Benchmarks that also check correctness report "ok"; the script exits with
+status 1 if any of them is false.
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+
+def _timed_subprocess(code, repeat=3):
+    """Best-of-N wall time of a fresh interpreter running `code` from the project root."""
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", code], cwd=str(ROOT),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return round(best, 3)
+
+
+# -------------------------
+# Startup
+# -------------------------
+def bench_startup(repeat=3):
+    """
+    Cold-start costs, each in a fresh interpreter:
+      server_import  - import backend.server (what uvicorn does before binding)
+      pipeline_import - import the full pipeline (librosa, pretty_midi, ...)
+      warm_models    - pipeline import + librosa JIT + CREPE weights (time to ready)
+    """
+    res = {
+        "bench": "startup",
+        "server_import": _timed_subprocess("import backend.server", repeat),
+        "pipeline_import": _timed_subprocess("import scripts.harmonia_pop_pipeline", repeat),
+        "warm_models": _timed_subprocess("from scripts.worker_pool import warm_models; warm_models()", repeat),
+    }
+    return res
+
+
+# -------------------------
+# MIDI writing
+# -------------------------
+def bench_midi_write(repeat=3, minutes=5.0, tempo=117.0):
+    """
+    A dense synthetic arrangement (16th hats, strums, pads) written with
+    pretty_midi and with midi_writer. `identical` compares the bytes,
+    `round_trip` parses the fast file back with pretty_midi and compares
+    every note (ticks, pitch, velocity, program, drum flag); `rejects_bad`
+    checks that pitches / velocities outside 0..127 raise instead of being
+    written. ok needs all three.
+    """
+    import io
+    import numpy as np
+    import pretty_midi
+    from scripts.midi_writer import MidiSong
+
+    rng = np.random.default_rng(0)
+    dur = minutes * 60.0
+    step = 60.0 / tempo / 4
+    parts = [(0, "Piano", False, 0.5), (24, "Guitar", False, step * 2), (32, "Bass", False, 0.5),
+             (88, "Synth", False, 2.0), (0, "Drums", True, step)]
+    pm = pretty_midi.PrettyMIDI(initial_tempo=tempo)
+    song = MidiSong(initial_tempo=tempo)
+    for program, name, is_drum, every in parts:
+        start = np.repeat(np.arange(0.0, dur, every), 3) + rng.uniform(-0.01, 0.01, 3 * int(np.ceil(dur / every)))
+        pitch = rng.integers(36, 84, start.size)
+        end = start + rng.uniform(0.02, every, start.size)
+        vel = rng.integers(1, 128, start.size)
+        inst = pretty_midi.Instrument(program=program, name=name, is_drum=is_drum)
+        inst.notes = [pretty_midi.Note(int(v), int(p), float(s), float(e)) for p, s, e, v in zip(pitch, start, end, vel)]
+        pm.instruments.append(inst)
+        song.track(program, name, is_drum).add_notes(pitch, start, end, vel)
+
+    def _best(fn):
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            out = fn()
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        return out, round(best, 4)
+
+    def _pm_bytes():
+        buf = io.BytesIO()
+        pm.write(buf)
+        return buf.getvalue()
+
+    ref, t_pm = _best(_pm_bytes)
+    fast, t_fast = _best(song.to_bytes)
+    ref_back = pretty_midi.PrettyMIDI(io.BytesIO(ref))
+    try:
+        back = pretty_midi.PrettyMIDI(io.BytesIO(fast))
+    except Exception:
+        back = None             # unparsable output fails the round trip
+
+    def _notes(m):
+        return [(i.program, i.is_drum, i.name,
+                 sorted((m.time_to_tick(n.start), m.time_to_tick(n.end), n.pitch, n.velocity) for n in i.notes))
+                for i in m.instruments]
+
+    rejects_bad = True
+    for bad in ((128, 64), (60, 128), (-1, 64)):
+        probe = MidiSong(initial_tempo=tempo)
+        probe.track(0, "Probe").add_notes([bad[0]], [0.0], [0.5], [bad[1]])
+        try:
+            probe.to_bytes()
+            rejects_bad = False
+        except ValueError:
+            pass
+    identical = ref == fast
+    round_trip = back is not None and _notes(back) == _notes(ref_back)
+
+    return {
+        "bench": "midi_write",
+        "notes": int(sum(len(i.notes) for i in pm.instruments)),
+        "pretty_midi_s": t_pm,
+        "midi_writer_s": t_fast,
+        "speedup": round(t_pm / max(t_fast, 1e-9), 1),
+        "identical": identical,
+        "round_trip": round_trip,
+        "rejects_bad": rejects_bad,
+        "ok": identical and round_trip and rejects_bad,
+    }
+
+
+# -------------------------
+# Analysis tiers
+# -------------------------
+def _synthetic_song(minutes, sr, tempo, seed=0):
+    """
+    Triads (I-V-vi-IV, one chord per bar) with a wandering melody, a kick on
+    every beat and noise; returns (y, chord labels per bar, bar length).
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    bar = 4 * 60.0 / tempo
+    n_bars = int(minutes * 60.0 / bar)
+    progression = [(0, "maj"), (7, "maj"), (9, "min"), (5, "maj")]
+    labels, parts = [], []
+    t = np.arange(int(round(bar * sr))) / sr
+    kick = np.exp(-40.0 * np.mod(t, 60.0 / tempo)) * np.sin(2 * np.pi * 55.0 * t)
+    for i in range(n_bars):
+        root, q = progression[(i + rng.integers(0, 2) * 2) % 4] if i % 8 >= 4 else progression[i % 4]
+        labels.append(f"{root}:{q}")
+        notes = [48 + root, 60 + root, 60 + root + (4 if q == "maj" else 3), 60 + root + 7]
+        x = sum(np.sin(2 * np.pi * 440.0 * 2 ** ((m - 69) / 12.0) * t) for m in notes) / len(notes)
+        mel = 72 + root + rng.choice([0, 2, 4, 5, 7, 9], 4)
+        f = np.repeat(440.0 * 2 ** ((mel - 69) / 12.0), int(np.ceil(t.size / 4)))[:t.size]
+        x = x + 0.3 * np.sin(2 * np.pi * np.cumsum(f) / sr) + 0.3 * kick
+        parts.append(x)
+    y = np.concatenate(parts) * 0.3 + 0.01 * rng.standard_normal(n_bars * t.size)
+    return y.astype(np.float32), labels, bar
+
+
+def bench_analysis(repeat=1, minutes=5.0, tempo=112.0):
+    """
+    compute_analysis per tier on a synthetic song with known chords and tempo:
+    seconds (including the resample to the tier's rate; tempo tracking is
+    part of it), features_seconds (chroma + RMS only, what the tier changes),
+    chord accuracy (fraction of 100 ms steps labelled right), number of chord
+    segments and tempo error. `agreement` compares a tier's chords with the
+    full tier's.
+    """
+    import numpy as np
+    from scripts.song_analysis import compute_analysis
+    from scripts.features import ANALYSIS_TIERS, frame_features
+    from scripts.resample import resample
+
+    sr = ANALYSIS_TIERS["full"]["sr"]
+    y, truth, bar = _synthetic_song(minutes, sr, tempo)
+    grid = np.arange(0.0, len(truth) * bar, 0.1)
+    want = np.asarray(truth)[(grid // bar).astype(int)]
+
+    def _labels(chords):
+        out = np.full(grid.size, "", dtype=object)
+        for s, e, lab in chords:
+            out[(grid >= s) & (grid < e)] = lab
+        return out
+
+    def _best(fn):
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            out = fn()
+            dt = time.perf_counter() - t0
+            best = dt if best is None else min(best, dt)
+        return out, best
+
+    res = {"bench": "analysis", "minutes": minutes, "tiers": {}}
+    full_labels = None
+    for tier, opts in ANALYSIS_TIERS.items():
+        def _run():
+            x = y if opts["sr"] == sr else resample(y, sr, opts["sr"])
+            return x, compute_analysis(x, sr=opts["sr"], hop_length=opts["hop"], tier=tier)
+        (x, out), best = _best(_run)
+        _, feat_s = _best(lambda: frame_features(x, opts["sr"], opts["hop"], kind=opts["chroma"],
+                                                 n_fft=opts.get("n_fft")))
+        got = _labels(out["chords"])
+        full_labels = got if full_labels is None else full_labels
+        res["tiers"][tier] = {
+            "seconds": round(best, 3),
+            "features_seconds": round(feat_s, 3),
+            "chord_accuracy": round(float(np.mean(got == want)), 3),
+            "agreement": round(float(np.mean(got == full_labels)), 3),
+            "chord_segments": len(out["chords"]),
+            "tempo_error_bpm": round(abs(out["tempo"] - tempo), 2),
+        }
+    base = res["tiers"]["full"]
+    for tier in res["tiers"].values():
+        tier["speedup"] = round(base["seconds"] / max(tier["seconds"], 1e-9), 1)
+        tier["features_speedup"] = round(base["features_seconds"] / max(tier["features_seconds"], 1e-9), 1)
+    return res
+
+
+# -------------------------
+# Vocal pitch + correction
+# -------------------------
+def bench_pitch(repeat=1, seconds=3.0, hz=450.0):
+    """
+    A harmonic tone at `hz` (450 Hz is A4 + 39 cents) through the same path
+    as a vocal stem: song_analysis.vocal_pitch (CREPE) and
+    pitch_correct.correct_pitch (full strength, hard snap). ok when the
+    contour is in Hz around `hz`, the correction is non-zero and the
+    corrected tone sits on A4 (YIN estimate within 10 cents of 440 Hz).
+    """
+    import tempfile
+    import numpy as np
+    import librosa
+    import soundfile as sf
+    from scripts.song_analysis import vocal_pitch, SR
+    from scripts.pitch_correct import correct_pitch
+
+    t = np.arange(int(seconds * SR)) / SR
+    y = sum(np.sin(2 * np.pi * hz * k * t) / k for k in range(1, 6)).astype(np.float32) * 0.3
+    with tempfile.TemporaryDirectory() as d:
+        wav = os.path.join(d, "tone.wav")
+        sf.write(wav, y, SR)
+        t0 = time.perf_counter()
+        times, f0 = vocal_pitch(wav, use_cache=False)
+        crepe_s = time.perf_counter() - t0
+    voiced = f0[f0 > 0]
+    median = float(np.median(voiced)) if voiced.size else 0.0
+    t0 = time.perf_counter()
+    out, cents = correct_pitch(y, SR, (times, f0), retune_ms=0.0, amount=1.0)
+    correct_s = time.perf_counter() - t0
+    mid = out[int(0.5 * SR):-int(0.5 * SR)]
+    after = float(np.median(librosa.yin(mid, fmin=200, fmax=900, sr=SR)))
+    after_cents = 1200.0 * np.log2(after / 440.0)
+    return {
+        "bench": "pitch",
+        "crepe_s": round(crepe_s, 3),
+        "correct_s": round(correct_s, 3),
+        "median_f0_hz": round(median, 1),
+        "mean_cents": round(cents, 1),
+        "corrected_cents_from_a4": round(float(after_cents), 1),
+        "ok": bool(abs(median - hz) < 0.03 * hz and cents > 10.0 and abs(after_cents) < 10.0),
+    }
+
+
+BENCHES = {
+    "startup": bench_startup,
+    "midi_write": bench_midi_write,
+    "analysis": bench_analysis,
+    "pitch": bench_pitch,
+}
+
+if __name__ == "__main__":
+    import argparse
+    p = argparse.ArgumentParser(description="Harmonica benchmark suite")
+    p.add_argument("bench", nargs="*", default=sorted(BENCHES), help="benchmarks to run: " + ", ".join(sorted(BENCHES)))
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+    failed = []
+    for name in args.bench:
+        res = BENCHES[name](repeat=args.repeat)
+        print(json.dumps(res))
+        if res.get("ok") is False:
+            failed.append(name)
+    if failed:
+        print("FAILED: " + ", ".join(failed), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,147 @@
+# scripts/cancellation.py
+"""
+Cooperative cancellation and stage timeouts.
+
+A CancelToken is cancelled either in-process (token.cancel(), used by the
+server for jobs running in its own threads) or through the job store's
+cancel flag (polled, so pool workers see a DELETE /jobs/<id> too).
+StageRunner gives every stage a child token carrying the stage deadline and
+makes it the current token for the stage's thread, so deep code can check
+it without threading an argument through every call:
+
+    current_token().check()      # raises JobCancelled / StageTimeout
+
+run_subprocess() runs demucs / fluidsynth in their own process group and
+kills the whole group on cancel or timeout.
+"""
+
+import os
+import time
+import signal
+import threading
+import subprocess
+import contextvars
+from contextlib import contextmanager
+
+STORE_POLL_SEC = 0.5       # how often the job-store flag is re-read
+SUBPROCESS_POLL_SEC = 0.2
+KILL_GRACE_SEC = 5.0
+
+
+class JobCancelled(BaseException):
+    """
+    Raised inside a job once cancellation was requested. Like
+    KeyboardInterrupt it is not an Exception, so the pipeline's broad
+    `except Exception` fallbacks do not swallow it.
+    """
+
+
+class StageTimeout(RuntimeError):
+    """A stage ran past its deadline (a normal, retryable stage failure)."""
+
+
+class CancelToken:
+    def __init__(self, job_id=None, store=None, deadline=None, stage=None, parent=None):
+        self.job_id = job_id
+        self.store = store
+        self.deadline = deadline
+        self.stage = stage
+        self.parent = parent
+        self._event = threading.Event()
+        self._polled = 0.0
+
+    def cancel(self):
+        self._event.set()
+
+    def cancelled(self):
+        if self._event.is_set():
+            return True
+        if self.parent is not None and self.parent.cancelled():
+            return True
+        if self.store is not None and self.job_id:
+            now = time.monotonic()
+            if now - self._polled >= STORE_POLL_SEC:
+                self._polled = now
+                if self.store.cancel_requested(self.job_id):
+                    self._event.set()
+                    return True
+        return False
+
+    def expired(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            return True
+        return self.parent is not None and self.parent.expired()
+
+    def check(self):
+        if self.cancelled():
+            raise JobCancelled(f"job {self.job_id} cancelled" if self.job_id else "cancelled")
+        if self.expired():
+            raise StageTimeout(f"stage {self.stage or '?'} timed out")
+
+    def child(self, timeout=None, stage=None):
+        """Token for one stage: cancelled with this one, plus its own deadline."""
+        deadline = time.monotonic() + float(timeout) if timeout else None
+        return CancelToken(job_id=self.job_id, deadline=deadline, stage=stage, parent=self)
+
+
+NEVER = CancelToken()
+_CURRENT = contextvars.ContextVar("harmonia_cancel_token", default=NEVER)
+
+
+def current_token():
+    return _CURRENT.get()
+
+
+@contextmanager
+def use_token(token):
+    reset = _CURRENT.set(token)
+    try:
+        yield token
+    finally:
+        _CURRENT.reset(reset)
+
+
+def _kill(proc):
+    try:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGTERM)
+        else:
+            proc.terminate()
+        proc.wait(KILL_GRACE_SEC)
+    except subprocess.TimeoutExpired:
+        if os.name == "posix":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+        proc.wait()
+    except (ProcessLookupError, OSError):
+        pass
+
+
+def run_subprocess(cmd, env=None, token=None, timeout=None, **kwargs):
+    """
+    subprocess.check_call that honours cancellation: the child (and its own
+    children) are killed when `token` (default: the current token) is
+    cancelled, its stage deadline passes or `timeout` seconds elapse.
+    """
+    token = token or current_token()
+    deadline = time.monotonic() + timeout if timeout else None
+    proc = subprocess.Popen(cmd, env=env, start_new_session=(os.name == "posix"), **kwargs)
+    try:
+        while True:
+            try:
+                ret = proc.wait(SUBPROCESS_POLL_SEC)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            if deadline is not None and time.monotonic() > deadline:
+                _kill(proc)
+                raise StageTimeout(f"{cmd[0]} timed out after {timeout:g}s")
+            token.check()
+    except BaseException:
+        if proc.poll() is None:
+            _kill(proc)
+        raise
+    if ret != 0:
+        raise subprocess.CalledProcessError(ret, cmd)
+    return ret
@@ -0,0 +1,122 @@
+# scripts/chords.py
+"""
+Chord recognition: major/minor triad templates + Viterbi smoothing.
+
+The old detectors took the best template of every 10 ms chroma frame on
+its own (a Python loop over frames x 24 templates), so a sustained chord
+with a passing note or a noisy frame broke into dozens of tiny segments
+that the arrangers then voiced one by one. Here:
+
+  - emissions   one matrix product scores all 24 templates on all frames
+                (CHORD_TEMPLATES @ chroma), turned into per-frame
+                probabilities with a softmax
+  - smoothing   an HMM whose transition matrix favours staying on the
+                current chord (librosa.sequence.viterbi); the self-
+                transition probability follows from the frame length and
+                the expected chord length, so frame and beat mode behave
+                the same in seconds
+  - beat mode   decode_chords() takes chroma pooled over beat intervals
+                (features.pooled_features); chord changes then land on beats
+
+Labels are "<root pitch class>:<maj|min>" as before ("0:maj" is C major);
+template order (root, maj before min) is the order the old loops searched,
+so ties resolve the same way.
+
+Usage:
+    segs = detect_chords(y, sr, hop_length=160)                 # [(start, end, label), ...]
+    segs = detect_chords(y, sr, hop_length=160, beats=beat_times)
+    segs = decode_chords(feats["chroma"], feats["bounds"])       # already pooled features
+"""
+
+import numpy as np
+import librosa
+
+try:
+    from scripts.features import pooled_features
+except Exception:
+    from features import pooled_features
+
+MAJ = np.array([1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0], dtype=float)
+MIN = np.array([1, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0], dtype=float)
+CHORD_TEMPLATES = np.stack([np.roll(t, r) for r in range(12) for t in (MAJ, MIN)])
+CHORD_LABELS = [f"{r}:{q}" for r in range(12) for q in ("maj", "min")]
+FALLBACK_LABEL = "0:maj"
+
+MEAN_CHORD_SEC = 2.0         # expected time between chord changes (sets the self-transition prior)
+EMISSION_SHARPNESS = 12.0    # softmax gain on template scores (scores are cosine-like, 0..sqrt(3))
+MIN_CHORD_SEC = 0.05
+
+
+def chord_scores(chroma):
+    """Template scores of every chord on every frame (24 x T)."""
+    return CHORD_TEMPLATES @ np.asarray(chroma, dtype=float)
+
+
+def emission_probs(scores, sharpness=EMISSION_SHARPNESS):
+    """Per-frame softmax over chords; an all-zero (silent) frame is uniform and keeps the chord."""
+    z = sharpness * (scores - scores.max(axis=0, keepdims=True))
+    p = np.exp(z)
+    return p / p.sum(axis=0, keepdims=True)
+
+
+def self_transition(frame_sec, mean_chord_sec=MEAN_CHORD_SEC):
+    """P(stay on the chord) for frames `frame_sec` long."""
+    return float(np.clip(1.0 - frame_sec / max(mean_chord_sec, 1e-6), 0.5, 0.999))
+
+
+def viterbi_path(scores, self_prob, sharpness=EMISSION_SHARPNESS):
+    """Most likely chord index per frame under a uniform-switch HMM."""
+    if scores.shape[1] == 0:
+        return np.zeros(0, dtype=int)
+    trans = librosa.sequence.transition_loop(len(CHORD_LABELS), self_prob)
+    return librosa.sequence.viterbi(emission_probs(scores, sharpness), trans)
+
+
+def segments(path, bounds, min_dur=MIN_CHORD_SEC):
+    """
+    Runs of equal chord indices -> [(start, end, label)]. `bounds` holds the
+    T + 1 frame edges in seconds; negative indices are gaps (no chord).
+    """
+    path = np.asarray(path)
+    if path.size == 0:
+        return []
+    change = np.flatnonzero(np.diff(path)) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [path.size]))
+    out = []
+    for a, b in zip(starts.tolist(), ends.tolist()):
+        idx = int(path[a])
+        s, e = float(bounds[a]), float(bounds[b])
+        if idx >= 0 and e - s > min_dur:
+            out.append((s, e, CHORD_LABELS[idx]))
+    return out
+
+
+def decode_chords(chroma, bounds, mean_chord_sec=MEAN_CHORD_SEC, min_dur=MIN_CHORD_SEC, min_score=0.0):
+    """
+    Chord segments from (pooled or frame-level) chroma, 12 x N, whose frames
+    span `bounds` (N + 1 edges in seconds). Frames whose best template score
+    is not above `min_score` are left out (gaps).
+    """
+    chroma = np.asarray(chroma, dtype=float)
+    n = chroma.shape[1]
+    if n == 0:
+        return []
+    frame_sec = float(bounds[-1] - bounds[0]) / n
+    scores = chord_scores(chroma)
+    path = viterbi_path(scores, self_transition(frame_sec, mean_chord_sec))
+    if min_score > 0:
+        path = np.where(scores.max(axis=0) > min_score, path, -1)
+    return segments(path, bounds, min_dur=min_dur)
+
+
+def detect_chords(y, sr, hop_length=160, beats=None, mean_chord_sec=MEAN_CHORD_SEC,
+                  min_dur=MIN_CHORD_SEC, min_score=0.0):
+    """
+    Chord segments [(start, end, label)] of a mono signal. With `beats`
+    (seconds) the chroma is pooled per beat and the decision is made per beat
+    instead of per frame.
+    """
+    feats = pooled_features(y, sr, hop_length, beats=beats, subdivisions=1)
+    return decode_chords(feats["chroma"], feats["bounds"], mean_chord_sec=mean_chord_sec,
+                         min_dur=min_dur, min_score=min_score)
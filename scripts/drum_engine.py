@@ -0,0 +1,213 @@
+# scripts/drum_engine.py
+"""
+Vectorized drum pattern engine.
+
+Builds the beat grid for a whole song at once, looks up the energy state of
+every beat with a single ``searchsorted`` over the section boundaries and
+emits kick / snare / hat events as NumPy arrays.
+
+Patterns come from groove templates: a template is a list of hits, each hit
+says which drum to play, where inside the beat, on which beats and from which
+energy state upwards.  New grooves are added with ``register_groove``.
+
+Usage:
+    from drum_engine import drum_events
+    ev = drum_events(duration, sections, tempo=120, groove="poprock")
+    ev["pitch"], ev["start"], ev["end"], ev["vel"]   # equal-length arrays
+
+    # live: only the events of the next window
+    ev = drum_events_window(t0, t1, state, tempo=120)
+"""
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# General MIDI drum map
+KICK = 36
+SNARE = 38
+CLOSED_HAT = 42
+OPEN_HAT = 46
+
+# -------------------------
+# Groove templates
+# Each hit:
+#   pitch      GM drum note
+#   offset     position inside the beat (fraction of a beat)
+#   every      play on beats where beat_index % every == phase
+#   phase      see above
+#   min_state  lowest energy state (0 low, 1 medium, 2 high) the hit plays in
+#   vel        MIDI velocity before mixer scaling
+#   dur        note length in seconds
+#   jitter     max humanize offset in seconds (uniform +/-)
+# -------------------------
+GROOVE_TEMPLATES: Dict[str, List[dict]] = {
+    # pattern used by harmonia_pop_pipeline arrangers
+    "poprock": [
+        {"pitch": KICK, "offset": 0.0, "every": 1, "phase": 0, "min_state": 0, "vel": 110, "dur": 0.04, "jitter": 0.01},
+        {"pitch": SNARE, "offset": 0.0, "every": 2, "phase": 1, "min_state": 1, "vel": 98, "dur": 0.04, "jitter": 0.008},
+        {"pitch": CLOSED_HAT, "offset": 0.25, "every": 1, "phase": 0, "min_state": 1, "vel": 72, "dur": 0.02, "jitter": 0.005},
+        {"pitch": CLOSED_HAT, "offset": 0.5, "every": 1, "phase": 0, "min_state": 1, "vel": 72, "dur": 0.02, "jitter": 0.005},
+        {"pitch": CLOSED_HAT, "offset": 0.75, "every": 1, "phase": 0, "min_state": 1, "vel": 72, "dur": 0.02, "jitter": 0.005},
+    ],
+    # straight, un-humanized kit used by arranger_pop_rock
+    "poprock_straight": [
+        {"pitch": KICK, "offset": 0.0, "every": 1, "phase": 0, "min_state": 0, "vel": 110, "dur": 0.05, "jitter": 0.0},
+        {"pitch": SNARE, "offset": 0.0, "every": 2, "phase": 1, "min_state": 1, "vel": 100, "dur": 0.05, "jitter": 0.0},
+        {"pitch": CLOSED_HAT, "offset": 0.25, "every": 1, "phase": 0, "min_state": 1, "vel": 60, "dur": 0.02, "jitter": 0.0},
+        {"pitch": CLOSED_HAT, "offset": 0.5, "every": 1, "phase": 0, "min_state": 1, "vel": 60, "dur": 0.02, "jitter": 0.0},
+        {"pitch": CLOSED_HAT, "offset": 0.75, "every": 1, "phase": 0, "min_state": 1, "vel": 60, "dur": 0.02, "jitter": 0.0},
+    ],
+}
+
+_HIT_DEFAULTS = {"offset": 0.0, "every": 1, "phase": 0, "min_state": 0, "vel": 100, "dur": 0.04, "jitter": 0.0}
+
+# compiled templates: name -> dict of per-hit arrays
+_COMPILED: Dict[str, Dict[str, np.ndarray]] = {}
+
+
+def _compile_groove(hits: Sequence[dict]) -> Dict[str, np.ndarray]:
+    """Turn a list of hit dicts into column arrays (one entry per hit)."""
+    rows = [{**_HIT_DEFAULTS, **h} for h in hits]
+    if not rows:
+        raise ValueError("groove template has no hits")
+    cols = {}
+    for key, dtype in (("pitch", np.int16), ("offset", np.float64), ("every", np.int64),
+                       ("phase", np.int64), ("min_state", np.int8), ("vel", np.float64),
+                       ("dur", np.float64), ("jitter", np.float64)):
+        cols[key] = np.array([r[key] for r in rows], dtype=dtype)
+    cols["every"] = np.maximum(cols["every"], 1)
+    return cols
+
+
+def register_groove(name: str, hits: Sequence[dict]) -> None:
+    """Add or replace a groove template. Hits use the keys documented above."""
+    compiled = _compile_groove(hits)
+    GROOVE_TEMPLATES[name] = [dict(h) for h in hits]
+    _COMPILED[name] = compiled
+
+
+def get_groove(name: Optional[str]) -> Dict[str, np.ndarray]:
+    """Compiled template for `name`, falling back to 'poprock'."""
+    key = name if name in GROOVE_TEMPLATES else "poprock"
+    if key not in _COMPILED:
+        _COMPILED[key] = _compile_groove(GROOVE_TEMPLATES[key])
+    return _COMPILED[key]
+
+
+# -------------------------
+# Beat grid + section lookup
+# -------------------------
+def beat_grid(duration: float, tempo: float) -> np.ndarray:
+    """Beat onset times from 0 up to (excluding) duration."""
+    beat = 60.0 / float(tempo)
+    n = int(np.ceil(max(float(duration), 0.0) / beat))
+    grid = np.arange(n, dtype=np.float64) * beat
+    return grid[grid < duration]
+
+
+def section_states(times: np.ndarray, sections: Sequence[Tuple[float, float, int]],
+                   default_state: int = 2) -> np.ndarray:
+    """
+    Energy state at each time in `times`.
+    `sections` is a list of (start, end, state); times outside every section
+    get `default_state`. O((beats + sections) log sections).
+    """
+    times = np.asarray(times, dtype=np.float64)
+    out = np.full(times.shape, int(default_state), dtype=np.int8)
+    if len(sections) == 0 or times.size == 0:
+        return out
+    sec = np.asarray([(s, e, st) for (s, e, st) in sections], dtype=np.float64)
+    sec = sec[np.argsort(sec[:, 0], kind="stable")]
+    starts, ends, states = sec[:, 0], sec[:, 1], sec[:, 2].astype(np.int8)
+    idx = np.searchsorted(starts, times, side="right") - 1
+    valid = idx >= 0
+    idx_c = np.clip(idx, 0, len(starts) - 1)
+    valid &= times < ends[idx_c]
+    out[valid] = states[idx_c[valid]]
+    return out
+
+
+# -------------------------
+# Event generation
+# -------------------------
+def drum_events(duration: float, sections, tempo: float = 120, groove: str = "poprock",
+                default_state: int = 2, beats: Optional[np.ndarray] = None,
+                rng: Optional[np.random.Generator] = None) -> Dict[str, np.ndarray]:
+    """
+    Generate drum events for a song.
+
+    Returns dict of equal-length arrays sorted by start time:
+        pitch (int), start, end (seconds), vel (float, unclamped)
+    `beats` overrides the tempo grid with explicit beat times.
+    """
+    if beats is None:
+        beats = beat_grid(duration, tempo)
+    beats = np.asarray(beats, dtype=np.float64)
+    beats = beats[(beats >= 0.0) & (beats < duration)]
+    if beats.size == 0:
+        empty = np.zeros(0)
+        return {"pitch": empty.astype(np.int16), "start": empty, "end": empty, "vel": empty}
+
+    # local beat length (handles non-uniform beat grids)
+    if beats.size > 1:
+        period = np.diff(beats, append=beats[-1] + (beats[-1] - beats[-2]))
+    else:
+        period = np.full(1, 60.0 / float(tempo))
+
+    states = section_states(beats, sections, default_state=default_state)
+    return _hits(beats, np.arange(beats.size), period, states, get_groove(groove), rng)
+
+
+def _hits(beats, beat_idx, period, states, g, rng, window=None):
+    """Expand a compiled groove over beats; `window` keeps on-grid times in [t0, t1)."""
+    # (hits x beats) masks and times, flattened in one go
+    mask = (states[None, :] >= g["min_state"][:, None]) & \
+           ((beat_idx[None, :] % g["every"][:, None]) == g["phase"][:, None])
+    grid = beats[None, :] + g["offset"][:, None] * period[None, :]
+    if window is not None:
+        mask &= (grid >= window[0]) & (grid < window[1])
+    hit_rows = np.nonzero(mask)[0]
+    on = grid[mask]
+    if rng is None:
+        rng = np.random.default_rng()
+    jit = g["jitter"][hit_rows]
+    start = on + rng.uniform(-1.0, 1.0, size=on.size) * jit
+    end = on + g["dur"][hit_rows]
+
+    order = np.argsort(start, kind="stable")
+    return {
+        "pitch": g["pitch"][hit_rows][order],
+        "start": start[order],
+        "end": end[order],
+        "vel": g["vel"][hit_rows][order],
+    }
+
+
+def drum_events_window(t0: float, t1: float, state: int, tempo: float = 120, groove: str = "poprock",
+                       origin: float = 0.0, rng: Optional[np.random.Generator] = None) -> Dict[str, np.ndarray]:
+    """
+    Drum events whose grid time falls in [t0, t1), for a live stream.
+
+    The beat grid is origin + k * 60 / tempo; beat indices are absolute, so
+    consecutive windows line up into the same pattern drum_events would
+    produce. `state` is the energy state for the whole window. Keeps no
+    state of its own.
+    """
+    beat = 60.0 / float(tempo)
+    # the beat before t0 too: its offbeat hits can land inside the window
+    k0 = max(0, int(np.floor((t0 - origin) / beat)) - 1)
+    k1 = max(k0, int(np.ceil((t1 - origin) / beat)))
+    beat_idx = np.arange(k0, k1, dtype=np.int64)
+    beats = origin + beat_idx * beat
+    states = np.full(beats.shape, int(state), dtype=np.int8)
+    period = np.full(beats.shape, beat)
+    return _hits(beats, beat_idx, period, states, get_groove(groove), rng, window=(t0, t1))
+
+
+def events_to_dicts(ev: Dict[str, np.ndarray]) -> List[dict]:
+    """Legacy list-of-dicts view ({pitch,start,end,vel}) of an event dict."""
+    return [
+        {"pitch": int(p), "start": float(s), "end": float(e), "vel": int(round(float(v)))}
+        for p, s, e, v in zip(ev["pitch"], ev["start"], ev["end"], ev["vel"])
+    ]
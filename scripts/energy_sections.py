@@ -0,0 +1,282 @@
+# scripts/energy_sections.py
+"""
+Energy-section segmentation (low / medium / high) from frame RMS.
+
+One vectorized implementation shared by harmonia_pop_pipeline and
+arranger_pop_rock:
+  - state assignment against percentile thresholds, with a hysteresis band
+    so noisy RMS does not flicker between neighbouring states
+  - run-length encoding of the state sequence
+  - minimum section length: runs shorter than the minimum are absorbed into
+    the preceding section
+
+sections_from_rms runs the same steps on RMS that is already framed (for
+instance pooled per beat). StreamingEnergySegmenter does the same for
+chunked input and only keeps a bounded window of history.
+
+Sections are lists of (start, end, state) with state 0 low, 1 medium, 2 high.
+"""
+
+from collections import deque
+from typing import List, Optional, Tuple
+
+import numpy as np
+import librosa
+
+SR = 16000
+HOP = 160
+
+DEFAULT_SIGMA = 1.2            # gaussian smoothing (frames)
+DEFAULT_HYSTERESIS = 0.1       # band half-width, as a fraction of (high - low)
+DEFAULT_MIN_SECTION_SEC = 1.0
+LOW_PERCENTILE = 40
+HIGH_PERCENTILE = 80
+
+
+# -------------------------
+# Vectorized building blocks
+# -------------------------
+def _forward_fill_index(decided: np.ndarray) -> np.ndarray:
+    """Index of the most recent True at or before each position (-1 if none)."""
+    idx = np.where(decided, np.arange(decided.size), -1)
+    return np.maximum.accumulate(idx) if idx.size else idx
+
+
+def hysteresis_threshold(x: np.ndarray, thr: float, band: float, init: Optional[bool] = None) -> np.ndarray:
+    """
+    Binary x >= thr with a hysteresis band: the output only switches on above
+    thr + band and off below thr - band. Frames inside the band keep the last
+    decided value; `init` is used before the first decision (default: x >= thr).
+    """
+    x = np.asarray(x, dtype=float)
+    up = x >= thr + band
+    down = x < thr - band
+    idx = _forward_fill_index(up | down)
+    undecided = idx < 0
+    out = up[np.maximum(idx, 0)]
+    if undecided.any():
+        out[undecided] = (x[undecided] >= thr) if init is None else bool(init)
+    return out
+
+
+def assign_states(smooth: np.ndarray, low: float, high: float, hysteresis: float = DEFAULT_HYSTERESIS,
+                  init_state: Optional[int] = None) -> np.ndarray:
+    """Per-frame energy state (0/1/2) with hysteresis around both thresholds."""
+    band = max(float(hysteresis), 0.0) * max(float(high) - float(low), 0.0)
+    init_low = None if init_state is None else init_state >= 1
+    init_high = None if init_state is None else init_state >= 2
+    above_low = hysteresis_threshold(smooth, low, band, init_low)
+    above_high = hysteresis_threshold(smooth, high, band, init_high)
+    return np.maximum(above_low.astype(np.int8), 2 * above_high.astype(np.int8))
+
+
+def run_length_encode(states: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return (starts, lengths, values) of the runs in `states`."""
+    states = np.asarray(states)
+    if states.size == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, states[:0]
+    change = np.flatnonzero(states[1:] != states[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    lengths = np.diff(np.concatenate((starts, [states.size])))
+    return starts, lengths, states[starts]
+
+
+def enforce_min_length(starts: np.ndarray, lengths: np.ndarray, values: np.ndarray,
+                       min_len: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Absorb runs shorter than `min_len` into the preceding long run (leading
+    short runs join the first long run) and re-merge equal neighbours.
+    """
+    if values.size == 0 or min_len <= 1:
+        return starts, lengths, values
+    long_run = lengths >= min_len
+    if not long_run.any():
+        # nothing is long enough: the whole span takes the dominant state
+        total = int(lengths.sum())
+        return starts[:1], np.array([total]), values[[int(np.argmax(lengths))]]
+    idx = _forward_fill_index(long_run)
+    idx[idx < 0] = int(np.argmax(long_run))
+    filled = values[idx]
+    keep = np.concatenate(([True], filled[1:] != filled[:-1]))
+    new_starts = starts[keep]
+    new_lengths = np.add.reduceat(lengths, np.flatnonzero(keep))
+    return new_starts, new_lengths, filled[keep]
+
+
+def segment_states(states: np.ndarray, times: np.ndarray, frame_dur: float,
+                   min_frames: int = 1) -> List[Tuple[float, float, int]]:
+    """Collapse a per-frame state array into (start, end, state) sections."""
+    starts, lengths, values = run_length_encode(states)
+    starts, lengths, values = enforce_min_length(starts, lengths, values, int(min_frames))
+    if values.size == 0:
+        return []
+    times = np.asarray(times, dtype=float)
+    bounds = np.append(times[starts], times[-1] + frame_dur)
+    return [(float(s), float(e), int(v)) for s, e, v in zip(bounds[:-1], bounds[1:], values)]
+
+
+def _gaussian_smooth(x, sigma):
+    if sigma and sigma > 0:
+        try:
+            import scipy.ndimage as ndi
+            return ndi.gaussian_filter1d(x, sigma=sigma)
+        except Exception:
+            pass
+    return x
+
+
+# -------------------------
+# Offline segmenter
+# -------------------------
+def compute_energy_sections(y, sr=SR, hop_length=HOP, sigma=DEFAULT_SIGMA,
+                            hysteresis=DEFAULT_HYSTERESIS, min_section_sec=DEFAULT_MIN_SECTION_SEC):
+    """
+    Returns (sections, smooth_rms, frame_times).
+    sections: list of (start, end, state), state 0 low, 1 medium, 2 high.
+    """
+    if len(y) < hop_length * 2:
+        return [(0.0, float(len(y) / sr), 2)], np.array([]), np.array([0.0])
+    rms = librosa.feature.rms(y=y, frame_length=hop_length * 2, hop_length=hop_length).squeeze()
+    times = librosa.frames_to_time(np.arange(len(rms)), sr=sr, hop_length=hop_length)
+    smooth = _gaussian_smooth(rms, sigma)
+    low = float(np.percentile(smooth, LOW_PERCENTILE))
+    high = float(np.percentile(smooth, HIGH_PERCENTILE))
+    states = assign_states(smooth, low, high, hysteresis=hysteresis)
+    frame_dur = hop_length / sr
+    min_frames = max(1, int(round(float(min_section_sec) / frame_dur)))
+    sections = segment_states(states, times, frame_dur, min_frames=min_frames)
+    if not sections:
+        sections = [(0.0, float(len(y) / sr), 2)]
+    return sections, smooth, times
+
+
+def sections_from_rms(rms, bounds, sigma=0.0, hysteresis=DEFAULT_HYSTERESIS,
+                      min_section_sec=DEFAULT_MIN_SECTION_SEC):
+    """
+    Sections from RMS that is already framed, e.g. pooled per beat
+    (features.pooled_features): frame i spans bounds[i]..bounds[i + 1]
+    seconds, frames need not be equally long. `sigma` is in these frames;
+    pooling already smooths, so the default is none.
+    """
+    rms = np.asarray(rms, dtype=float)
+    bounds = np.asarray(bounds, dtype=float)
+    if rms.size == 0:
+        return [(0.0, float(bounds[-1]) if bounds.size else 0.0, 2)]
+    smooth = _gaussian_smooth(rms, sigma)
+    low = float(np.percentile(smooth, LOW_PERCENTILE))
+    high = float(np.percentile(smooth, HIGH_PERCENTILE))
+    states = assign_states(smooth, low, high, hysteresis=hysteresis)
+    frame_dur = float(bounds[-1] - bounds[0]) / rms.size
+    min_frames = max(1, int(round(float(min_section_sec) / max(frame_dur, 1e-9))))
+    starts, lengths, values = enforce_min_length(*run_length_encode(states), min_frames)
+    ends = starts + lengths
+    return [(float(bounds[a]), float(bounds[b]), int(v)) for a, b, v in zip(starts, ends, values)]
+
+
+# -------------------------
+# Streaming segmenter
+# -------------------------
+class StreamingEnergySegmenter:
+    """
+    Chunked version of compute_energy_sections.
+
+    push(samples) returns the sections that became final with this chunk;
+    flush() closes the open section. Thresholds are either fixed (low/high)
+    or percentiles over the last `history_sec` seconds of smoothed RMS, and
+    smoothing is a one-pole filter so no lookahead is needed. Memory is
+    bounded by the history window.
+    """
+
+    def __init__(self, sr=SR, hop_length=HOP, low=None, high=None,
+                 hysteresis=DEFAULT_HYSTERESIS, min_section_sec=DEFAULT_MIN_SECTION_SEC,
+                 smooth_sec=0.03, history_sec=30.0):
+        self.sr = int(sr)
+        self.hop = int(hop_length)
+        self.frame_len = 2 * self.hop
+        self.frame_dur = self.hop / self.sr
+        self.fixed_low = low
+        self.fixed_high = high
+        self.hysteresis = hysteresis
+        self.min_frames = max(1, int(round(float(min_section_sec) / self.frame_dur)))
+        self.alpha = min(1.0, self.frame_dur / max(float(smooth_sec), 1e-6))
+        self.history = deque(maxlen=max(1, int(history_sec / self.frame_dur)))
+        self._tail = np.zeros(0, dtype=np.float32)
+        self._frames_done = 0
+        self._ema = None
+        self._state = None          # committed state
+        self._state_start = 0       # frame index
+        self._cand = None           # [state, start_frame, length]
+
+    @property
+    def state(self) -> Optional[int]:
+        """Energy state of the open section (None before the first frame)."""
+        return None if self._state is None else int(self._state)
+
+    # thresholds currently in use
+    def thresholds(self):
+        if self.fixed_low is not None and self.fixed_high is not None:
+            return float(self.fixed_low), float(self.fixed_high)
+        hist = np.fromiter(self.history, dtype=float, count=len(self.history))
+        return float(np.percentile(hist, LOW_PERCENTILE)), float(np.percentile(hist, HIGH_PERCENTILE))
+
+    def _frames(self, samples):
+        buf = np.concatenate((self._tail, np.asarray(samples, dtype=np.float32).ravel()))
+        if buf.size < self.frame_len:
+            self._tail = buf
+            return np.zeros(0)
+        n = 1 + (buf.size - self.frame_len) // self.hop
+        win = np.lib.stride_tricks.sliding_window_view(buf, self.frame_len)[::self.hop][:n]
+        self._tail = buf[n * self.hop:]
+        return np.sqrt(np.mean(win.astype(np.float64) ** 2, axis=1))
+
+    def _smooth(self, rms):
+        from scipy.signal import lfilter
+        a = self.alpha
+        zi = np.array([(1.0 - a) * (rms[0] if self._ema is None else self._ema)])
+        out, _ = lfilter([a], [1.0, -(1.0 - a)], rms, zi=zi)
+        self._ema = float(out[-1])
+        return out
+
+    def _t(self, frame):
+        return float(frame * self.frame_dur)
+
+    def push(self, samples) -> List[Tuple[float, float, int]]:
+        rms = self._frames(samples)
+        if rms.size == 0:
+            return []
+        smooth = self._smooth(rms)
+        self.history.extend(smooth.tolist())
+        low, high = self.thresholds()
+        states = assign_states(smooth, low, high, hysteresis=self.hysteresis, init_state=self._state)
+        base = self._frames_done
+        self._frames_done += states.size
+
+        done = []
+        starts, lengths, values = run_length_encode(states)
+        # loop over runs (few after hysteresis), not frames
+        for st, ln, val in zip((starts + base).tolist(), lengths.tolist(), values.tolist()):
+            if self._state is None:
+                self._state, self._state_start = val, st
+                continue
+            if self._cand is not None and val == self._cand[0]:
+                self._cand[2] += ln
+            elif val == self._state:
+                self._cand = None
+                continue
+            else:
+                self._cand = [val, st, ln]
+            if self._cand[2] >= self.min_frames:
+                done.append((self._t(self._state_start), self._t(self._cand[1]), int(self._state)))
+                self._state, self._state_start = self._cand[0], self._cand[1]
+                self._cand = None
+        return done
+
+    def flush(self) -> List[Tuple[float, float, int]]:
+        if self._state is None:
+            return []
+        end = self._frames_done
+        out = [(self._t(self._state_start), self._t(end), int(self._state))]
+        self._state, self._cand = None, None
+        self._state_start = end
+        return out
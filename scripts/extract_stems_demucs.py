@@ -4,42 +4,249 @@ import time
 from pathlib import Path
 import shutil
 import os
+import tempfile
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def run_demucs_cli(song_path: str):
+import numpy as np
+import soundfile as sf
+
+try:
+    from scripts.resources import subprocess_env, cpu_count
+    from scripts.cancellation import run_subprocess, current_token, use_token
+except Exception:
+    from resources import subprocess_env, cpu_count
+    from cancellation import run_subprocess, current_token, use_token
+
+# separation mode -> demucs options
+#   quality  all four stems (drums, bass, other, vocals)
+#   fast     vocals / no_vocals only, lighter segment overlap. The pipeline
+#            only reads the melody stem; nothing else is resampled or written.
+#            HARMONIA_FAST_MODEL swaps in a smaller / two-source model.
+SEPARATION_MODES = {
+    "quality": {"model": "htdemucs", "two_stems": None, "overlap": 0.25},
+    "fast": {"model": "htdemucs", "two_stems": "vocals", "overlap": 0.1},
+}
+DEFAULT_SEPARATION = "quality"
+
+# very long inputs are separated in overlapping segments (bounded memory per
+# demucs process) and stitched with linear crossfades over the overlap;
+# ordinary songs (under ~15 min) stay a single demucs pass.
+#   HARMONIA_SEPARATION_SEGMENT_SEC  segment length (default 600, 0 = always one pass)
+#   HARMONIA_SEPARATION_WORKERS      segments separated at once (default 1: low memory)
+SEGMENT_SEC = 600.0
+SEGMENT_OVERLAP_SEC = 2.0
+DEMUCS_SR = 44100          # every pretrained demucs model writes 44.1 kHz
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]   # music_project/
+
+
+def resolve_separation(mode=None):
+    """Separation mode name (default: HARMONIA_SEPARATION, else 'quality')."""
+    mode = (mode or os.environ.get("HARMONIA_SEPARATION") or DEFAULT_SEPARATION).lower()
+    if mode not in SEPARATION_MODES:
+        raise ValueError(f"unknown separation mode {mode!r} (choose from {', '.join(SEPARATION_MODES)})")
+    return mode
+
+
+def separation_options(mode=None):
+    mode = resolve_separation(mode)
+    opts = dict(SEPARATION_MODES[mode])
+    if mode == "fast":
+        opts["model"] = os.environ.get("HARMONIA_FAST_MODEL") or opts["model"]
+    return opts
+
+
+def output_root(mode=None):
+    """Demucs -o directory; modes get their own so a fast run never shadows full stems."""
+    mode = resolve_separation(mode)
+    return PROJECT_ROOT / "separated" if mode == DEFAULT_SEPARATION else PROJECT_ROOT / "separated" / mode
+
+
+def _env_number(name, default, cast=float):
+    try:
+        return cast(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def demucs_command(song_path, mode=None, out_root=None):
+    opts = separation_options(mode)
+    out_root = out_root or output_root(mode)
+    cmd = ["demucs", "-n", opts["model"], "-o", str(out_root), "--overlap", str(opts["overlap"])]
+    if opts["two_stems"]:
+        cmd.append(f"--two-stems={opts['two_stems']}")
+    cmd.append(str(song_path))
+    return cmd
+
+
+def run_demucs_cli(song_path: str, threads: int = None, mode: str = None, out_root=None):
     song_path = str(Path(song_path).resolve())
-    cmd = ["demucs", "-n", "htdemucs", song_path]
+    cmd = demucs_command(song_path, mode, out_root)
     try:
         print("Calling:", " ".join(cmd))
-        subprocess.check_call(cmd)
+        # threads: cap torch/OpenMP threads of the demucs process to the job budget;
+        # killed if the job is cancelled or the stage times out
+        run_subprocess(cmd, env=subprocess_env(threads))
     except FileNotFoundError:
         raise RuntimeError("Demucs not found in PATH. Install demucs and ensure it's on PATH.")
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"Demucs failed with exit code {e.returncode}")
 
-def extract_stems_demucs(song_path: str, wait_seconds: float = 25.0):
+def plan_segments(n_frames, sr, segment_sec=SEGMENT_SEC, overlap_sec=SEGMENT_OVERLAP_SEC, out_sr=DEMUCS_SR):
+    """
+    [(start, end), ...] frame ranges of (nearly) equal length covering
+    n_frames, each overlapping the next by overlap_sec. One range when the
+    input is short. Starts fall on whole samples at `out_sr` too, so the
+    resampled segments line up exactly when stitched.
+    """
+    seg = int(round(segment_sec * sr))
+    ov = int(round(overlap_sec * sr))
+    if seg <= 0 or n_frames <= seg + seg // 2 or seg <= 2 * ov:
+        return [(0, int(n_frames))]
+    k = math.ceil((n_frames - ov) / (seg - ov))
+    step = (n_frames - ov) / k
+    align = int(sr) // math.gcd(int(sr), int(out_sr))
+    starts = [int(round(i * step / align)) * align for i in range(k)]
+    ends = starts[1:] + [n_frames]
+    return [(s, min(int(n_frames), e + ov)) for s, e in zip(starts, ends)]
+
+
+def _crossfade(y, tail):
+    """Blend the previous segment's `tail` into the head of `y` (linear, sums to 1)."""
+    if tail is not None and len(tail):
+        n = min(len(tail), len(y))
+        fade = ((np.arange(n, dtype=np.float32) + 0.5) / n)[:, None]
+        y[:n] = tail[:n] * (1.0 - fade) + y[:n] * fade
+    return y
+
+
+def stitch_segments(seg_dirs, spans, in_sr, out_dir):
+    """
+    Overlap-add the per-segment stems into out_dir/<stem>.wav, streaming:
+    only one segment plus the overlap tail is in memory at a time.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for stem in sorted(p.name for p in Path(seg_dirs[0]).glob("*.wav")):
+        info = sf.info(str(Path(seg_dirs[0]) / stem))
+        ratio = info.samplerate / float(in_sr)
+        # segment starts in output samples (demucs writes at the model's rate)
+        offsets = [int(round(s * ratio)) for s, _ in spans]
+        tail = None
+        with sf.SoundFile(str(out_dir / stem), "w", info.samplerate, info.channels, subtype=info.subtype) as out:
+            for i, d in enumerate(seg_dirs):
+                y, _ = sf.read(str(Path(d) / stem), dtype="float32", always_2d=True)
+                y = _crossfade(y, tail)
+                if i + 1 < len(seg_dirs):
+                    keep = offsets[i + 1] - offsets[i]
+                    out.write(y[:keep])
+                    tail = y[keep:]
+                else:
+                    out.write(y)
+    return str(out_dir)
+
+
+def _progress(done, total):
+    print(f"[extract_stems_demucs] segment {done}/{total} separated")
+
+
+def separate_segmented(song_path, spans, sr, mode=None, threads=None, workers=None, progress=None):
+    """
+    Cut the song into `spans`, run demucs on every segment (`workers` at a
+    time, each with its share of the thread budget) and stitch the stems
+    into the usual <out_root>/<model>/<song> folder.
+    """
+    mode = resolve_separation(mode)
+    song_path = Path(song_path).resolve()
+    model = separation_options(mode)["model"]
+    out_root = output_root(mode)
+    workers = max(1, min(int(workers or 1), len(spans)))
+    per_job = max(1, (threads or cpu_count()) // workers)
+    progress = progress or _progress
+    token = current_token()
+
+    def _one(i, span):
+        with use_token(token):
+            token.check()
+            seg_wav = work / f"seg_{i:03d}.wav"
+            y, _ = sf.read(str(song_path), start=span[0], stop=span[1], dtype="float32", always_2d=True)
+            sf.write(str(seg_wav), y, sr, subtype="FLOAT")
+            del y
+            run_demucs_cli(str(seg_wav), threads=per_job, mode=mode, out_root=work / "out")
+            seg_wav.unlink()
+            return work / "out" / model / seg_wav.stem
+
+    # scratch space of this call only: jobs on the same song run side by side
+    (out_root / "_segments").mkdir(parents=True, exist_ok=True)
+    work = Path(tempfile.mkdtemp(prefix=f"{song_path.stem}_", dir=out_root / "_segments"))
+    try:
+        seg_dirs = [None] * len(spans)
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = {ex.submit(_one, i, span): i for i, span in enumerate(spans)}
+            try:
+                for done, f in enumerate(as_completed(futures), 1):
+                    seg_dirs[futures[f]] = f.result()
+                    progress(done, len(spans))
+            except BaseException:
+                for f in futures:
+                    f.cancel()
+                raise
+        return stitch_segments(seg_dirs, spans, sr, out_root / model / song_path.stem)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def extract_stems_demucs(song_path: str, wait_seconds: float = 25.0, threads: int = None, mode: str = None,
+                         segment_sec: float = None, workers: int = None, progress=None):
     """
     Run Demucs and return the folder where stems appear.
+    `mode` is 'quality' (4 stems) or 'fast' (vocals / no_vocals only).
+    Inputs longer than ~1.5 * `segment_sec` are separated segment by segment
+    (`workers` segments in parallel) and stitched; `progress(done, total)`
+    is called per finished segment.
     This searches typical locations and waits up to `wait_seconds`.
     """
+    mode = resolve_separation(mode)
     song_path = Path(song_path).resolve()
     song_name = song_path.stem
 
+    if segment_sec is None:
+        segment_sec = _env_number("HARMONIA_SEPARATION_SEGMENT_SEC", SEGMENT_SEC)
+    if workers is None:
+        workers = _env_number("HARMONIA_SEPARATION_WORKERS", 1, int)
+    try:
+        info = sf.info(str(song_path))
+        spans = plan_segments(info.frames, info.samplerate, segment_sec)
+    except RuntimeError:
+        # not readable by libsndfile (e.g. some mp3s): demucs decodes it in one pass
+        spans = None
+    if spans is not None and len(spans) > 1:
+        print(f"[extract_stems_demucs] {len(spans)} segments of ~{segment_sec:g}s, {workers} at a time")
+        return separate_segmented(song_path, spans, info.samplerate, mode=mode, threads=threads,
+                                  workers=workers, progress=progress)
+
     # run CLI
-    run_demucs_cli(str(song_path))
+    run_demucs_cli(str(song_path), threads=threads, mode=mode)
 
-    # candidate output roots (cover your variants)
-    project_root = Path(__file__).resolve().parents[1]   # music_project/
-    candidates = [
-        project_root / "separated" / "htdemucs" / song_name,
-        project_root / "backend" / "separated" / "htdemucs" / song_name,
-        project_root / "backend" / "separated" / song_name,
-        project_root / "separated" / song_name,
-    ]
+    out_root = output_root(mode)
+    candidates = [out_root / separation_options(mode)["model"] / song_name]
+    scan_root = out_root
+    if mode == DEFAULT_SEPARATION:
+        # candidate output roots of older runs (cover your variants)
+        project_root = PROJECT_ROOT
+        candidates += [
+            project_root / "backend" / "separated" / "htdemucs" / song_name,
+            project_root / "backend" / "separated" / song_name,
+            project_root / "separated" / song_name,
+        ]
+        scan_root = project_root
 
     print("[extract_stems_demucs] waiting for Demucs output. checking:", candidates)
     waited = 0.0
     interval = 0.5
     while waited < wait_seconds:
+        current_token().check()
         for c in candidates:
             if c.exists() and any(c.iterdir()):
                 print("Demucs output found at:", c)
@@ -47,9 +254,9 @@ def extract_stems_demucs(song_path: str, wait_seconds: float = 25.0):
         time.sleep(interval)
         waited += interval
 
-    # last-resort recursive scan inside project_root
+    # last-resort recursive scan inside the output root
     print("No demucs folder in candidate paths — doing recursive scan (last resort).")
-    for root, dirs, files in os.walk(project_root):
+    for root, dirs, files in os.walk(scan_root):
         for d in dirs:
             if d == song_name:
                 p = Path(root) / d
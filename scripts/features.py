@@ -0,0 +1,161 @@
+# scripts/features.py
+"""
+Beat-synchronous feature pooling.
+
+Chroma and RMS are computed once per song at the analysis hop (160 samples
+at 16 kHz, 100 frames per second), but chords and energy states only change
+on the beat or bar scale. pooled_features() aggregates both over beat (or
+sub-beat) intervals, so chord decoding and section segmentation run on a few
+frames per second instead of a hundred:
+
+  - chroma   median over the interval (robust to passing notes and onsets),
+             re-normalized per pooled frame
+  - rms      mean over the interval (energy adds up; a median would hide
+             short hits)
+
+ANALYSIS_TIERS picks the front end: 'full' computes CQT chroma at 16 kHz
+with a 10 ms hop, 'fast' STFT chroma at 11.025 kHz with a ~93 ms hop.
+
+The frame-level arrays are kept next to the pooled ones ("frame"), for the
+places that need hop precision; vocal pitch has its own CREPE contour
+(song_analysis.vocal_pitch) and does not go through this module.
+
+Usage:
+    feats = pooled_features(y, sr, hop_length=160, beats=beat_times, subdivisions=2)
+    feats["chroma"], feats["rms"], feats["bounds"]     # (12, N), (N,), (N + 1,) seconds
+    feats["frame"]["chroma"], feats["frame"]["times"]  # frame-level data
+"""
+
+import os
+
+import numpy as np
+import librosa
+
+DEFAULT_SUBDIVISIONS = 2        # pooled frames per beat (eighth notes in 4/4)
+
+# analysis tier -> rate / hop / chroma front end
+#   full  CQT chroma at the analysis rate, 10 ms hop
+#   fast  STFT chroma at 11.025 kHz, 93 ms hop (still ~4 frames per beat at
+#         160 bpm, so the beat pooling sees the same grid); about 10x cheaper
+ANALYSIS_TIERS = {
+    "full": {"sr": 16000, "hop": 160, "chroma": "cqt"},
+    "fast": {"sr": 11025, "hop": 1024, "chroma": "stft", "n_fft": 4096},
+}
+DEFAULT_ANALYSIS_TIER = "full"
+TUNING_SEC = 30.0               # STFT chroma: tuning estimated on this much audio
+
+
+def resolve_tier(tier=None):
+    """Analysis tier name (default: HARMONIA_ANALYSIS_TIER, else 'full')."""
+    tier = (tier or os.environ.get("HARMONIA_ANALYSIS_TIER") or DEFAULT_ANALYSIS_TIER).lower()
+    if tier not in ANALYSIS_TIERS:
+        raise ValueError(f"unknown analysis tier {tier!r} (choose from {', '.join(ANALYSIS_TIERS)})")
+    return tier
+
+
+def _chroma_stft(y, sr, hop_length, n_fft=None):
+    # librosa estimates the tuning on the whole spectrogram when tuning=None,
+    # which costs more than the chroma itself; the first seconds are enough
+    head = y[:int(TUNING_SEC * sr)]
+    tuning = librosa.estimate_tuning(y=head, sr=sr, n_fft=n_fft or 2048) if head.size else 0.0
+    return librosa.feature.chroma_stft(y=y, sr=sr, hop_length=hop_length, n_fft=n_fft or 2048,
+                                       tuning=tuning)
+
+
+def frame_features(y, sr, hop_length, kind="cqt", n_fft=None):
+    """
+    Frame-level chroma (12 x T, L2-normalized), RMS (T) and frame times (T).
+    `kind` is the chroma front end, 'cqt' or 'stft' (see ANALYSIS_TIERS).
+    """
+    chroma = None
+    if kind == "cqt":
+        try:
+            chroma = librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=hop_length)
+        except Exception:
+            pass        # fallback to STFT-based chroma if CQT fails
+    if chroma is None:
+        chroma = _chroma_stft(y, sr, hop_length, n_fft)
+    chroma = chroma / (np.linalg.norm(chroma, axis=0, keepdims=True) + 1e-9)
+    rms = librosa.feature.rms(y=y, frame_length=hop_length * 2, hop_length=hop_length)[0]
+    T = min(chroma.shape[1], rms.size)
+    times = librosa.frames_to_time(np.arange(T), sr=sr, hop_length=hop_length)
+    return {"chroma": chroma[:, :T], "rms": rms[:T], "times": times}
+
+
+def beat_grid(beats, duration, subdivisions=DEFAULT_SUBDIVISIONS):
+    """
+    Pooling boundaries in seconds: each beat interval split into
+    `subdivisions` equal parts, plus the lead-in before the first beat and the
+    tail after the last one.
+    """
+    beats = np.unique(np.asarray(beats, dtype=float))
+    beats = beats[(beats > 0) & (beats < duration)]
+    if beats.size == 0:
+        return np.array([0.0, float(duration)])
+    subdivisions = max(1, int(subdivisions))
+    if subdivisions > 1 and beats.size > 1:
+        step = np.diff(beats)[:, None] / subdivisions
+        inner = (beats[:-1, None] + step * np.arange(subdivisions)).ravel()
+        beats = np.append(inner, beats[-1])
+    return np.concatenate(([0.0], beats, [float(duration)]))
+
+
+def tempo_grid(tempo, duration):
+    """Beat times of a constant tempo (when no tracked beats are available)."""
+    period = 60.0 / max(float(tempo), 1.0)
+    return np.arange(period, float(duration), period)
+
+
+def pool(data, edges, aggregate=np.mean):
+    """
+    Aggregate the columns of `data` (d x T, or T) between frame `edges`
+    (N + 1 increasing frame indices, edges[0] = 0, edges[-1] = T) -> d x N.
+    """
+    data = np.asarray(data, dtype=float)
+    squeeze = data.ndim == 1
+    if squeeze:
+        data = data[None, :]
+    edges = np.asarray(edges, dtype=int)
+    if aggregate is np.mean:
+        # one pass instead of a loop over intervals
+        sums = np.add.reduceat(data, edges[:-1], axis=1)
+        out = sums / np.diff(edges)
+    else:
+        out = np.stack([aggregate(data[:, a:b], axis=1) for a, b in zip(edges[:-1], edges[1:])], axis=1)
+    return out[0] if squeeze else out
+
+
+def frame_edges(bounds, sr, hop_length, n_frames):
+    """Second boundaries -> frame boundaries; intervals that round to nothing are merged away."""
+    idx = librosa.time_to_frames(np.asarray(bounds, dtype=float), sr=sr, hop_length=hop_length)
+    idx = np.clip(idx, 0, n_frames)
+    idx[0], idx[-1] = 0, n_frames
+    return np.unique(idx)
+
+
+def pooled_features(y, sr, hop_length, beats=None, tempo=None, subdivisions=DEFAULT_SUBDIVISIONS,
+                    chroma_aggregate=np.median, rms_aggregate=np.mean, chroma_kind="cqt", n_fft=None):
+    """
+    Chroma and RMS pooled over the beat grid. Without beats a constant grid
+    from `tempo` is used; without either the frames are returned unpooled.
+    Returns {"chroma", "rms", "bounds", "frame"}; bounds are seconds (N + 1).
+    """
+    frame = frame_features(y, sr, hop_length, kind=chroma_kind, n_fft=n_fft)
+    T = frame["rms"].size
+    duration = float(len(y) / sr)
+    if (beats is None or len(beats) == 0) and tempo:
+        beats = tempo_grid(tempo, duration)
+    if beats is None or len(beats) == 0 or T == 0:
+        edges = np.arange(T + 1)
+        chroma, rms = frame["chroma"], frame["rms"]
+    else:
+        edges = frame_edges(beat_grid(beats, duration, subdivisions), sr, hop_length, T)
+        chroma = pool(frame["chroma"], edges, chroma_aggregate)
+        chroma = chroma / (np.linalg.norm(chroma, axis=0, keepdims=True) + 1e-9)
+        rms = pool(frame["rms"], edges, rms_aggregate)
+    return {
+        "chroma": chroma,
+        "rms": rms,
+        "bounds": librosa.frames_to_time(edges, sr=sr, hop_length=hop_length),
+        "frame": frame,
+    }
@@ -0,0 +1,383 @@
+# scripts/job_store.py
+"""
+Persistent job store (SQLite) with per-stage checkpoints.
+
+Every job row keeps the request parameters, so a job can be retried or
+resumed after a server restart. Every pipeline stage of a job keeps its
+status, its JSON output (paths), the sha1 of every file in that output and
+a fingerprint of its inputs:
+
+    jobs(id, song, out_dir, params, status, error, result, cancel, created, updated)
+    stages(job_id, name, status, inputs, output, artifacts, error, started, finished)
+
+StageRunner wraps the pipeline stages. A stage that is already `done`, whose
+inputs are unchanged and whose artifacts are still on disk with the
+recorded hashes is skipped and returns its stored output, so a retry after
+a failed mix only re-runs the mix, not Demucs. A stage whose upstream
+re-ran with a different result sees new inputs and runs again.
+
+Each stage also runs under a child CancelToken (cancellation.py) with its
+timeout from STAGE_TIMEOUTS.
+
+Finished results are also cached per request: request_key(song, params)
+hashes the song contents with every parameter, and
+
+    results(key, job_id, result, artifacts, created)
+
+maps it to the job that produced it. seed_for(key) seeds that job's
+humanize jitter, so an identical request would produce identical output
+anyway and can be answered from the cache.
+
+Stages run through a StageGraph (stage_graph.py) carry a content key that
+does not depend on the job; finished stages are indexed by it across jobs
+
+    stage_cache(key, name, job_id, output, artifacts, created)
+
+so a new job whose request differs only in the mixer or the style reuses
+the earlier job's separation and vocals.
+
+    HARMONIA_JOB_DB=<file>   database location (default: <project>/cache/jobs.sqlite3)
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+
+try:
+    from scripts.audio_store import content_hash
+    from scripts.cancellation import CancelToken, JobCancelled, use_token
+except Exception:
+    from audio_store import content_hash
+    from cancellation import CancelToken, JobCancelled, use_token
+
+ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_DB = ROOT / "cache" / "jobs.sqlite3"
+
+RESULT_VERSION = 2      # bump when pipeline output changes for the same parameters
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED, INTERRUPTED = (
+    "queued", "running", "done", "failed", "cancelled", "interrupted")
+
+# seconds per stage (keyed by the part after "<style>/"); None = no limit
+STAGE_TIMEOUTS = {
+    "separate": 1800,
+    "vocals": 900,
+    "arrange": 300,
+    "synth": 600,
+    "mix": 300,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    song TEXT NOT NULL,
+    out_dir TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    result TEXT,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    job_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    inputs TEXT,
+    output TEXT,
+    artifacts TEXT,
+    error TEXT,
+    started REAL,
+    finished REAL,
+    PRIMARY KEY (job_id, name)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    job_id TEXT NOT NULL,
+    result TEXT NOT NULL,
+    artifacts TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stage_cache (
+    key TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    output TEXT,
+    artifacts TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+def default_db():
+    return Path(os.environ.get("HARMONIA_JOB_DB") or DEFAULT_DB)
+
+
+def _paths(output):
+    """Every string in a stage output that names an existing file or directory."""
+    if isinstance(output, str):
+        return [output] if os.path.exists(output) else []
+    if isinstance(output, dict):
+        output = list(output.values())
+    if isinstance(output, (list, tuple)):
+        return [p for item in output for p in _paths(item)]
+    return []
+
+
+def hash_artifacts(output):
+    """{path: sha1} for the files in a stage output (directories: their .wav files)."""
+    hashes = {}
+    for p in _paths(output):
+        if os.path.isdir(p):
+            # only the audio: analysis sidecars next to the stems change later
+            for f in sorted(Path(p).glob("*.wav")):
+                if f.is_file():
+                    hashes[str(f)] = content_hash(f)
+        else:
+            hashes[p] = content_hash(p)
+    return hashes
+
+
+def fingerprint(inputs):
+    """Stable string for a stage's inputs: the values plus the hashes of the files they name."""
+    return json.dumps({"values": inputs, "files": hash_artifacts(inputs)}, sort_keys=True, default=str)
+
+
+def request_key(song, params):
+    """Cache key of a request: song contents + canonical parameters + RESULT_VERSION."""
+    blob = json.dumps({"song": content_hash(song), "params": params, "v": RESULT_VERSION},
+                      sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+
+def seed_for(key):
+    return int(key[:8], 16)
+
+
+def artifacts_valid(hashes):
+    for p, h in (hashes or {}).items():
+        try:
+            if content_hash(p) != h:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+class JobStore:
+    """Thin SQLite wrapper; one short-lived connection per call (safe across threads and processes)."""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else default_db()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        con = self._connect()
+        try:
+            con.executescript(_SCHEMA)
+        finally:
+            con.close()
+
+    def _connect(self):
+        con = sqlite3.connect(str(self.path), timeout=30)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    def _exec(self, sql, args=()):
+        con = self._connect()
+        try:
+            with con:
+                return con.execute(sql, args).rowcount
+        finally:
+            con.close()
+
+    def _query(self, sql, args=()):
+        con = self._connect()
+        try:
+            return [dict(r) for r in con.execute(sql, args).fetchall()]
+        finally:
+            con.close()
+
+    # ---- jobs ----
+    def create_job(self, song, out_dir, params, job_id=None):
+        job_id = job_id or uuid.uuid4().hex[:12]
+        now = time.time()
+        self._exec("INSERT INTO jobs (id, song, out_dir, params, status, created, updated) VALUES (?,?,?,?,?,?,?)",
+                   (job_id, str(song), str(out_dir), json.dumps(params), QUEUED, now, now))
+        return job_id
+
+    @staticmethod
+    def _job(row):
+        for k in ("params", "result"):
+            row[k] = json.loads(row[k]) if row.get(k) else None
+        row["cancel"] = bool(row["cancel"])
+        return row
+
+    def get_job(self, job_id, stages=False):
+        rows = self._query("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = self._job(rows[0])
+        if stages:
+            job["stages"] = self.list_stages(job_id)
+        return job
+
+    def list_jobs(self, status=None, limit=100):
+        if status:
+            rows = self._query("SELECT * FROM jobs WHERE status = ? ORDER BY created DESC LIMIT ?", (status, limit))
+        else:
+            rows = self._query("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,))
+        return [self._job(r) for r in rows]
+
+    def set_status(self, job_id, status, error=None, result=None):
+        self._exec("UPDATE jobs SET status = ?, error = ?, result = COALESCE(?, result), updated = ? WHERE id = ?",
+                   (status, error, json.dumps(result) if result is not None else None, time.time(), job_id))
+
+    def request_cancel(self, job_id):
+        """Flag a job for cancellation; queued jobs are cancelled right away. Returns False if unknown."""
+        now = time.time()
+        n = self._exec("UPDATE jobs SET cancel = 1, updated = ? WHERE id = ?", (now, job_id))
+        self._exec("UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status IN (?, ?)",
+                   (CANCELLED, now, job_id, QUEUED, INTERRUPTED))
+        return n > 0
+
+    def cancel_requested(self, job_id):
+        rows = self._query("SELECT cancel FROM jobs WHERE id = ?", (job_id,))
+        return bool(rows and rows[0]["cancel"])
+
+    def prepare_retry(self, job_id):
+        """Re-queue a job: clear the cancel flag and forget every stage that did not finish."""
+        self._exec("DELETE FROM stages WHERE job_id = ? AND status != ?", (job_id, DONE))
+        self._exec("UPDATE jobs SET status = ?, error = NULL, cancel = 0, updated = ? WHERE id = ?",
+                   (QUEUED, time.time(), job_id))
+
+    def mark_interrupted(self):
+        """On startup: jobs left running/queued by a dead process become `interrupted`."""
+        now = time.time()
+        self._exec("UPDATE stages SET status = ?, finished = ? WHERE status = ?", (INTERRUPTED, now, RUNNING))
+        return self._exec("UPDATE jobs SET status = ?, updated = ? WHERE status IN (?, ?)",
+                          (INTERRUPTED, now, RUNNING, QUEUED))
+
+    # ---- result cache ----
+    def put_result(self, key, job_id, result):
+        self._exec("INSERT OR REPLACE INTO results (key, job_id, result, artifacts, created) VALUES (?,?,?,?,?)",
+                   (key, job_id, json.dumps(result), json.dumps(hash_artifacts(result)), time.time()))
+
+    def cached_result(self, key):
+        """{"job_id", "result"} for `key` if every artifact is still intact, else None."""
+        rows = self._query("SELECT job_id, result, artifacts FROM results WHERE key = ?", (key,))
+        if not rows:
+            return None
+        if not artifacts_valid(json.loads(rows[0]["artifacts"])):
+            self._exec("DELETE FROM results WHERE key = ?", (key,))
+            return None
+        return {"job_id": rows[0]["job_id"], "result": json.loads(rows[0]["result"])}
+
+    # ---- stage cache (across jobs) ----
+    def put_stage_cache(self, key, name, job_id, output, artifacts):
+        self._exec("INSERT OR REPLACE INTO stage_cache (key, name, job_id, output, artifacts, created) "
+                   "VALUES (?,?,?,?,?,?)",
+                   (key, name, job_id, json.dumps(output), json.dumps(artifacts), time.time()))
+
+    def cached_stage(self, key):
+        """{"job_id", "output", "artifacts"} of a finished stage with `key` whose files are intact, else None."""
+        rows = self._query("SELECT job_id, output, artifacts FROM stage_cache WHERE key = ?", (key,))
+        if not rows:
+            return None
+        artifacts = json.loads(rows[0]["artifacts"])
+        if not artifacts_valid(artifacts):
+            self._exec("DELETE FROM stage_cache WHERE key = ?", (key,))
+            return None
+        return {"job_id": rows[0]["job_id"], "output": json.loads(rows[0]["output"]), "artifacts": artifacts}
+
+    # ---- stages ----
+    def list_stages(self, job_id):
+        rows = self._query("SELECT * FROM stages WHERE job_id = ? ORDER BY started", (job_id,))
+        for r in rows:
+            r["output"] = json.loads(r["output"]) if r["output"] else None
+            r["artifacts"] = json.loads(r["artifacts"]) if r["artifacts"] else {}
+        return rows
+
+    def get_stage(self, job_id, name):
+        for r in self.list_stages(job_id):
+            if r["name"] == name:
+                return r
+        return None
+
+    def start_stage(self, job_id, name, inputs=None):
+        self._exec("INSERT OR REPLACE INTO stages (job_id, name, status, inputs, started) VALUES (?,?,?,?,?)",
+                   (job_id, name, RUNNING, inputs, time.time()))
+
+    def finish_stage(self, job_id, name, output, artifacts):
+        self._exec("UPDATE stages SET status = ?, output = ?, artifacts = ?, error = NULL, finished = ? "
+                   "WHERE job_id = ? AND name = ?",
+                   (DONE, json.dumps(output), json.dumps(artifacts), time.time(), job_id, name))
+
+    def fail_stage(self, job_id, name, error, status=FAILED):
+        self._exec("UPDATE stages SET status = ?, error = ?, finished = ? WHERE job_id = ? AND name = ?",
+                   (status, str(error), time.time(), job_id, name))
+
+
+class StageRunner:
+    """
+    Checkpointing wrapper for pipeline stages:
+    runner(name, fn, inputs) -> fn() or the stored output.
+    With a `cache_key` (StageGraph) the stage is also looked up in, and
+    added to, the cross-job stage cache.
+    Without a store nothing is checkpointed, but cancellation and timeouts
+    still apply.
+    """
+
+    def __init__(self, store=None, job_id=None, log=print, token=None, timeouts=None):
+        self.store = store
+        self.job_id = job_id
+        self.log = log
+        self.token = token or CancelToken(job_id=job_id, store=store)
+        self.timeouts = dict(STAGE_TIMEOUTS, **(timeouts or {}))
+        self._lock = threading.Lock()
+        self.failed = []
+
+    def check_cancelled(self):
+        self.token.check()
+
+    def _run(self, name, fn):
+        token = self.token.child(self.timeouts.get(name.rsplit("/", 1)[-1]), stage=name)
+        with use_token(token):
+            return fn()
+
+    def __call__(self, name, fn, inputs=None, cache_key=None):
+        self.check_cancelled()
+        if self.store is None:
+            return self._run(name, fn)
+        key = cache_key or fingerprint(inputs)
+        row = self.store.get_stage(self.job_id, name)
+        if row and row["status"] == DONE and row["inputs"] == key and artifacts_valid(row["artifacts"]):
+            self.log(f"[JOB] {self.job_id}: stage {name} done, skipping")
+            return row["output"]
+        self.store.start_stage(self.job_id, name, key)
+        hit = self.store.cached_stage(cache_key) if cache_key else None
+        if hit is not None:
+            self.log(f"[JOB] {self.job_id}: stage {name} unchanged, reusing job {hit['job_id']}")
+            self.store.finish_stage(self.job_id, name, hit["output"], hit["artifacts"])
+            return hit["output"]
+        try:
+            out = self._run(name, fn)
+        except JobCancelled as e:
+            self.store.fail_stage(self.job_id, name, e, status=CANCELLED)
+            raise
+        except Exception as e:
+            self.store.fail_stage(self.job_id, name, e)
+            with self._lock:
+                self.failed.append(name)
+            raise
+        artifacts = hash_artifacts(out)
+        self.store.finish_stage(self.job_id, name, out, artifacts)
+        if cache_key:
+            self.store.put_stage_cache(cache_key, name, self.job_id, out, artifacts)
+        return out
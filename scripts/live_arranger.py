@@ -0,0 +1,239 @@
+# scripts/live_arranger.py
+"""
+Live (streaming) arrangement.
+
+The offline pipeline works on whole files. LiveArranger takes microphone
+audio block by block and answers every block with the MIDI events of the
+accompaniment, keeping only windowed state:
+
+  - chords   StreamingChordDetector: STFT chroma over a sliding window
+             (the major/minor templates of chords.py), with a
+             short hold so one noisy frame does not flip the chord
+  - energy   energy_sections.StreamingEnergySegmenter (one-pole smoothing,
+             percentile thresholds over recent history)
+  - pitch    YIN on the newest frame (for display / follow modes)
+  - drums    drum_engine.drum_events_window: the groove for the next
+             `lookahead` seconds at the current energy state
+
+Latency is one block plus the processing time (a few ms per block); with
+blocks of <= 100 ms the answer arrives well under 200 ms. Chord notes are
+stamped with the time the change was detected, drum hits are scheduled
+`lookahead` seconds ahead so they land on the grid.
+
+Usage:
+    live = LiveArranger(sr=16000, tempo=120)
+    msg = live.push(block)        # {"t", "chord", "state", "pitch", "events", "latency_ms"}
+    msg = live.close()            # note-offs for everything still sounding
+"""
+
+import time
+from collections import deque
+
+import numpy as np
+import librosa
+
+try:
+    from scripts.energy_sections import StreamingEnergySegmenter
+    from scripts.drum_engine import drum_events_window
+    from scripts.audio_store import ANALYSIS_SR
+    from scripts.chords import CHORD_TEMPLATES, CHORD_LABELS
+except Exception:
+    from energy_sections import StreamingEnergySegmenter
+    from drum_engine import drum_events_window
+    from audio_store import ANALYSIS_SR
+    from chords import CHORD_TEMPLATES, CHORD_LABELS
+
+DEFAULT_TEMPO = 120
+LOOKAHEAD_SEC = 0.1
+CHORD_WINDOW_SEC = 0.75
+CHORD_HOLD_FRAMES = 2          # frames a new chord must win before it is taken
+SILENCE_RMS = 1e-3
+
+PAD_CHANNEL = 0
+BASS_CHANNEL = 1
+DRUM_CHANNEL = 9
+PAD_VELOCITY = 64
+BASS_VELOCITY = 84
+
+
+def decode_pcm(data, fmt="f32"):
+    """Mono samples from a binary frame: little-endian float32 ('f32') or int16 ('s16')."""
+    if fmt == "s16":
+        return np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+    return np.frombuffer(data, dtype="<f4").astype(np.float32, copy=False)
+
+
+def chord_notes(label):
+    """(pad triad, bass root) MIDI notes; same voicing as the offline arrangers."""
+    root, quality = label.split(":")
+    r = 60 + int(root)
+    triad = [r, r + 4, r + 7] if quality == "maj" else [r, r + 3, r + 7]
+    return triad, r - 12
+
+
+class StreamingChordDetector:
+    """
+    push(samples) -> [(time, label), ...] chord changes, newest state in
+    .label. Chroma frames are n_fft long every `hop` samples; the decision
+    uses the mean chroma of the last `window_sec` seconds.
+    """
+
+    def __init__(self, sr=ANALYSIS_SR, window_sec=CHORD_WINDOW_SEC, hold=CHORD_HOLD_FRAMES):
+        self.sr = int(sr)
+        self.n_fft = 1 << int(np.ceil(np.log2(0.25 * self.sr)))     # ~250 ms
+        self.hop = self.n_fft // 4
+        self.hold = max(1, int(hold))
+        self._fb = librosa.filters.chroma(sr=self.sr, n_fft=self.n_fft)
+        self._win = np.hanning(self.n_fft).astype(np.float32)
+        self._frames = deque(maxlen=max(1, int(round(window_sec * self.sr / self.hop))))
+        self._sum = np.zeros(12)
+        self._tail = np.zeros(0, dtype=np.float32)
+        self._consumed = 0          # samples dropped from the front of the stream
+        self.label = None
+        self._cand = None           # [label index, frames it has won]
+
+    def _chroma(self, samples):
+        buf = np.concatenate((self._tail, samples))
+        if buf.size < self.n_fft:
+            self._tail = buf
+            return np.zeros((0, 12)), np.zeros(0)
+        n = 1 + (buf.size - self.n_fft) // self.hop
+        win = np.lib.stride_tricks.sliding_window_view(buf, self.n_fft)[::self.hop][:n]
+        rms = np.sqrt(np.mean(win.astype(np.float64) ** 2, axis=1))
+        spec = np.abs(np.fft.rfft(win * self._win, axis=1)) ** 2
+        chroma = spec @ self._fb.T
+        chroma /= np.linalg.norm(chroma, axis=1, keepdims=True) + 1e-9
+        # frame end times in the stream
+        ends = (self._consumed + np.arange(n) * self.hop + self.n_fft) / self.sr
+        self._tail = buf[n * self.hop:]
+        self._consumed += n * self.hop
+        chroma[rms < SILENCE_RMS] = 0.0
+        return chroma, ends
+
+    def push(self, samples):
+        chroma, ends = self._chroma(np.asarray(samples, dtype=np.float32).ravel())
+        changes = []
+        for vec, t in zip(chroma, ends.tolist()):
+            if len(self._frames) == self._frames.maxlen:
+                self._sum -= self._frames[0]
+            self._frames.append(vec)
+            self._sum += vec
+            if not self._sum.any():
+                continue                # silence: keep the current chord
+            best = int(np.argmax(CHORD_TEMPLATES @ self._sum))
+            if self.label is not None and CHORD_LABELS[best] == self.label:
+                self._cand = None
+                continue
+            if self._cand is not None and self._cand[0] == best:
+                self._cand[1] += 1
+            else:
+                self._cand = [best, 1]
+            if self._cand[1] >= self.hold or self.label is None:
+                self.label = CHORD_LABELS[best]
+                self._cand = None
+                changes.append((t, self.label))
+        return changes
+
+
+def frame_pitch(frame, sr, fmin=65.0, fmax=1000.0):
+    """MIDI pitch (float) of one frame with YIN, or None when it is silent."""
+    frame = np.asarray(frame, dtype=np.float32)
+    if frame.size == 0 or np.sqrt(np.mean(frame.astype(np.float64) ** 2)) < SILENCE_RMS:
+        return None
+    f0 = librosa.yin(frame, fmin=fmin, fmax=fmax, sr=sr, frame_length=frame.size, center=False)
+    f0 = float(f0[-1])
+    return round(float(librosa.hz_to_midi(f0)), 2) if np.isfinite(f0) and f0 > 0 else None
+
+
+_WARM = set()
+
+
+def _warm(sr, n):
+    """librosa.yin compiles on first use (~0.3 s); pay that before the first block, once per rate."""
+    if (sr, n) not in _WARM:
+        noise = np.random.default_rng(0).standard_normal(n).astype(np.float32) * 0.1
+        frame_pitch(noise, sr)
+        _WARM.add((sr, n))
+
+
+def _note(t, kind, channel, pitch, velocity=0):
+    return {"t": round(float(t), 4), "type": kind, "channel": int(channel),
+            "pitch": int(pitch), "velocity": int(velocity)}
+
+
+class LiveArranger:
+    """Incremental arranger; one instance per live session (not thread-safe)."""
+
+    def __init__(self, sr=ANALYSIS_SR, tempo=DEFAULT_TEMPO, groove="poprock",
+                 lookahead=LOOKAHEAD_SEC, seed=None):
+        self.sr = int(sr)
+        self.tempo = float(tempo or DEFAULT_TEMPO)
+        self.groove = groove
+        self.lookahead = float(lookahead)
+        self.chords = StreamingChordDetector(self.sr)
+        self.energy = StreamingEnergySegmenter(sr=self.sr, hop_length=max(1, self.sr // 100))
+        self.rng = np.random.default_rng(seed)
+        self.pitch_frame = 1 << int(np.ceil(np.log2(0.064 * self.sr)))   # ~64 ms
+        self._recent = np.zeros(0, dtype=np.float32)
+        self._received = 0
+        self._scheduled = 0.0       # drums are scheduled up to here
+        self._held = []             # (channel, pitch) of sounding chord notes
+        _warm(self.sr, self.pitch_frame)
+
+    @property
+    def now(self):
+        return self._received / self.sr
+
+    def _chord_events(self, t, label):
+        events = [_note(t, "note_off", ch, p) for ch, p in self._held]
+        triad, bass = chord_notes(label)
+        self._held = [(PAD_CHANNEL, p) for p in triad] + [(BASS_CHANNEL, bass)]
+        events += [_note(t, "note_on", PAD_CHANNEL, p, PAD_VELOCITY) for p in triad]
+        events.append(_note(t, "note_on", BASS_CHANNEL, bass, BASS_VELOCITY))
+        return events
+
+    def _drum_events(self, state):
+        horizon = self.now + self.lookahead
+        if horizon <= self._scheduled:
+            return []
+        ev = drum_events_window(self._scheduled, horizon, state, tempo=self.tempo,
+                                groove=self.groove, rng=self.rng)
+        self._scheduled = horizon
+        vel = np.clip(np.rint(ev["vel"]), 1, 127).astype(int).tolist()
+        events = []
+        for p, s, e, v in zip(ev["pitch"].tolist(), ev["start"].tolist(), ev["end"].tolist(), vel):
+            events.append(_note(max(s, 0.0), "note_on", DRUM_CHANNEL, p, v))
+            events.append(_note(e, "note_off", DRUM_CHANNEL, p))
+        return events
+
+    def push(self, samples):
+        """Feed one block of mono audio; returns the analysis and the new events."""
+        t0 = time.perf_counter()
+        x = np.asarray(samples, dtype=np.float32).ravel()
+        self._received += x.size
+        self._recent = np.concatenate((self._recent, x))[-self.pitch_frame:]
+
+        events = []
+        for t, label in self.chords.push(x):
+            events += self._chord_events(t, label)
+        self.energy.push(x)
+        state = self.energy.state
+        events += self._drum_events(1 if state is None else state)
+        events.sort(key=lambda e: e["t"])
+
+        pitch = frame_pitch(self._recent, self.sr) if self._recent.size == self.pitch_frame else None
+        return {
+            "t": round(self.now, 4),
+            "chord": self.chords.label,
+            "state": state,
+            "pitch": pitch,
+            "events": events,
+            "latency_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+        }
+
+    def close(self):
+        """Note-offs for the chord still sounding; the session can be dropped after this."""
+        events = [_note(self.now, "note_off", ch, p) for ch, p in self._held]
+        self._held = []
+        return {"t": round(self.now, 4), "chord": self.chords.label, "state": self.energy.state,
+                "pitch": None, "events": events, "latency_ms": 0.0}
@@ -0,0 +1,156 @@
+# scripts/mixer.py
+"""
+Block-based final mixer (instruments + vocals).
+
+Both sources are streamed from disk, converted to mono and resampled on the
+fly to a common rate, summed with their gains and soft-clipped block by
+block. Peak normalization is two-pass: the first pass writes the clipped mix
+to a float32 temp file while tracking the peak, the second pass rescales it
+into the final WAV. Resampling uses the resample.py quality tiers. Memory use is bounded by the block size, so hour-long
+inputs mix with a few MB of RAM.
+
+Usage:
+    from mixer import mix_final
+    mix_final("instruments.wav", "vocals_medium.wav", "final_medium.wav")
+"""
+
+import os
+import math
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+import soundfile as sf
+
+try:
+    from scripts.resample import ratio, resample_ratio, half_zeros
+    from scripts.cancellation import current_token
+except Exception:
+    from resample import ratio, resample_ratio, half_zeros
+    from cancellation import current_token
+
+BLOCK = 65536              # output frames per block
+PEAK = 0.95
+
+
+def _read_mono(f: sf.SoundFile, start: int, stop: int) -> np.ndarray:
+    """Frames [start, stop) of `f` as mono float32, zero-filled outside the file."""
+    n = stop - start
+    out = np.zeros(n, dtype=np.float32)
+    lo, hi = max(start, 0), min(stop, f.frames)
+    if hi > lo:
+        f.seek(lo)
+        data = f.read(hi - lo, dtype="float32", always_2d=True)
+        out[lo - start:lo - start + data.shape[0]] = data.mean(axis=1)
+    return out
+
+
+def stream_mono(path: str, target_sr: int, block: int = BLOCK,
+                quality: Optional[str] = None) -> Iterator[np.ndarray]:
+    """
+    Yield consecutive mono float32 blocks of `path` resampled to `target_sr`.
+
+    Resampling is polyphase (resample.resample_ratio) on input blocks whose length
+    is a multiple of the decimation factor, with enough context on both sides
+    that the concatenated output equals resampling the whole file at once.
+    """
+    with sf.SoundFile(path) as f:
+        src_sr = f.samplerate
+        if src_sr == target_sr:
+            for start in range(0, f.frames, block):
+                yield _read_mono(f, start, min(start + block, f.frames))
+            return
+        up, down = ratio(src_sr, target_sr)
+        in_block = down * max(1, block // up)
+        # the filter spans half_zeros * max(up, down) samples each side at the
+        # upsampled rate; keep a few input samples of margin on top of it
+        pad = down * int(math.ceil((half_zeros(quality) * max(up, down) / up + 2) / down))
+        pad_out = pad * up // down
+        total_out = int(math.ceil(f.frames * up / down))
+        emitted = 0
+        for start in range(0, f.frames, in_block):
+            stop = min(start + in_block, f.frames)
+            x = _read_mono(f, start - pad, stop + pad)
+            y = resample_ratio(x, up, down, quality)
+            n_out = min(in_block * up // down, total_out - emitted)
+            out = y[pad_out:pad_out + n_out].astype(np.float32)
+            emitted += out.size
+            yield out
+
+
+def _samplerate(path: Optional[str]) -> Optional[int]:
+    if path and os.path.exists(path):
+        return int(sf.info(path).samplerate)
+    return None
+
+
+def _fixed_blocks(it: Iterator[np.ndarray], block: int) -> Iterator[np.ndarray]:
+    """Re-chunk a stream of arrays into blocks of exactly `block` samples (last one shorter)."""
+    buf = np.zeros(0, dtype=np.float32)
+    for b in it:
+        buf = np.concatenate((buf, b)) if buf.size else b
+        while buf.size >= block:
+            yield buf[:block]
+            buf = buf[block:]
+    if buf.size:
+        yield buf
+
+
+def _blocks_or_silence(path, sr, block, quality=None):
+    """Aligned blocks of `path` at `sr`, then None forever once exhausted."""
+    if path is not None:
+        for b in _fixed_blocks(stream_mono(path, sr, block, quality), block):
+            yield b
+    while True:
+        yield None
+
+
+def mix_final(instruments_wav, vocals_wav, out_wav, inst_boost=1.1, voc_boost=1.0,
+              sr=None, block=BLOCK, peak=PEAK, quality=None):
+    """
+    Mix instruments + vocals into `out_wav`.
+    Output rate: `sr` if given, else the instruments' rate (else the vocals').
+    quality: resample tier for inputs at another rate (resample.QUALITY).
+    """
+    sr_i = _samplerate(instruments_wav)
+    sr_v = _samplerate(vocals_wav)
+    if sr_i is None and sr_v is None:
+        raise FileNotFoundError("No inputs for mixing")
+    sr = int(sr or sr_i or sr_v)
+    inst_path = instruments_wav if sr_i else None
+    voc_path = vocals_wav if sr_v else None
+
+    Path(os.path.dirname(out_wav) or ".").mkdir(parents=True, exist_ok=True)
+    tmp_wav = out_wav + ".mixtmp.wav"
+    max_abs = 0.0
+    try:
+        # pass 1: gain + soft clip, stream to float temp file, track the peak
+        inst_it = _blocks_or_silence(inst_path, sr, block, quality)
+        voc_it = _blocks_or_silence(voc_path, sr, block, quality)
+        with sf.SoundFile(tmp_wav, "w", samplerate=sr, channels=1, subtype="FLOAT") as tmp:
+            token = current_token()
+            while True:
+                token.check()
+                bi, bv = next(inst_it), next(voc_it)
+                if bi is None and bv is None:
+                    break
+                n = max(bi.size if bi is not None else 0, bv.size if bv is not None else 0)
+                mix = np.zeros(n, dtype=np.float32)
+                if bi is not None:
+                    mix[:bi.size] += bi * np.float32(inst_boost)
+                if bv is not None:
+                    mix[:bv.size] += bv * np.float32(voc_boost)
+                np.tanh(mix, out=mix)
+                if n:
+                    max_abs = max(max_abs, float(np.max(np.abs(mix))))
+                tmp.write(mix)
+
+        # pass 2: peak normalize into the final file
+        scale = np.float32(peak / (max_abs + 1e-9)) if max_abs >= 1e-9 else np.float32(1.0)
+        with sf.SoundFile(tmp_wav) as src, sf.SoundFile(out_wav, "w", samplerate=sr, channels=1) as dst:
+            for data in src.blocks(blocksize=block, dtype="float32"):
+                dst.write(data * scale)
+    finally:
+        if os.path.exists(tmp_wav):
+            os.remove(tmp_wav)
+    return out_wav
@@ -0,0 +1,135 @@
+# scripts/pitch_correct.py
+"""
+Time-varying pitch correction (autotune) driven by an f0 contour.
+
+- correction_curve(): per-frame semitone correction towards the nearest
+  semitone, smoothed with a one-pole filter whose time constant is the
+  preset's retune speed (0 ms = hard snap) and scaled by `amount`
+- psola_shift(): TD-PSOLA resynthesis. Pitch marks are placed by
+  integrating the f0 contour (a fixed pseudo-period in unvoiced frames),
+  synthesis marks by integrating f0 * ratio; each synthesis mark takes the
+  two-period Hann grain around the nearest analysis mark. Grains are
+  overlap-added block by block and normalized by the summed window; frames
+  without correction crossfade back to the untouched input.
+
+The f0 contour comes from pitch_extract.extract_pitch_crepe (smoothed f0)
+and is computed once per song, then shared by every preset.
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+from scipy.signal import lfilter
+
+UNVOICED_HZ = 100.0        # pseudo pitch used to place marks in unvoiced frames
+MIN_VOICED_HZ = 40.0       # smoothed contours leak tiny values next to silence
+BLOCK_MARKS = 4096         # synthesis marks overlap-added per block
+
+
+def hz_to_midi(f0: np.ndarray) -> np.ndarray:
+    f0 = np.asarray(f0, dtype=np.float64)
+    out = np.zeros_like(f0)
+    v = f0 > 0
+    out[v] = 69.0 + 12.0 * np.log2(f0[v] / 440.0)
+    return out
+
+
+def correction_curve(f0: np.ndarray, frame_dur: float, retune_ms: float = 0.0,
+                     amount: float = 1.0) -> np.ndarray:
+    """
+    Per-frame correction in semitones (0 where unvoiced).
+    retune_ms is the time constant of the glide towards the target note.
+    """
+    f0 = np.asarray(f0, dtype=np.float64)
+    voiced = f0 > 0
+    midi = hz_to_midi(f0)
+    corr = np.where(voiced, np.round(midi) - midi, 0.0)
+    if retune_ms and retune_ms > 0:
+        a = min(1.0, frame_dur / (retune_ms / 1000.0))
+        corr = lfilter([a], [1.0, -(1.0 - a)], corr)
+        corr[~voiced] = 0.0
+    return corr * float(amount)
+
+
+def _pitch_marks(freq: np.ndarray, frame_times: np.ndarray, frame_dur: float,
+                 duration: float) -> np.ndarray:
+    """Times where the integral of `freq` crosses an integer (one mark per period)."""
+    edges = np.append(frame_times, frame_times[-1] + frame_dur)
+    phase = np.concatenate(([0.0], np.cumsum(freq * frame_dur)))
+    # extend to the end of the signal at the last frequency
+    if duration > edges[-1]:
+        edges = np.append(edges, duration)
+        phase = np.append(phase, phase[-1] + freq[-1] * (duration - edges[-2]))
+    levels = np.arange(0.0, np.floor(phase[-1]) + 1.0)
+    return np.interp(levels, phase, edges)
+
+
+def psola_shift(y: np.ndarray, sr: int, frame_times: np.ndarray, f0: np.ndarray,
+                semitones: np.ndarray) -> np.ndarray:
+    """Shift `y` by a per-frame amount (semitones) with TD-PSOLA. Length is preserved."""
+    y = np.asarray(y, dtype=np.float32)
+    n = y.size
+    frame_times = np.asarray(frame_times, dtype=np.float64)
+    if n == 0 or frame_times.size < 2 or not np.any(np.abs(semitones) > 1e-4):
+        return y.copy()
+    frame_dur = float(np.median(np.diff(frame_times)))
+    duration = n / float(sr)
+
+    freq = np.where(np.asarray(f0) > 0, f0, UNVOICED_HZ).astype(np.float64)
+    ratio = np.power(2.0, np.asarray(semitones, dtype=np.float64) / 12.0)
+    ana = _pitch_marks(freq, frame_times, frame_dur, duration)
+    syn = _pitch_marks(freq * ratio, frame_times, frame_dur, duration)
+
+    # nearest analysis mark and its local period (samples) for every synthesis mark
+    j = np.clip(np.searchsorted(ana, syn), 1, ana.size - 1)
+    j -= (syn - ana[j - 1]) < (ana[j] - syn)
+    ana_pos = np.rint(ana[j] * sr).astype(np.int64)
+    syn_pos = np.rint(syn * sr).astype(np.int64)
+    period = np.rint(sr / np.interp(ana[j], frame_times, freq)).astype(np.int64)
+    period = np.maximum(period, 8)
+
+    out = np.zeros(n, dtype=np.float64)
+    wsum = np.zeros(n, dtype=np.float64)
+    windows: Dict[int, np.ndarray] = {}
+    for b0 in range(0, syn_pos.size, BLOCK_MARKS):
+        for a_c, s_c, p in zip(ana_pos[b0:b0 + BLOCK_MARKS].tolist(),
+                               syn_pos[b0:b0 + BLOCK_MARKS].tolist(),
+                               period[b0:b0 + BLOCK_MARKS].tolist()):
+            w = windows.get(p)
+            if w is None:
+                w = windows[p] = np.hanning(2 * p + 1)
+            # clip grain to both the source and the destination range
+            lo = max(-p, -a_c, -s_c)
+            hi = min(p, n - 1 - a_c, n - 1 - s_c)
+            if hi < lo:
+                continue
+            wg = w[lo + p:hi + p + 1]
+            out[s_c + lo:s_c + hi + 1] += y[a_c + lo:a_c + hi + 1] * wg
+            wsum[s_c + lo:s_c + hi + 1] += wg
+    good = wsum > 0.1
+    out[good] /= wsum[good]
+    out[~good] = y[~good]
+    # crossfade back to the untouched signal wherever no correction is applied
+    active = np.abs(np.asarray(semitones)) > 1e-4
+    active = np.convolve(active.astype(np.float64), np.ones(5), mode="same") > 0
+    gain = np.interp(np.arange(n) / float(sr), frame_times, active.astype(np.float64))
+    return (y + gain * (out - y)).astype(np.float32)
+
+
+def correct_pitch(y: np.ndarray, sr: int, pitch: Tuple[np.ndarray, np.ndarray],
+                  retune_ms: float = 0.0, amount: float = 1.0) -> Tuple[np.ndarray, float]:
+    """
+    Apply autotune to `y` using a (times, f0_hz) contour.
+    Returns (corrected signal, mean absolute correction in cents over voiced frames).
+    """
+    times, f0 = pitch
+    times = np.asarray(times, dtype=np.float64)
+    f0 = np.nan_to_num(np.asarray(f0, dtype=np.float64).ravel(), nan=0.0)
+    f0 = np.where(f0 >= MIN_VOICED_HZ, f0, 0.0)
+    if times.size < 2 or not np.any(f0 > 0):
+        return np.asarray(y, dtype=np.float32), 0.0
+    frame_dur = float(np.median(np.diff(times)))
+    corr = correction_curve(f0, frame_dur, retune_ms=retune_ms, amount=amount)
+    voiced = f0 > 0
+    mean_cents = float(np.mean(np.abs(corr[voiced])) * 100.0) if voiced.any() else 0.0
+    return psola_shift(y, sr, times, f0, corr), mean_cents
@@ -6,6 +6,21 @@ import numpy as np
 import inspect
 from scipy.signal import medfilt, savgol_filter
 
+try:
+    from scripts.audio_store import load_audio
+    from scripts.cancellation import current_token
+    from scripts.resources import apply_current_budget
+except Exception:
+    from audio_store import load_audio
+    from cancellation import current_token
+    from resources import apply_current_budget
+
+# torch is first imported here, usually inside a running job: start at its thread budget
+apply_current_budget()
+
+CHUNK_SEC = 30.0        # CREPE runs chunk by chunk so a cancelled job stops within one chunk
+CREPE_CONTEXT = 1024    # CREPE window: every frame sees +-512 samples
+
 
 def _safe_crepe_predict(audio_tensor, sr, hop_length):
     """
@@ -14,6 +29,7 @@ def _safe_crepe_predict(audio_tensor, sr, hop_length):
       - sample_rate
       - or sr
     and calls accordingly.
+    Returns (pitch_hz, periodicity) tensors, torchcrepe's order.
     """
     sig = inspect.signature(torchcrepe.predict)
 
@@ -34,6 +50,34 @@ def _safe_crepe_predict(audio_tensor, sr, hop_length):
     return torchcrepe.predict(audio_tensor, **args)
 
 
+def _crepe_chunked(audio, sr, hop_length, chunk_sec=CHUNK_SEC):
+    """
+    _safe_crepe_predict over the whole signal in chunks of ~chunk_sec,
+    checking for cancellation in between. Each chunk carries half a window
+    of real audio on both sides, so frames match a single pass (only the
+    Viterbi decoding restarts at chunk boundaries).
+    Returns (f0, periodicity) as 1-D numpy arrays of 1 + len // hop frames.
+    """
+    audio = np.asarray(audio, dtype=np.float32)
+    n_frames = 1 + len(audio) // hop_length
+    pad_frames = int(np.ceil((CREPE_CONTEXT // 2) / hop_length))
+    pad = pad_frames * hop_length
+    padded = np.pad(audio, (pad, pad + hop_length))
+    step = max(1, int(chunk_sec * sr) // hop_length)
+    f0s, per = [], []
+    for f_start in range(0, n_frames, step):
+        current_token().check()
+        f_stop = min(f_start + step, n_frames)
+        # frame f is centred on sample f * hop = padded[f * hop + pad]
+        seg = padded[f_start * hop_length:(f_stop - 1) * hop_length + 2 * pad + 1]
+        f, p = _safe_crepe_predict(torch.tensor(seg).unsqueeze(0), sr=sr, hop_length=hop_length)
+        f = f.squeeze(0).cpu().numpy()
+        p = p.squeeze(0).cpu().numpy()
+        f0s.append(f[pad_frames:pad_frames + f_stop - f_start])
+        per.append(p[pad_frames:pad_frames + f_stop - f_start])
+    return np.concatenate(f0s), np.concatenate(per)
+
+
 def _smooth_f0(f0, confidence,
                conf_thresh=0.2,
                median_kernel=3,
@@ -99,16 +143,10 @@ def extract_pitch_crepe(
     """
 
     # ---- Load audio ----
-    audio, _ = librosa.load(wav_file, sr=sr, mono=True)
-    audio_tensor = torch.tensor(audio).unsqueeze(0)
-
-    # ---- CREPE pitch extraction (raw + confidence) ----
-    periodicity, f0 = _safe_crepe_predict(audio_tensor,
-                                          sr=sr,
-                                          hop_length=hop_length)
+    audio, _ = load_audio(wav_file, sr=sr)
 
-    f0_raw = f0.squeeze(0).cpu().numpy()
-    confidence = periodicity.squeeze(0).cpu().numpy()
+    # ---- CREPE pitch extraction (raw + confidence), chunked for cancellation ----
+    f0_raw, confidence = _crepe_chunked(audio, sr, hop_length)
 
     # ---- Time axis ----
     times = np.arange(len(f0_raw)) * (hop_length / sr)
@@ -0,0 +1,81 @@
+# scripts/resample.py
+"""
+Polyphase resampling with selectable quality.
+
+Every rate conversion goes through scipy's resample_poly with a Kaiser
+low-pass whose length and attenuation depend on the tier:
+
+    fast      short filter (4 zero crossings, beta 5)  - previews, analysis drafts
+    balanced  scipy's default filter (10, beta 5)     - default
+    hq        long filter (32, beta 9)                 - final renders
+
+The default tier comes from HARMONIA_RESAMPLE_QUALITY. Results are cached
+per source and target rate by audio_store.load_audio; the mixer streams
+with the same filters.
+"""
+
+import os
+import math
+from functools import lru_cache
+
+import numpy as np
+from scipy.signal import firwin, resample_poly
+
+# tier -> (filter half-length in zero crossings, kaiser beta)
+QUALITY = {
+    "fast": (4, 5.0),
+    "balanced": (10, 5.0),
+    "hq": (32, 9.0),
+}
+DEFAULT_QUALITY = "balanced"
+
+
+def default_quality():
+    q = os.environ.get("HARMONIA_RESAMPLE_QUALITY", DEFAULT_QUALITY)
+    return q if q in QUALITY else DEFAULT_QUALITY
+
+
+def resolve_quality(quality=None):
+    if quality is None:
+        return default_quality()
+    if quality not in QUALITY:
+        raise ValueError(f"unknown resample quality {quality!r} (choose from {', '.join(QUALITY)})")
+    return quality
+
+
+def ratio(src_sr, dst_sr):
+    """(up, down) with dst_sr / src_sr == up / down in lowest terms."""
+    g = math.gcd(int(src_sr), int(dst_sr))
+    return int(dst_sr) // g, int(src_sr) // g
+
+
+def half_zeros(quality=None):
+    return QUALITY[resolve_quality(quality)][0]
+
+
+@lru_cache(maxsize=32)
+def _filter(up, down, quality):
+    zeros, beta = QUALITY[quality]
+    max_rate = max(up, down)
+    return firwin(2 * zeros * max_rate + 1, 1.0 / max_rate, window=("kaiser", beta))
+
+
+def filter_taps(up, down, quality=None):
+    """Low-pass FIR for an up/down conversion (resample_poly scales it by `up`)."""
+    return _filter(int(up), int(down), resolve_quality(quality))
+
+
+def resample_ratio(x, up, down, quality=None):
+    """resample_poly(x, up, down) with the tier's filter, as float32."""
+    if up == down:
+        return np.asarray(x, dtype=np.float32)
+    h = filter_taps(up, down, quality)
+    return resample_poly(np.asarray(x, dtype=np.float32), up, down, window=h).astype(np.float32, copy=False)
+
+
+def resample(y, orig_sr, target_sr, quality=None):
+    """Resample a mono signal from orig_sr to target_sr (integer rates)."""
+    if int(orig_sr) == int(target_sr):
+        return np.asarray(y, dtype=np.float32)
+    up, down = ratio(orig_sr, target_sr)
+    return resample_ratio(y, up, down, quality)
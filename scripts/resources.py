@@ -0,0 +1,212 @@
+# scripts/resources.py
+"""
+CPU / thread budgets for pipeline jobs.
+
+Without limits every concurrent job lets torch, OpenMP/BLAS and numba start
+one thread per core, and a few jobs at once thrash the machine. The
+ResourceManager caps concurrent jobs and gives each one a thread budget:
+
+    threads_per_job = cpus // max_jobs
+
+thread_budget(n) pins torch intra-op threads, BLAS/OpenMP pools (through
+threadpoolctl when installed) and numba while any job holds a budget, and
+modules that import torch lazily call apply_current_budget() right after
+the import so it starts pinned too. numba's thread count is per calling
+thread: the budget covers numba parallel code run from the job's own
+thread (where the pipeline stages run); other threads keep the process
+default (NUMBA_NUM_THREADS, which pool workers set from the budget). And
+subprocess_env(n) passes the same limits to demucs / fluidsynth children.
+
+Configuration (environment):
+    HARMONIA_MAX_JOBS         concurrent jobs (default: pool size, else cpus // 4)
+    HARMONIA_THREADS_PER_JOB  override the computed per-job budget
+"""
+
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMBA_NUM_THREADS",
+)
+
+
+def cpu_count():
+    """CPUs this process may run on (respects affinity / cgroup cpusets)."""
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except (AttributeError, OSError):
+        return max(1, os.cpu_count() or 1)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def set_thread_env(n, env=None):
+    """Write the thread-count variables into `env` (default os.environ). Returns env."""
+    env = os.environ if env is None else env
+    for var in THREAD_ENV_VARS:
+        env[var] = str(int(n))
+    return env
+
+
+def subprocess_env(n=None):
+    """Environment for child processes (demucs, fluidsynth) limited to `n` threads."""
+    env = dict(os.environ)
+    if n:
+        set_thread_env(n, env)
+    return env
+
+
+def _torch():
+    # only touch torch if something already imported it; never import it here
+    return sys.modules.get("torch")
+
+
+def _set_numba_threads(n):
+    numba = sys.modules.get("numba")
+    if numba is None:
+        return None
+    try:
+        prev = numba.get_num_threads()
+        numba.set_num_threads(max(1, min(int(n), numba.config.NUMBA_NUM_THREADS)))
+        return prev
+    except Exception:
+        return None
+
+
+def _pin(n):
+    torch = _torch()
+    if torch is not None:
+        torch.set_num_threads(n)
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=n)
+    except Exception:
+        pass
+    _set_numba_threads(n)
+
+
+def apply_thread_budget(n):
+    """Process-wide pin of torch / BLAS / numba threads to `n` (no restore)."""
+    n = max(1, int(n))
+    _BUDGET["process"] = n
+    _pin(n)
+
+
+# torch / BLAS / numba thread counts are process-wide: overlapping in-process
+# jobs share one setting, saved by the first job in and restored by the last out
+_BUDGET_LOCK = threading.Lock()
+_BUDGET = {"active": 0, "n": None, "torch": None, "numba": None, "limiter": None, "process": None}
+
+
+def apply_current_budget():
+    """
+    Pin libraries imported after the budget was set (torch is imported
+    lazily, inside the job) to the active job budget, else to the process
+    budget of a pool worker. No-op without a budget.
+    """
+    with _BUDGET_LOCK:
+        if _BUDGET["active"]:
+            n = _BUDGET["n"]
+            torch = _torch()
+            if torch is not None and _BUDGET["torch"] is None:
+                # imported inside the job: restore its own default when the last job ends
+                _BUDGET["torch"] = torch.get_num_threads()
+        else:
+            n = _BUDGET["process"]
+        if n:
+            _pin(n)
+
+
+@contextmanager
+def thread_budget(n):
+    """Pin torch / BLAS / numba threads to `n` inside the block; restored when no job holds a budget."""
+    if not n:
+        yield
+        return
+    n = max(1, int(n))
+    with _BUDGET_LOCK:
+        torch = _torch()
+        if _BUDGET["active"] == 0:
+            _BUDGET["torch"] = torch.get_num_threads() if torch is not None else None
+            _BUDGET["numba"] = _set_numba_threads(n)
+            try:
+                from threadpoolctl import threadpool_limits
+                _BUDGET["limiter"] = threadpool_limits(limits=n)
+            except Exception:
+                _BUDGET["limiter"] = None
+        else:
+            # libraries imported by a running job since the first one entered
+            _pin(n)
+        if torch is not None:
+            torch.set_num_threads(n)
+        _BUDGET["active"] += 1
+        _BUDGET["n"] = n
+    try:
+        yield
+    finally:
+        with _BUDGET_LOCK:
+            _BUDGET["active"] -= 1
+            if _BUDGET["active"] == 0:
+                if _BUDGET["limiter"] is not None:
+                    _BUDGET["limiter"].restore_original_limits()
+                if _BUDGET["numba"] is not None:
+                    _set_numba_threads(_BUDGET["numba"])
+                torch = _torch()
+                if _BUDGET["torch"] is not None and torch is not None:
+                    torch.set_num_threads(_BUDGET["torch"])
+                _BUDGET.update(n=None, torch=None, numba=None, limiter=None)
+
+
+class ResourceManager:
+    """Caps concurrent jobs and hands each one a thread budget."""
+
+    def __init__(self, max_jobs=None, threads_per_job=None, cpus=None):
+        self.cpus = int(cpus or cpu_count())
+        self.max_jobs = max(1, int(max_jobs or _env_int("HARMONIA_MAX_JOBS", max(1, self.cpus // 4))))
+        default_threads = max(1, self.cpus // self.max_jobs)
+        self.threads_per_job = max(1, int(threads_per_job or _env_int("HARMONIA_THREADS_PER_JOB", default_threads)))
+        self._sem = threading.BoundedSemaphore(self.max_jobs)
+        self._lock = threading.Lock()
+        self.active = 0
+
+    @contextmanager
+    def job(self):
+        """Block until a job slot is free; yields the job's thread budget."""
+        self._sem.acquire()
+        with self._lock:
+            self.active += 1
+        try:
+            yield self.threads_per_job
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._sem.release()
+
+    def config(self):
+        return {
+            "cpus": self.cpus,
+            "max_jobs": self.max_jobs,
+            "threads_per_job": self.threads_per_job,
+            "active_jobs": self.active,
+            "threadpoolctl": _has_threadpoolctl(),
+        }
+
+
+def _has_threadpoolctl():
+    try:
+        import threadpoolctl  # noqa: F401
+        return True
+    except Exception:
+        return False
@@ -0,0 +1,216 @@
+# scripts/song_analysis.py
+"""
+Per-song analysis shared by every arranger.
+
+analyze_song(stem) loads the melody stem once and computes
+  - tempo + beat grid   (tempo_beats.analyze_tempo)
+  - chord segments      (chords.decode_chords)
+  - energy sections     (energy_sections.sections_from_rms)
+the last two on chroma / RMS pooled per half beat (features.pooled_features)
+rather than on the 100 frames per second of the analysis hop,
+and caches the result in memory (the CACHE_ENTRIES most recently used
+analyses and contours) and in a JSON file next to the stem, so
+re-arranging the same song (other style, other mixer) skips the analysis.
+The 'fast' tier (features.ANALYSIS_TIERS) trades chord accuracy for a
+roughly 10x cheaper chroma front end; each tier has its own cache entry.
+
+vocal_pitch(stem) caches the smoothed CREPE f0 contour the same way
+(<stem>.f0.npz), so every autotune preset reuses one pitch analysis.
+"""
+
+import os
+import sys
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import librosa
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+try:
+    from scripts.energy_sections import sections_from_rms
+    from scripts.tempo_beats import analyze_tempo
+    from scripts.audio_store import load_audio, ANALYSIS_SR
+    from scripts.chords import detect_chords, decode_chords, FALLBACK_LABEL
+    from scripts.features import pooled_features, resolve_tier, ANALYSIS_TIERS, DEFAULT_ANALYSIS_TIER
+except Exception:
+    from energy_sections import sections_from_rms
+    from tempo_beats import analyze_tempo
+    from audio_store import load_audio, ANALYSIS_SR
+    from chords import detect_chords, decode_chords, FALLBACK_LABEL
+    from features import pooled_features, resolve_tier, ANALYSIS_TIERS, DEFAULT_ANALYSIS_TIER
+
+SR = ANALYSIS_SR
+HOP = 160
+ANALYSIS_VERSION = 3     # 2: Viterbi-smoothed chords, 3: beat-pooled chords + sections
+PITCH_VERSION = 2        # 2: CREPE pitch / periodicity read in the right order
+
+CACHE_ENTRIES = 64       # analyses + f0 contours kept in memory (least recently used dropped)
+
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def _cache_get(key):
+    with _CACHE_LOCK:
+        res = _CACHE.get(key)
+        if res is not None:
+            _CACHE.move_to_end(key)
+        return res
+
+def _cache_put(key, res):
+    with _CACHE_LOCK:
+        _CACHE[key] = res
+        _CACHE.move_to_end(key)
+        while len(_CACHE) > CACHE_ENTRIES:
+            _CACHE.popitem(last=False)
+
+# -------------------------
+# Chord detection (robust)
+# returns list of (start, end, label)
+# -------------------------
+def detect_chords_fixed(y, sr=SR, hop_length=HOP, beats=None):
+    """Return list of (start, end, label) with guaranteed shape (HMM-smoothed, see chords.py)."""
+    if len(y) < hop_length * 2:
+        return [(0.0, float(len(y)/sr), FALLBACK_LABEL)]
+    clean = detect_chords(y, sr, hop_length=hop_length, beats=beats)
+    if not clean:
+        clean = [(0.0, float(len(y)/sr), FALLBACK_LABEL)]
+    return clean
+
+# -------------------------
+# Cached analysis
+# -------------------------
+def _cache_key(path, sr, hop_length):
+    st = os.stat(path)
+    return f"v{ANALYSIS_VERSION}:{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}:{sr}:{hop_length}"
+
+def _cache_file(path, tier=DEFAULT_ANALYSIS_TIER):
+    suffix = "" if tier == DEFAULT_ANALYSIS_TIER else "." + tier
+    return str(path) + f".analysis{suffix}.json"
+
+def _to_json(res):
+    return {
+        "duration": res["duration"],
+        "tempo": res["tempo"],
+        "beats": [round(float(b), 4) for b in res["beats"]],
+        "chords": [[float(s), float(e), str(l)] for s, e, l in res["chords"]],
+        "sections": [[float(s), float(e), int(st)] for s, e, st in res["sections"]],
+    }
+
+def _from_json(d):
+    return {
+        "duration": float(d["duration"]),
+        "tempo": float(d["tempo"]),
+        "beats": np.asarray(d["beats"], dtype=float),
+        "chords": [(float(s), float(e), str(l)) for s, e, l in d["chords"]],
+        "sections": [(float(s), float(e), int(st)) for s, e, st in d["sections"]],
+    }
+
+def compute_analysis(y, sr=SR, hop_length=HOP, tier=None):
+    """Run all analysis stages on an already-loaded mono signal (chroma front end of `tier`)."""
+    opts = ANALYSIS_TIERS[resolve_tier(tier)]
+    tempo, beats = analyze_tempo(y, sr)
+    duration = float(len(y) / sr)
+    if len(y) < hop_length * 2:
+        chords = [(0.0, duration, FALLBACK_LABEL)]
+        sections = [(0.0, duration, 2)]
+    else:
+        # chords and sections on beat-synchronous (eighth-note) frames
+        feats = pooled_features(y, sr, hop_length, beats=beats, tempo=tempo,
+                                chroma_kind=opts["chroma"], n_fft=opts.get("n_fft"))
+        chords = decode_chords(feats["chroma"], feats["bounds"]) or [(0.0, duration, FALLBACK_LABEL)]
+        sections = sections_from_rms(feats["rms"], feats["bounds"])
+    return {
+        "duration": duration,
+        "tempo": float(tempo),
+        "beats": np.asarray(beats, dtype=float),
+        "chords": chords,
+        "sections": sections,
+    }
+
+def analyze_song(stem_path, sr=None, hop_length=None, use_cache=True, tier=None):
+    """
+    Cached analysis of a melody stem.
+    `tier` is 'full' or 'fast' (default: HARMONIA_ANALYSIS_TIER, else 'full');
+    sr / hop_length default to the tier's.
+    Returns dict: duration, tempo (bpm), beats (np.ndarray of s), chords, sections.
+    """
+    tier = resolve_tier(tier)
+    sr = sr or ANALYSIS_TIERS[tier]["sr"]
+    hop_length = hop_length or ANALYSIS_TIERS[tier]["hop"]
+    key = f"{_cache_key(stem_path, sr, hop_length)}:{tier}"
+    if use_cache:
+        res = _cache_get(key)
+        if res is not None:
+            return res
+        try:
+            with open(_cache_file(stem_path, tier), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("key") == key:
+                res = _from_json(stored["analysis"])
+                _cache_put(key, res)
+                return res
+        except (OSError, ValueError, KeyError):
+            pass
+
+    y, sr = load_audio(stem_path, sr=sr)
+    res = compute_analysis(y, sr=sr, hop_length=hop_length, tier=tier)
+    _cache_put(key, res)
+    try:
+        tmp = _cache_file(stem_path, tier) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "analysis": _to_json(res)}, f)
+        os.replace(tmp, _cache_file(stem_path, tier))
+    except OSError:
+        pass
+    return res
+
+
+# -------------------------
+# Cached vocal pitch (CREPE)
+# -------------------------
+def _pitch_file(path):
+    return str(path) + ".f0.npz"
+
+def vocal_pitch(stem_path, use_cache=True, compute=True):
+    """
+    Smoothed CREPE contour of a vocal stem as (times, f0_hz); unvoiced frames are 0.
+    With compute=False only a cached contour is returned (None if there is none).
+    """
+    key = f"f0:v{PITCH_VERSION}:" + _cache_key(stem_path, SR, HOP)
+    if use_cache:
+        res = _cache_get(key)
+        if res is not None:
+            return res
+        try:
+            with np.load(_pitch_file(stem_path), allow_pickle=False) as z:
+                if str(z["key"]) == key:
+                    res = (z["times"], z["f0"])
+                    _cache_put(key, res)
+                    return res
+        except (OSError, ValueError, KeyError):
+            pass
+
+    if not compute:
+        return None
+    # torch / torchcrepe are heavy: import only when a contour is actually needed
+    try:
+        from scripts.pitch_extract import extract_pitch_crepe
+    except Exception:
+        from pitch_extract import extract_pitch_crepe
+    times, _f0_raw, f0_smooth, _conf = extract_pitch_crepe(stem_path, hop_length=HOP, sr=SR)
+    res = (np.asarray(times, dtype=float), np.nan_to_num(np.asarray(f0_smooth, dtype=float), nan=0.0))
+    _cache_put(key, res)
+    try:
+        tmp = _pitch_file(stem_path) + ".tmp.npz"
+        np.savez(tmp, key=np.array(key), times=res[0], f0=res[1])
+        os.replace(tmp, _pitch_file(stem_path))
+    except OSError:
+        pass
+    return res
@@ -0,0 +1,366 @@
+# scripts/song_index.py
+"""
+Catalog index of analysed songs (SQLite).
+
+Every finished job adds its song's features, computed from the analysis
+and pitch contour the job already has (nothing is re-analysed for the
+index, and catalog queries only read the index):
+
+    songs(song, path, title, duration, tempo, key, key_conf, chords,
+          energy, vocal_low, vocal_high, analysis_version, version, updated)
+    ngrams(song, n, gram, count)
+
+  - key         Krumhansl-Schmuckler estimate from the chord segments
+                (triad pitch classes weighted by duration), "<root>:<maj|min>"
+  - chords      the chord sequence with repeats merged
+  - ngrams      2/3/4-chord windows of that sequence, transposed to the key
+                ("0:maj 7:maj 9:min" is I-V-vi in any key), with counts
+  - energy      ENERGY_BINS section states (0/1/2) over the song's length
+  - vocal range 5th / 95th percentile of the voiced f0, MIDI
+
+A song's id is the sha1 of its audio; update() is a no-op when the row
+is current, so re-running a song costs nothing.
+
+Queries:
+    idx = SongIndex()
+    idx.similar_progressions(song_id, n=3)        # cosine over transposed n-grams
+    idx.compatible(song_id)                       # same / relative / fifth-related keys, close tempo
+    idx.search(key="9:min", tempo=(90, 110), vocal_range=(55, 76))
+
+    HARMONIA_INDEX_DB=<file>   database location (default: <project>/cache/index.sqlite3)
+"""
+
+import os
+import json
+import time
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from scripts.audio_store import content_hash
+except Exception:
+    from audio_store import content_hash
+
+ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_DB = ROOT / "cache" / "index.sqlite3"
+
+INDEX_VERSION = 2       # bump when the stored features change (2: vocal range from f0 in Hz)
+NGRAM_SIZES = (2, 3, 4)
+ENERGY_BINS = 16
+TEMPO_TOLERANCE = 0.06  # relative
+MIN_VOICED_HZ = 40.0    # smoothed contours leak tiny values next to silence
+MIDI_RANGE = (0.0, 127.0)
+
+# Krumhansl-Kessler key profiles (C major / C minor)
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    song TEXT PRIMARY KEY,
+    path TEXT,
+    title TEXT,
+    duration REAL,
+    tempo REAL,
+    key TEXT,
+    key_conf REAL,
+    chords TEXT,
+    energy TEXT,
+    vocal_low REAL,
+    vocal_high REAL,
+    analysis_version TEXT,
+    version INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ngrams (
+    song TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    gram TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (song, n, gram)
+);
+CREATE INDEX IF NOT EXISTS ngrams_gram ON ngrams(n, gram);
+CREATE INDEX IF NOT EXISTS songs_key ON songs(key);
+CREATE INDEX IF NOT EXISTS songs_tempo ON songs(tempo);
+"""
+
+
+def default_db():
+    return Path(os.environ.get("HARMONIA_INDEX_DB") or DEFAULT_DB)
+
+
+# -------------------------
+# Features
+# -------------------------
+def _parse(label):
+    root, quality = str(label).split(":")
+    return int(root) % 12, quality
+
+
+def estimate_key(chords):
+    """(key label, correlation) from chord segments [(start, end, label)]."""
+    hist = np.zeros(12)
+    for s, e, label in chords:
+        root, quality = _parse(label)
+        third = 4 if quality == "maj" else 3
+        hist[[root, (root + third) % 12, (root + 7) % 12]] += max(float(e) - float(s), 0.0)
+    if not hist.any():
+        return None, 0.0
+    best, best_r = None, -2.0
+    for mode, profile in (("maj", MAJOR_PROFILE), ("min", MINOR_PROFILE)):
+        for root in range(12):
+            r = float(np.corrcoef(hist, np.roll(profile, root))[0, 1])
+            if r > best_r:
+                best, best_r = f"{root}:{mode}", r
+    return best, round(best_r, 4)
+
+
+def chord_sequence(chords):
+    """Chord labels in order with repeats merged."""
+    seq = []
+    for _s, _e, label in chords:
+        if not seq or seq[-1] != label:
+            seq.append(str(label))
+    return seq
+
+
+def transpose(seq, key):
+    """Labels relative to the key's tonic."""
+    tonic = _parse(key)[0] if key else 0
+    out = []
+    for label in seq:
+        root, quality = _parse(label)
+        out.append(f"{(root - tonic) % 12}:{quality}")
+    return out
+
+
+def ngrams(seq, n):
+    """{gram: count} of the n-chord windows of `seq`."""
+    counts = {}
+    for i in range(len(seq) - n + 1):
+        gram = " ".join(seq[i:i + n])
+        counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+def energy_profile(sections, duration, bins=ENERGY_BINS):
+    """Section state at the centre of each of `bins` equal slices of the song."""
+    if not sections or not duration:
+        return []
+    centers = (np.arange(bins) + 0.5) * float(duration) / bins
+    starts = np.array([float(s) for s, _e, _st in sections])
+    states = np.array([int(st) for _s, _e, st in sections])
+    idx = np.clip(np.searchsorted(starts, centers, side="right") - 1, 0, len(states) - 1)
+    return states[idx].tolist()
+
+
+def vocal_range(pitch):
+    """
+    (low, high) MIDI pitch of a (times, f0_hz) contour, or (None, None) when
+    unvoiced or when the result is not a MIDI range (a contour that is not
+    in Hz).
+    """
+    if pitch is None:
+        return None, None
+    f0 = np.nan_to_num(np.asarray(pitch[1], dtype=float), nan=0.0)
+    f0 = f0[f0 >= MIN_VOICED_HZ]
+    if f0.size == 0:
+        return None, None
+    midi = 69.0 + 12.0 * np.log2(f0 / 440.0)
+    lo, hi = np.percentile(midi, [5, 95])
+    if lo < MIDI_RANGE[0] or hi > MIDI_RANGE[1]:
+        return None, None
+    return round(float(lo), 1), round(float(hi), 1)
+
+
+def compatible_keys(key):
+    """Keys that mix with `key`: itself, its relative, and its fifth neighbours in the same mode."""
+    root, mode = _parse(key)
+    relative = f"{(root + 9) % 12}:min" if mode == "maj" else f"{(root + 3) % 12}:maj"
+    return [key, relative, f"{(root + 7) % 12}:{mode}", f"{(root + 5) % 12}:{mode}"]
+
+
+# -------------------------
+# Index
+# -------------------------
+class SongIndex:
+    """Thin SQLite wrapper; one short-lived connection per call (safe across threads and processes)."""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else default_db()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        con = self._connect()
+        try:
+            con.executescript(_SCHEMA)
+            with con:
+                # version 1 stored ranges computed from CREPE periodicity, not f0
+                con.execute("UPDATE songs SET vocal_low = NULL, vocal_high = NULL WHERE version < 2")
+        finally:
+            con.close()
+
+    def _connect(self):
+        con = sqlite3.connect(str(self.path), timeout=30)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA journal_mode=WAL")
+        return con
+
+    def _query(self, sql, args=()):
+        con = self._connect()
+        try:
+            return con.execute(sql, args).fetchall()
+        finally:
+            con.close()
+
+    @staticmethod
+    def _song(row):
+        d = dict(row)
+        d["chords"] = json.loads(d["chords"]) if d["chords"] else []
+        d["energy"] = json.loads(d["energy"]) if d["energy"] else []
+        return d
+
+    # ---- updates ----
+    def update(self, song, analysis, pitch=None, analysis_version=None, title=None):
+        """
+        Index (or re-index) one song from its analysis dict and optional
+        (times, f0) contour. Returns the song id (sha1 of the audio). A row
+        that is already current (same versions, vocal range known or no
+        contour given) is left alone.
+        """
+        song_id = content_hash(song)
+        row = self.get(song_id)
+        if (row and row["version"] == INDEX_VERSION and row["analysis_version"] == analysis_version
+                and (pitch is None or row["vocal_low"] is not None)):
+            return song_id
+
+        chords = analysis["chords"]
+        key, key_conf = estimate_key(chords)
+        seq = chord_sequence(chords)
+        rel = transpose(seq, key)
+        low, high = vocal_range(pitch)
+        if low is None and row is not None and row["version"] == INDEX_VERSION:
+            low, high = row["vocal_low"], row["vocal_high"]
+        con = self._connect()
+        try:
+            with con:
+                con.execute(
+                    "INSERT OR REPLACE INTO songs (song, path, title, duration, tempo, key, key_conf, chords,"
+                    " energy, vocal_low, vocal_high, analysis_version, version, updated)"
+                    " VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                    (song_id, str(song), title or Path(song).stem, float(analysis["duration"]),
+                     float(analysis["tempo"]), key, key_conf, json.dumps(seq),
+                     json.dumps(energy_profile(analysis["sections"], analysis["duration"])),
+                     low, high, analysis_version, INDEX_VERSION, time.time()))
+                con.execute("DELETE FROM ngrams WHERE song=?", (song_id,))
+                con.executemany(
+                    "INSERT INTO ngrams (song, n, gram, count) VALUES (?,?,?,?)",
+                    [(song_id, n, gram, c) for n in NGRAM_SIZES for gram, c in ngrams(rel, n).items()])
+        finally:
+            con.close()
+        return song_id
+
+    def remove(self, song_id):
+        con = self._connect()
+        try:
+            with con:
+                con.execute("DELETE FROM ngrams WHERE song=?", (song_id,))
+                return con.execute("DELETE FROM songs WHERE song=?", (song_id,)).rowcount
+        finally:
+            con.close()
+
+    # ---- lookups ----
+    def get(self, song_id):
+        rows = self._query("SELECT * FROM songs WHERE song=?", (song_id,))
+        return self._song(rows[0]) if rows else None
+
+    def __len__(self):
+        return int(self._query("SELECT COUNT(*) FROM songs")[0][0])
+
+    def search(self, key=None, keys=None, tempo=None, vocal_range=None, limit=50):
+        """
+        Songs matching every given filter: `key` (label) or `keys` (list),
+        `tempo` as (min, max) bpm, `vocal_range` as (low, high) MIDI - the
+        song's range must fit inside it (ValueError outside 0..127).
+        """
+        where, args = [], []
+        keys = list(keys or []) + ([key] if key else [])
+        if keys:
+            where.append(f"key IN ({','.join('?' * len(keys))})")
+            args += keys
+        if tempo:
+            where.append("tempo BETWEEN ? AND ?")
+            args += [float(tempo[0]), float(tempo[1])]
+        if vocal_range:
+            if not MIDI_RANGE[0] <= float(vocal_range[0]) <= float(vocal_range[1]) <= MIDI_RANGE[1]:
+                raise ValueError(f"vocal range {tuple(vocal_range)} is not a MIDI range (0..127, low <= high)")
+            where.append("vocal_low >= ? AND vocal_high <= ?")
+            args += [float(vocal_range[0]), float(vocal_range[1])]
+        sql = "SELECT * FROM songs" + (" WHERE " + " AND ".join(where) if where else "")
+        return [self._song(r) for r in self._query(sql + " ORDER BY tempo LIMIT ?", args + [int(limit)])]
+
+    def compatible(self, song_id, tempo_tolerance=TEMPO_TOLERANCE, limit=50):
+        """Songs in a compatible key (compatible_keys) within the tempo tolerance, excluding the song."""
+        me = self.get(song_id)
+        if me is None or not me["key"]:
+            return []
+        t = me["tempo"]
+        rows = self.search(keys=compatible_keys(me["key"]),
+                           tempo=(t * (1 - tempo_tolerance), t * (1 + tempo_tolerance)), limit=limit + 1)
+        rows = [r for r in rows if r["song"] != song_id]
+        rows.sort(key=lambda r: abs(r["tempo"] - t))
+        return rows[:limit]
+
+    def similar_progressions(self, query, n=3, limit=10):
+        """
+        Songs ranked by cosine similarity of their transposed chord n-grams.
+        `query` is a song id in the index or a list of chord labels /
+        segments (transposed with their own estimated key).
+        """
+        if isinstance(query, str):
+            rows = self._query("SELECT gram, count FROM ngrams WHERE song=? AND n=?", (query, n))
+            q = {r["gram"]: r["count"] for r in rows}
+            exclude = query
+        else:
+            segs = [c if isinstance(c, (list, tuple)) else (0.0, 1.0, c) for c in query]
+            q = ngrams(transpose(chord_sequence(segs), estimate_key(segs)[0]), n)
+            exclude = None
+        if not q:
+            return []
+        grams = list(q)
+        con = self._connect()
+        try:
+            dots = {}
+            for i in range(0, len(grams), 500):          # SQLite's host-parameter limit
+                chunk = grams[i:i + 500]
+                for r in con.execute(
+                        f"SELECT song, gram, count FROM ngrams WHERE n=? AND gram IN ({','.join('?' * len(chunk))})",
+                        [n] + chunk):
+                    if r["song"] != exclude:
+                        dots[r["song"]] = dots.get(r["song"], 0.0) + q[r["gram"]] * r["count"]
+            if not dots:
+                return []
+            cands = list(dots)
+            norms = {}
+            for i in range(0, len(cands), 500):
+                chunk = cands[i:i + 500]
+                for r in con.execute(
+                        f"SELECT song, SUM(count * count) AS ss FROM ngrams WHERE n=? AND song IN "
+                        f"({','.join('?' * len(chunk))}) GROUP BY song", [n] + chunk):
+                    norms[r["song"]] = float(r["ss"])
+        finally:
+            con.close()
+        qn = float(np.sqrt(sum(c * c for c in q.values())))
+        ranked = sorted(((dots[s] / (qn * np.sqrt(norms[s])), s) for s in cands), reverse=True)[:limit]
+        out = []
+        for score, s in ranked:
+            row = self.get(s)
+            if row is not None:
+                row["similarity"] = round(float(score), 4)
+                out.append(row)
+        return out
+
+
+def index_song(song, analysis, pitch=None, analysis_version=None, index=None):
+    """Add a finished job's song to the catalog index (see SongIndex.update)."""
+    return (index or SongIndex()).update(song, analysis, pitch=pitch, analysis_version=analysis_version)
@@ -0,0 +1,131 @@
+# scripts/stage_graph.py
+"""
+Dependency-tracked stage graph.
+
+A pipeline run declares its stages and what each one depends on:
+
+    g = StageGraph(runner)
+    g.add("separate", separate, params={"song": song, "separation": mode})
+    g.add("melody", pick_stem, deps=["separate"], checkpoint=False)
+    g.add("vocals", autotune, deps=["melody"], params={"autotune_mode": m})
+    g.run("vocals")                  # runs separate -> melody -> vocals
+
+A stage's function gets its dependencies' outputs as positional arguments.
+Its key hashes the stage name, its parameters (a path stands for the
+content of the file, so keys do not depend on a job's output folder) and
+the keys of its dependencies: a key changes exactly when something
+upstream changed.
+
+Checkpointed stages go through the job's StageRunner with that key, which
+looks it up in the job store's stage cache, across jobs. A request that
+only changes the mixer or the style reuses the separation, vocals and
+analysis of the earlier job and recomputes arrange -> synth -> mix.
+
+Stages added with optional=True log a failure and yield None instead of
+raising (recorded in `failed`, reported as the result's warnings); their
+dependents then get a different key, so a fallback result is never reused
+for a successful run.
+"""
+
+import json
+import hashlib
+import threading
+from pathlib import Path
+
+try:
+    from scripts.audio_store import content_hash
+    from scripts.job_store import StageRunner
+except Exception:
+    from audio_store import content_hash
+    from job_store import StageRunner
+
+GRAPH_VERSION = 1      # bump when a stage's output changes for the same inputs
+
+
+def content_value(value):
+    """`value` with every existing file (or stem folder) replaced by its content hash."""
+    if isinstance(value, dict):
+        return {str(k): content_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [content_value(v) for v in value]
+    if isinstance(value, str) and value:
+        p = Path(value)
+        try:
+            if p.is_file():
+                return "sha1:" + content_hash(p)
+            if p.is_dir():
+                return {"dir": {f.name: content_hash(f) for f in sorted(p.glob("*.wav")) if f.is_file()}}
+        except OSError:
+            pass
+    return value
+
+
+class _Node:
+    __slots__ = ("name", "fn", "deps", "params", "checkpoint", "optional", "lock", "done", "key", "out")
+
+    def __init__(self, name, fn, deps, params, checkpoint, optional):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+        self.params = params or {}
+        self.checkpoint = checkpoint
+        self.optional = optional
+        self.lock = threading.Lock()
+        self.done = False
+        self.key = None
+        self.out = None
+
+
+class StageGraph:
+    """Stages of one pipeline run; run() is safe to call from several threads."""
+
+    def __init__(self, runner=None, log=print):
+        self.runner = runner or StageRunner()
+        self.log = log
+        self.nodes = {}
+        self.failed = {}        # optional stage -> error message
+
+    def add(self, name, fn, deps=(), params=None, checkpoint=True, optional=False):
+        """Declare a stage. Dependencies must be added first (the graph stays acyclic)."""
+        missing = [d for d in deps if d not in self.nodes]
+        if missing:
+            raise KeyError(f"stage {name}: unknown dependencies {missing}")
+        if name in self.nodes:
+            raise KeyError(f"stage {name} already declared")
+        self.nodes[name] = _Node(name, fn, deps, params, checkpoint, optional)
+        return name
+
+    def key(self, name):
+        """Key of a stage that has run (its dependencies' keys are part of it)."""
+        return self.nodes[name].key
+
+    def _key(self, node):
+        blob = json.dumps({"stage": node.name, "v": GRAPH_VERSION,
+                           "params": content_value(node.params),
+                           "deps": [self.nodes[d].key for d in node.deps]},
+                          sort_keys=True, default=str)
+        return hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+    def run(self, name):
+        """Output of stage `name`, running it and its dependencies as needed."""
+        node = self.nodes[name]
+        args = [self.run(d) for d in node.deps]
+        with node.lock:
+            if node.done:
+                return node.out
+            node.key = self._key(node)
+            fn = lambda: node.fn(*args)
+            try:
+                if node.checkpoint:
+                    node.out = self.runner(name, fn, cache_key=node.key)
+                else:
+                    node.out = fn()
+            except Exception as e:   # JobCancelled is not an Exception: a cancel still propagates
+                if not node.optional:
+                    raise
+                self.log(f"[STAGE] {name} failed: {e}")
+                self.failed[name] = str(e)
+                node.out = None
+                node.key = hashlib.sha1((node.key + ":failed").encode("utf-8")).hexdigest()
+            node.done = True
+            return node.out
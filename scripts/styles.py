@@ -0,0 +1,372 @@
+# scripts/styles.py
+"""
+Arrangement styles as declarative templates.
+
+A style is a list of parts; each part names a pattern generator and the
+track it writes to:
+
+    {
+        "aliases": ["lo-fi"],
+        "mixer": {"piano": 0.8, "bass": 0.9, "synth": 0.9, "drums": 0.6},
+        "parts": [
+            {"pattern": "comp", "name": "Piano", "program": 0, "velocity": 58, "mixer": "piano"},
+            {"pattern": "pad", "name": "Pad", "program": 89, "velocity": 46, "mixer": "synth"},
+            {"pattern": "drums", "name": "Drums", "drum": True, "velocity": 0.5, "mixer": "drums"},
+        ],
+    }
+
+Part keys:
+    pattern    generator name (PATTERNS: comp, pad, strum, bass, drums; more
+               with register_pattern)
+    name       track name; program: GM program; drum: drum track
+    velocity   base velocity (melodic), multiplied by mixer[<mixer>] and
+               clamped to 1..127; drums: factor on the groove's velocities
+    curve      optional velocity factors for energy states 0 / 1 / 2
+    octave     melodic parts: transpose by whole octaves
+    groove     drums: drum_engine groove name (default 'poprock')
+
+Templates are compiled once per process into per-part column arrays and
+generator functions (every generator works on all chords of a song at once
+and fills a Track with one add_notes call), so adding a style costs nothing
+per job. Styles come from STYLE_TEMPLATES, register_style(), and *.json
+template files in HARMONIA_STYLES_DIR (default <project>/styles), loaded on
+first use; none of them need a change to harmonia_pop_pipeline.
+
+Usage:
+    style = get_style("lofi")
+    style.arrange(analysis, "arranged.mid", tempo=tempo, beats=beats, mixer=mixer, seed=seed)
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from scripts.drum_engine import drum_events, section_states
+    from scripts.midi_writer import MidiSong
+except Exception:
+    from drum_engine import drum_events, section_states
+    from midi_writer import MidiSong
+
+LOG = logging.getLogger("harmonica")
+
+ROOT = Path(__file__).resolve().parents[1]
+DEFAULT_STYLES_DIR = ROOT / "styles"
+DEFAULT_STYLE = "poprock"
+
+# -------------------------
+# Built-in styles (the four arrangers the pipeline has always had)
+# -------------------------
+STYLE_TEMPLATES = {
+    "poprock": {
+        "aliases": ["pop-rock", "pop"],
+        "mixer": {"piano": 0.6, "guitar": 1.5, "bass": 1.25, "synth": 0.95, "drums": 2.0},
+        "parts": [
+            {"pattern": "comp", "name": "Piano", "program": 0, "velocity": 40, "mixer": "piano"},
+            {"pattern": "strum", "name": "Guitar", "program": 24, "velocity": 95, "mixer": "guitar"},
+            {"pattern": "bass", "name": "Bass", "program": 32, "velocity": 85, "mixer": "bass"},
+            {"pattern": "pad", "name": "Synth", "program": 88, "velocity": 55, "mixer": "synth"},
+            {"pattern": "drums", "name": "Drums", "drum": True, "velocity": 1.9, "mixer": "drums"},
+        ],
+    },
+    "edm": {
+        "aliases": ["edmpop"],
+        "mixer": {"piano": 0.6, "guitar": 0.6, "bass": 1.1, "synth": 1.4, "drums": 1.4},
+        "parts": [
+            {"pattern": "pad", "name": "LeadSynth", "program": 81, "velocity": 78, "mixer": "synth"},
+            {"pattern": "bass", "name": "Bass", "program": 38, "velocity": 100, "mixer": "bass"},
+            {"pattern": "drums", "name": "Drums", "drum": True, "velocity": 1.6, "mixer": "drums"},
+        ],
+    },
+    "bollywood": {
+        "aliases": ["bolly"],
+        "mixer": {"piano": 1.0, "guitar": 0.9, "bass": 0.9, "synth": 0.8, "drums": 0.8},
+        "parts": [
+            {"pattern": "comp", "name": "Piano", "program": 0, "velocity": 66, "mixer": "piano"},
+            {"pattern": "strum", "name": "Guitar", "program": 25, "velocity": 76, "mixer": "guitar"},
+            {"pattern": "bass", "name": "Bass", "program": 32, "velocity": 88, "mixer": "bass"},
+            {"pattern": "pad", "name": "Pad", "program": 89, "velocity": 64, "mixer": "synth"},
+            {"pattern": "drums", "name": "Drums", "drum": True, "velocity": 0.75, "mixer": "drums"},
+        ],
+    },
+    "lofi": {
+        "aliases": ["lo-fi"],
+        "mixer": {"piano": 0.8, "guitar": 0.0, "bass": 0.9, "synth": 0.9, "drums": 0.6},
+        "parts": [
+            {"pattern": "comp", "name": "Piano", "program": 0, "velocity": 58, "mixer": "piano"},
+            {"pattern": "bass", "name": "Bass", "program": 34, "velocity": 72, "mixer": "bass"},
+            {"pattern": "pad", "name": "Pad", "program": 89, "velocity": 46, "mixer": "synth"},
+            {"pattern": "drums", "name": "Drums", "drum": True, "velocity": 0.5, "mixer": "drums"},
+        ],
+    },
+}
+
+_PART_DEFAULTS = {"name": "", "program": 0, "drum": False, "velocity": 80, "mixer": None,
+                  "curve": None, "octave": 0, "groove": "poprock"}
+
+
+def clamp_velocity(v):
+    """Round and clip velocities to the MIDI range 1..127."""
+    return np.clip(np.round(np.asarray(v, dtype=float)), 1, 127).astype(int)
+
+
+# -------------------------
+# Pattern generators
+# Each takes (song, part, velocity, rng) and returns (pitch, start, end, vel)
+# arrays. `song` holds the chords as columns (start, end, root, third), the
+# beat grid, sections, duration and tempo; `velocity` is the part's base
+# velocity after the mixer (drums: the factor).
+# -------------------------
+PATTERNS = {}
+
+
+def register_pattern(name, fn=None):
+    """Add a pattern generator (usable as a decorator)."""
+    if fn is None:
+        return lambda f: register_pattern(name, f)
+    PATTERNS[name] = fn
+    return fn
+
+
+def _triads(song, octave=0):
+    """(chords x 3) triad pitches from C4, transposed by `octave`."""
+    base = 60 + song["root"] + 12 * octave
+    return np.stack([base, base + song["third"], base + 7], axis=1)
+
+
+@register_pattern("comp")
+def comp_pattern(song, part, velocity, rng):
+    """Sustained block chords, onsets and releases humanized by up to 30 ms."""
+    pitch = _triads(song, part["octave"])
+    n = pitch.shape[0]
+    st = song["start"][:, None] + rng.uniform(0.0, 0.03, (n, 3))
+    en = song["end"][:, None] - rng.uniform(0.0, 0.03, (n, 3))
+    return pitch.ravel(), st.ravel(), np.maximum(en, st + 0.05).ravel(), np.full(3 * n, velocity)
+
+
+@register_pattern("pad")
+def pad_pattern(song, part, velocity, rng):
+    """Chords held over the whole segment, an octave up."""
+    pitch = _triads(song, part["octave"] + 1)
+    n = pitch.shape[0]
+    return (pitch.ravel(), np.repeat(song["start"], 3), np.repeat(song["end"], 3),
+            np.full(3 * n, velocity))
+
+
+@register_pattern("strum")
+def strum_pattern(song, part, velocity, rng):
+    """
+    Quick root-third-fifth arpeggios an octave down; on every other beat of
+    the chord with a beat grid, else every max(0.5 s, half the chord).
+    """
+    s, e = song["start"], song["end"]
+    beats = song["beats"]
+    if beats is not None and beats.size:
+        lo = np.searchsorted(beats, s)
+        hi = np.searchsorted(beats, e)
+        count = (hi - lo + 1) // 2
+        on_beat = count > 0
+        count = np.where(on_beat, count, 1)          # no beat inside: one strum at the chord start
+        chord = np.repeat(np.arange(s.size), count)
+        k = np.arange(chord.size) - np.repeat(np.cumsum(count) - count, count)
+        idx = np.minimum(lo[chord] + 2 * k, max(beats.size - 1, 0))
+        times = np.where(on_beat[chord], beats[idx], s[chord])
+    else:
+        step = np.maximum(0.5, (e - s) / 2.0)
+        count = np.where(e > s, np.ceil((e - s) / step), 0).astype(int)
+        chord = np.repeat(np.arange(s.size), count)
+        k = np.arange(chord.size) - np.repeat(np.cumsum(count) - count, count)
+        times = s[chord] + k * step[chord]
+    root = 48 + song["root"][chord] + 12 * part["octave"]
+    pitch = root[:, None] + np.array([0, 4, 7])
+    st = times[:, None] + np.arange(3) * 0.06 + rng.uniform(-0.01, 0.01, pitch.shape)
+    en = st + 0.08 + rng.uniform(0.0, 0.02, pitch.shape)
+    return pitch.ravel(), st.ravel(), en.ravel(), np.full(pitch.size, velocity)
+
+
+@register_pattern("bass")
+def bass_pattern(song, part, velocity, rng):
+    """Root for half a second at each chord, a passing second on chords longer than 1 s."""
+    s, e = song["start"], song["end"]
+    root = 48 + song["root"] + 12 * part["octave"]
+    st = s + rng.uniform(0.0, 0.02, s.size)
+    long_ = (e - s) > 1.0
+    pitch = np.concatenate((root, root[long_] + 2))
+    start = np.concatenate((st, s[long_] + 0.5))
+    end = np.concatenate((np.minimum(e, s + 0.5), np.minimum(e[long_], s[long_] + 1.0)))
+    vel = np.concatenate((np.full(s.size, velocity), np.full(int(long_.sum()), max(velocity - 8, 8))))
+    return pitch, start, end, vel
+
+
+@register_pattern("drums")
+def drum_pattern(song, part, factor, rng):
+    """drum_engine groove over the song's sections; velocities scaled by `factor`."""
+    ev = drum_events(song["duration"], song["sections"], tempo=song["tempo"], groove=part["groove"],
+                     default_state=2, beats=song["beats"], rng=song["drum_rng"])
+    return ev["pitch"], ev["start"], ev["end"], ev["vel"] * factor
+
+
+# -------------------------
+# Compiled styles
+# -------------------------
+def _chord_columns(chords):
+    """Chord segments -> (start, end, root, third) arrays; unparsable labels play C major."""
+    n = len(chords)
+    start = np.fromiter((float(c[0]) for c in chords), dtype=float, count=n)
+    end = np.fromiter((float(c[1]) for c in chords), dtype=float, count=n)
+    root = np.zeros(n, dtype=int)
+    third = np.full(n, 4, dtype=int)
+    for i, (_s, _e, label) in enumerate(chords):
+        try:
+            r, q = str(label).split(":")
+            root[i] = int(r)
+            third[i] = 4 if q == "maj" else 3
+        except ValueError:
+            pass
+    return start, end, root, third
+
+
+class Style:
+    """A compiled style template; immutable and shared by every job."""
+
+    def __init__(self, name, template):
+        if not isinstance(template, dict):
+            raise ValueError(f"style {name!r}: template must be an object")
+        parts = template.get("parts") or []
+        if not parts:
+            raise ValueError(f"style {name!r} has no parts")
+        self.name = name
+        self.aliases = [str(a).lower() for a in template.get("aliases", [])]
+        self.mixer = dict(template.get("mixer") or {})
+        self.parts = []
+        for p in parts:
+            p = {**_PART_DEFAULTS, **p}
+            if p.get("pattern") not in PATTERNS:
+                raise ValueError(f"style {name!r}: unknown pattern {p.get('pattern')!r}")
+            p["fn"] = PATTERNS[p["pattern"]]
+            try:
+                p["program"] = int(p["program"])
+                p["velocity"] = float(p["velocity"])
+                p["octave"] = int(p["octave"])
+                p["curve"] = None if p["curve"] is None else np.asarray(p["curve"], dtype=float)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"style {name!r}: part {p.get('name')!r}: {e}") from None
+            if not 0 <= p["program"] <= 127:
+                raise ValueError(f"style {name!r}: program {p['program']} outside 0..127")
+            if p["curve"] is not None and p["curve"].shape != (3,):
+                raise ValueError(f"style {name!r}: curve needs one factor per energy state (3)")
+            self.parts.append(p)
+        # changes whenever the template does: part of the arrange stage's cache key
+        blob = json.dumps({"name": name, "template": template}, sort_keys=True, default=str)
+        self.fingerprint = hashlib.sha1(blob.encode("utf-8")).hexdigest()
+
+    def arrange(self, analysis, out_midi, tempo, beats=None, mixer=None, seed=None):
+        """Write the arrangement of `analysis` (song_analysis dict) to out_midi."""
+        mixer = self.mixer if mixer is None else mixer
+        start, end, root, third = _chord_columns(analysis["chords"])
+        song = {
+            "start": start, "end": end, "root": root, "third": third,
+            "beats": None if beats is None else np.asarray(beats, dtype=float),
+            "sections": analysis["sections"],
+            "duration": float(analysis["duration"]),
+            "tempo": float(tempo),
+            # drums draw from their own stream seeded with `seed`, melodic parts from [seed, 1]
+            "drum_rng": None if seed is None else np.random.default_rng(seed),
+        }
+        rng = np.random.default_rng(None if seed is None else [int(seed), 1])
+        midi = MidiSong(initial_tempo=tempo)
+        for p in self.parts:
+            gain = float(mixer.get(p["mixer"], 1.0)) if p["mixer"] else 1.0
+            velocity = p["velocity"] * gain if p["drum"] else int(clamp_velocity(int(p["velocity"] * gain)))
+            pitch, st, en, vel = p["fn"](song, p, velocity, rng)
+            if p["curve"] is not None and len(st):
+                vel = vel * p["curve"][section_states(st, song["sections"])]
+            track = midi.track(program=p["program"], name=p["name"], is_drum=p["drum"])
+            track.add_notes(pitch, st, en, clamp_velocity(vel))
+        # empty melodic tracks are left out; the drum track is always written
+        midi.instruments = [t for t in midi.instruments if len(t) or t.is_drum]
+        midi.write(out_midi)
+        return out_midi
+
+
+_REGISTRY = {}          # name -> Style
+_ALIASES = {}           # alias -> name
+_LOCK = threading.RLock()
+_LOADED = False
+
+
+def styles_dir():
+    return Path(os.environ.get("HARMONIA_STYLES_DIR") or DEFAULT_STYLES_DIR)
+
+
+def register_style(name, template):
+    """Add or replace a style (compiled now). Returns the compiled Style."""
+    name = str(name).lower()
+    style = Style(name, template)
+    with _LOCK:
+        old = _REGISTRY.get(name)
+        if old is not None:
+            for a in old.aliases:
+                _ALIASES.pop(a, None)
+        STYLE_TEMPLATES[name] = template
+        _REGISTRY[name] = style
+        for a in style.aliases:
+            _ALIASES[a] = name
+    return style
+
+
+def load_style_dir(path=None):
+    """
+    Register every <name>.json template in `path`; returns the names loaded.
+    A file that does not parse or compile is logged and skipped.
+    """
+    loaded = []
+    for f in sorted(Path(path or styles_dir()).glob("*.json")):
+        try:
+            with open(f, "r", encoding="utf-8") as fh:
+                template = json.load(fh)
+            if not isinstance(template, dict):
+                raise ValueError("template must be an object")
+            register_style(template.pop("name", f.stem), template)
+        except Exception as e:      # user files: any bad value skips the file, never the registry
+            LOG.warning("[STYLES] skipped %s: %s", f, e)
+            continue
+        loaded.append(f.stem)
+    return loaded
+
+
+def _ensure_loaded():
+    global _LOADED
+    if _LOADED:
+        return
+    with _LOCK:         # styles are rendered from several threads at once
+        if _LOADED:
+            return
+        for name, template in list(STYLE_TEMPLATES.items()):
+            if name not in _REGISTRY:
+                register_style(name, template)
+        try:
+            if styles_dir().is_dir():
+                load_style_dir()
+        except OSError as e:
+            LOG.warning("[STYLES] style dir unreadable: %s", e)
+        _LOADED = True
+
+
+def get_style(name=None):
+    """Compiled style for a name or alias, falling back to 'poprock'."""
+    _ensure_loaded()
+    key = (name or DEFAULT_STYLE).lower()
+    key = _ALIASES.get(key, key)
+    return _REGISTRY.get(key) or _REGISTRY[DEFAULT_STYLE]
+
+
+def available_styles():
+    """{name: [aliases]} of every registered style."""
+    _ensure_loaded()
+    return {name: list(s.aliases) for name, s in _REGISTRY.items()}
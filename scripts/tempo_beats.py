@@ -0,0 +1,133 @@
+# scripts/tempo_beats.py
+"""
+Tempo estimation and beat grid.
+
+- onset strength envelope (librosa mel flux) at a coarse hop
+- tempo from the FFT autocorrelation of the envelope, weighted by a
+  log-normal prior around 120 BPM to avoid octave errors
+- beat grid: best (period, phase) comb over the envelope, then each beat is
+  snapped to the strongest onset within a small window
+
+All steps are vectorized; the autocorrelation only looks at a bounded
+excerpt (TEMPO_MAX_SEC) so the cost stays a small, fixed fraction of the run.
+
+Usage:
+    from tempo_beats import analyze_tempo
+    tempo, beats = analyze_tempo(y, sr)      # bpm, beat times (s)
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+import librosa
+
+DEFAULT_TEMPO = 120
+ONSET_HOP = 256            # samples; 16 ms at 16 kHz
+BPM_MIN = 60.0
+BPM_MAX = 200.0
+PRIOR_BPM = 120.0
+PRIOR_OCTAVES = 1.0        # std-dev of the log2 tempo prior
+TEMPO_MAX_SEC = 90.0       # excerpt length used for the autocorrelation
+COMB_MAX_BEATS = 512       # beats scored per (period, phase) candidate
+SNAP_FRACTION = 0.1        # beats may move +/- this fraction of a period
+
+
+def onset_envelope(y: np.ndarray, sr: int, hop_length: int = ONSET_HOP) -> np.ndarray:
+    env = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length)
+    env = np.asarray(env, dtype=np.float64)
+    env -= env.mean() if env.size else 0.0
+    np.maximum(env, 0.0, out=env)
+    return env
+
+
+def _autocorrelation(x: np.ndarray, max_lag: int) -> np.ndarray:
+    n = x.size
+    nfft = 1 << int(np.ceil(np.log2(2 * n - 1)))
+    spec = np.fft.rfft(x, nfft)
+    ac = np.fft.irfft(spec * np.conj(spec), nfft)[:max_lag + 1]
+    # unbiased: divide by the number of overlapping samples
+    return ac / np.arange(n, n - max_lag - 1, -1, dtype=np.float64)
+
+
+def estimate_tempo(env: np.ndarray, fps: float, bpm_min: float = BPM_MIN, bpm_max: float = BPM_MAX,
+                   prior_bpm: float = PRIOR_BPM, max_sec: float = TEMPO_MAX_SEC) -> Optional[float]:
+    """Tempo in BPM from an onset envelope, or None if the envelope is too short/flat."""
+    max_frames = int(max_sec * fps)
+    if env.size > max_frames:
+        mid = (env.size - max_frames) // 2
+        env = env[mid:mid + max_frames]
+    lag_min = max(1, int(np.floor(60.0 * fps / bpm_max)))
+    lag_max = int(np.ceil(60.0 * fps / bpm_min))
+    if env.size < 2 * lag_max or not np.any(env > 0):
+        return None
+    ac = _autocorrelation(env, lag_max)
+    lags = np.arange(lag_min, lag_max + 1)
+    bpms = 60.0 * fps / lags
+    weight = np.exp(-0.5 * (np.log2(bpms / prior_bpm) / PRIOR_OCTAVES) ** 2)
+    score = ac[lags] * weight
+    best = int(np.argmax(score))
+    if score[best] <= 0:
+        return None
+    # parabolic interpolation for a sub-frame lag
+    lag = float(lags[best])
+    if 0 < best < len(score) - 1:
+        a, b, c = score[best - 1], score[best], score[best + 1]
+        den = a - 2 * b + c
+        if abs(den) > 1e-12:
+            lag += 0.5 * (a - c) / den
+    return float(60.0 * fps / lag)
+
+
+def track_beats(env: np.ndarray, fps: float, tempo: float, duration: float) -> np.ndarray:
+    """Beat times (s) for a near-constant tempo: comb search over period/phase + local snap."""
+    period0 = 60.0 * fps / float(tempo)
+    n_frames = env.size
+    if n_frames < 2 or period0 <= 0:
+        return np.arange(0.0, duration, 60.0 / float(tempo))
+
+    # (periods x phases x beats) comb scores
+    periods = period0 * np.linspace(0.98, 1.02, 21)
+    phases = np.arange(int(np.ceil(period0)), dtype=np.float64)
+    n_beats = min(int(n_frames / periods.min()) + 1, COMB_MAX_BEATS)
+    k = np.arange(n_beats, dtype=np.float64)
+    pos = phases[None, :, None] + periods[:, None, None] * k[None, None, :]
+    idx = np.rint(pos).astype(np.int64)
+    valid = idx < n_frames
+    comb = np.where(valid, env[np.minimum(idx, n_frames - 1)], 0.0)
+    score = comb.sum(axis=2) / np.maximum(valid.sum(axis=2), 1)
+    pi, phi = np.unravel_index(int(np.argmax(score)), score.shape)
+    period = periods[pi]
+    grid = phases[phi] + period * np.arange(int((n_frames - phases[phi]) / period) + 1)
+    grid = grid[grid < n_frames]
+
+    # snap each beat to the local envelope maximum
+    half = max(1, int(round(SNAP_FRACTION * period)))
+    padded = np.pad(env, half, mode="constant")
+    win = np.lib.stride_tricks.sliding_window_view(padded, 2 * half + 1)
+    centers = np.rint(grid).astype(np.int64)
+    local = win[centers]
+    offset = np.argmax(local, axis=1) - half
+    flat = local.max(axis=1) <= 0
+    offset[flat] = 0
+    frames = np.clip(centers + offset, 0, n_frames - 1)
+    beats = np.unique(frames) / fps
+    return beats[beats < duration]
+
+
+def analyze_tempo(y: np.ndarray, sr: int, hop_length: int = ONSET_HOP,
+                  default_tempo: float = DEFAULT_TEMPO) -> Tuple[float, np.ndarray]:
+    """Return (tempo_bpm, beat_times). Falls back to a fixed grid at default_tempo."""
+    duration = float(len(y)) / sr
+    fps = sr / float(hop_length)
+    tempo = None
+    env = np.zeros(0)
+    if len(y) >= hop_length * 4:
+        env = onset_envelope(y, sr, hop_length=hop_length)
+        tempo = estimate_tempo(env, fps)
+    if tempo is None:
+        return float(default_tempo), np.arange(0.0, duration, 60.0 / float(default_tempo))
+    beats = track_beats(env, fps, tempo, duration)
+    if beats.size > 2:
+        # report the tempo the grid actually follows
+        tempo = 60.0 / float(np.median(np.diff(beats)))
+    return round(float(tempo), 2), beats
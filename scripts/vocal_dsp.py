@@ -0,0 +1,72 @@
+# scripts/vocal_dsp.py
+"""
+Fused vocal DSP stage used by process_vocals.
+
+- nonsilent_mask(): silence trimming as one boolean keep-mask built from the
+  librosa.effects.split intervals (vectorized), gathered once instead of
+  slicing and concatenating every interval
+- stretch_shift(): time stretch and pitch shift from a single STFT; the
+  phase vocoder runs at rate / pitch_ratio and one resample brings the pitch
+  back, instead of separate time_stretch + pitch_shift round trips
+- finalize(): normalize, gain and clip in place before the single write
+"""
+
+import numpy as np
+import librosa
+
+N_FFT = 2048
+HOP = 512
+
+
+def nonsilent_mask(y: np.ndarray, top_db: float = 30, frame_length: int = 2048,
+                   hop_length: int = 512) -> np.ndarray:
+    """Boolean mask of the samples librosa.effects.split keeps (all True if nothing found)."""
+    n = len(y)
+    intervals = librosa.effects.split(y, top_db=top_db, frame_length=frame_length, hop_length=hop_length)
+    if len(intervals) == 0:
+        return np.ones(n, dtype=bool)
+    intervals = np.clip(np.asarray(intervals, dtype=np.int64), 0, n)
+    marks = np.zeros(n + 1, dtype=np.int32)
+    np.add.at(marks, intervals[:, 0], 1)
+    np.add.at(marks, intervals[:, 1], -1)
+    return np.cumsum(marks[:-1]) > 0
+
+
+def stretch_shift(y: np.ndarray, sr: int, rate: float = 1.0, n_steps: float = 0.0,
+                  n_fft: int = N_FFT, hop_length: int = HOP) -> np.ndarray:
+    """
+    Time-stretch by `rate` (>1 = faster) and pitch-shift by `n_steps` semitones
+    with one STFT / phase vocoder / ISTFT round trip plus at most one resample.
+    """
+    rate = float(rate)
+    ratio = float(2.0 ** (float(n_steps) / 12.0))
+    if abs(rate - 1.0) < 1e-3 and abs(ratio - 1.0) < 1e-4:
+        return y
+    if len(y) < n_fft:
+        return y
+    D = librosa.stft(y, n_fft=n_fft, hop_length=hop_length)
+    pv_rate = rate / ratio
+    if abs(pv_rate - 1.0) >= 1e-6:
+        D = librosa.phase_vocoder(D, rate=pv_rate, hop_length=hop_length)
+    out_len = int(round(len(y) * ratio / rate))
+    y_out = librosa.istft(D, hop_length=hop_length, length=out_len)
+    if abs(ratio - 1.0) >= 1e-4:
+        # stretched by `ratio`; squeeze back by resampling sr * ratio -> sr (raises pitch by ratio)
+        y_out = librosa.resample(y_out, orig_sr=float(sr) * ratio, target_sr=sr)
+        y_out = librosa.util.fix_length(y_out, size=int(round(len(y) / rate)))
+    return y_out.astype(np.float32, copy=False)
+
+
+def finalize(y: np.ndarray, peak: float = 0.95, gain: float = 1.0) -> np.ndarray:
+    """Peak-normalize to `peak`, apply `gain` and clip to [-1, 1], in place."""
+    y = np.asarray(y, dtype=np.float32)
+    if not y.flags.writeable:
+        # read-only view from the audio store
+        y = y.copy()
+    maxv = float(np.max(np.abs(y))) if y.size else 0.0
+    if maxv >= 1e-9:
+        y *= np.float32(peak / (maxv + 1e-9) * gain)
+    else:
+        y *= np.float32(gain)
+    np.clip(y, -1.0, 1.0, out=y)
+    return y
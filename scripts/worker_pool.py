@@ -0,0 +1,140 @@
+# scripts/worker_pool.py
+"""
+Model warm-up and an optional prefork worker pool for the backend.
+
+Importing this module is cheap: librosa, torch and torchcrepe are only
+imported inside warm_models(), which
+  - imports the pipeline (librosa, pretty_midi, soundfile, scipy)
+  - loads the CREPE weights once with a tiny dummy prediction
+  - triggers librosa's numba JIT on a short signal
+so the first real job does not pay for any of it.
+
+WorkerPool keeps N processes alive; each one runs warm_models() in its
+initializer and then serves full_run jobs, so models are loaded once per
+worker instead of once per request.
+
+    HARMONIA_WORKERS=0   run jobs in the server process (default)
+    HARMONIA_WORKERS=N   prefork N warm worker processes, each pinned to its
+                         share of the CPUs (see resources.py)
+"""
+
+import os
+import sys
+import time
+import logging
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, Future
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))
+
+try:
+    from scripts.resources import set_thread_env, apply_thread_budget
+except Exception:
+    from resources import set_thread_env, apply_thread_budget
+
+LOG = logging.getLogger("harmonica")
+
+# warm-up timings (seconds) of this process, filled by warm_models()
+WARM_TIMINGS = {}
+
+
+def _import_pipeline():
+    try:
+        from scripts import harmonia_pop_pipeline as pipeline
+    except Exception:
+        import harmonia_pop_pipeline as pipeline
+    return pipeline
+
+
+def warm_models(crepe=True):
+    """Import heavy modules and load model weights. Returns per-step timings."""
+    t0 = time.perf_counter()
+    pipeline = _import_pipeline()
+    WARM_TIMINGS["import_pipeline"] = time.perf_counter() - t0
+
+    import numpy as np
+    t1 = time.perf_counter()
+    try:
+        y = np.zeros(16000, dtype=np.float32)
+        y[::400] = 1.0
+        pipeline.librosa.onset.onset_strength(y=y, sr=16000)
+        pipeline.librosa.feature.chroma_stft(y=y, sr=16000)
+    except Exception as e:
+        LOG.warning("[WARMUP] librosa warm-up failed: %s", e)
+    WARM_TIMINGS["librosa_jit"] = time.perf_counter() - t1
+
+    if crepe:
+        t2 = time.perf_counter()
+        try:
+            import torch
+            try:
+                from scripts.pitch_extract import _safe_crepe_predict
+            except Exception:
+                from pitch_extract import _safe_crepe_predict
+            _safe_crepe_predict(torch.zeros(1, 16000), sr=16000, hop_length=160)
+        except Exception as e:
+            LOG.warning("[WARMUP] crepe warm-up failed: %s", e)
+        WARM_TIMINGS["crepe_load"] = time.perf_counter() - t2
+
+    WARM_TIMINGS["total"] = time.perf_counter() - t0
+    return dict(WARM_TIMINGS)
+
+
+def run_full(song, out_dir, **kwargs):
+    """Entry point executed inside a worker (or in-process)."""
+    return _import_pipeline().full_run(song, out_dir, **kwargs)
+
+
+def _worker_init(threads=None):
+    # pin thread pools before torch / BLAS are imported so they start at the budget
+    if threads:
+        set_thread_env(threads)
+    warm_models()
+    if threads:
+        apply_thread_budget(threads)
+
+
+def _ping():
+    return os.getpid(), dict(WARM_TIMINGS)
+
+
+class WorkerPool:
+    """Prefork pool of warm pipeline workers."""
+
+    def __init__(self, workers, threads_per_worker=None):
+        self.workers = max(1, int(workers))
+        self.threads_per_worker = threads_per_worker
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_worker_init,
+                                         initargs=(threads_per_worker,))
+        self.ready = False
+        self.startup_seconds = None
+
+    def prewarm(self):
+        """Start every worker and block until each has loaded its models."""
+        t0 = time.perf_counter()
+        # ping until every worker process has answered (a worker only takes
+        # tasks once its initializer - the model warm-up - has finished)
+        info = {}
+        while len(info) < self.workers:
+            futs = [self._pool.submit(_ping) for _ in range(self.workers)]
+            for f in futs:
+                pid, timings = f.result()
+                info[pid] = timings
+        self.startup_seconds = time.perf_counter() - t0
+        self.ready = True
+        return info
+
+    def submit(self, song, out_dir, **kwargs) -> Future:
+        return self._pool.submit(run_full, song, out_dir, **kwargs)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def configured_workers():
+    try:
+        return max(0, int(os.environ.get("HARMONIA_WORKERS", "0")))
+    except ValueError:
+        return 0